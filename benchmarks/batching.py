@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Load generator for the micro-batching scheduler. A stub model stands in for
+Whisper, its cost per call is `overhead + per_item * batch_size`, which is
+roughly how a batched encoder/decoder behaves on a GPU.
+
+运行方式:
+    python3 -m benchmarks.batching --clients 32 --requests 20
+"""
+import asyncio
+import time
+
+import numpy as np
+
+from src.batching import BatchScheduler
+
+
+class StubBatchModel:
+    def __init__(self, overhead: float = 0.05, per_item: float = 0.005):
+        self.overhead = overhead
+        self.per_item = per_item
+
+    def __call__(self, items):
+        time.sleep(self.overhead + self.per_item * len(items))
+        return ['text'] * len(items)
+
+
+async def _run(scheduler: BatchScheduler, clients: int, requests: int):
+    latencies = []
+
+    async def client():
+        for _ in range(requests):
+            start_time = time.perf_counter()
+            await scheduler.submit(b'')
+            latencies.append(time.perf_counter() - start_time)
+
+    await scheduler.start()
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    elapsed = time.perf_counter() - start_time
+    await scheduler.stop()
+    return np.array(latencies), elapsed
+
+
+def bench(clients: int = 32,
+          requests: int = 20,
+          batch_size: int = 8,
+          delay_ms: float = 10,
+          overhead: float = 0.05,
+          per_item: float = 0.005):
+    model = StubBatchModel(overhead, per_item)
+    for name, size in (('off', 1), ('on', batch_size)):
+        scheduler = BatchScheduler(model,
+                                   max_batch_size=size,
+                                   max_queue_delay=delay_ms / 1000,
+                                   max_queue_size=clients)
+        latencies, elapsed = asyncio.run(_run(scheduler, clients, requests))
+        print(f"batching {name:>3}: "
+              f"p50 {np.percentile(latencies, 50) * 1000:8.1f} ms  "
+              f"p99 {np.percentile(latencies, 99) * 1000:8.1f} ms  "
+              f"{len(latencies) / elapsed:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
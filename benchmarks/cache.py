@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Cost of a result cache hit: fingerprinting the decoded audio plus the
+lookup, against the transcription it replaces. Also checks that the
+local tier stays within its byte budget under churn.
+
+运行方式:
+    python3 -m benchmarks.cache --seconds 30
+    python3 -m benchmarks.cache --url redis://localhost:6379/0  # redis tier
+"""
+import asyncio
+import time
+import typing
+
+import numpy as np
+
+from src.cache import ResultCache, fingerprint
+
+RATE = 16000
+
+
+async def run(seconds: float, entries: int, max_bytes: int,
+              url: typing.Optional[str]):
+    redis = None
+    if url is not None:
+        import aioredis
+        redis = aioredis.from_url(url)
+    cache = ResultCache(max_bytes, redis=redis, ttl=60)
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 0.1, int(seconds * RATE)).astype(np.float32)
+    settings = dict(model='base', prompt='', language=None, beam_size=5,
+                    vad_filter=True)
+    result = [{'start': 0.0, 'end': seconds, 'text': ' hello' * 50}]
+
+    n = 200
+    start_time = time.perf_counter()
+    for _ in range(n):
+        key = fingerprint(audio, **settings)
+    hashing = (time.perf_counter() - start_time) / n
+    await cache.set(key, result)
+    start_time = time.perf_counter()
+    for _ in range(n):
+        assert await cache.get(key) is not None
+    lookup = (time.perf_counter() - start_time) / n
+    print(f"{seconds:.0f}s clip: fingerprint {hashing * 1e6:.0f} us, "
+          f"lookup {lookup * 1e6:.1f} us, hit total "
+          f"{(hashing + lookup) * 1e3:.2f} ms")
+
+    if redis is not None:
+        cache.clear()
+        start_time = time.perf_counter()
+        assert await cache.get(key) is not None
+        print(f"  redis tier hit {(time.perf_counter() - start_time) * 1e3:.2f}"
+              f" ms")
+
+    for i in range(entries):
+        await cache.set(str(i), result)
+        assert cache.size <= max_bytes
+    print(f"  after {entries} inserts: {cache.stats()}")
+    if redis is not None:
+        await redis.close()
+
+
+def bench(seconds: float = 30.0,
+          entries: int = 100000,
+          max_bytes: int = 16 * 1024 * 1024,
+          url: typing.Optional[str] = None):
+    asyncio.run(run(seconds, entries, max_bytes, url))
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
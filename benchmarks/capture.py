@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Audio lost while the consumer is busy, with and without the ring buffer.
+
+A WAV file (synthetic speech bursts unless `--wav` is given) is replayed
+through WavReplay at real-time rate, `--speed` times faster if asked. The
+consumer reads 30 ms frames, segments them and then stalls for `--stall`
+seconds per utterance, like a blocking transcribe or ChatGPT call. A
+`device` buffer of a few chunks stands for the old blocking stream.read,
+where PortAudio's small internal buffer overflowed during the stall.
+
+Without overflows the audio read back must be identical to the file.
+
+运行方式:
+    python3 -m benchmarks.capture --stall 2.0 --speed 4
+    python3 -m benchmarks.capture --wav a.wav
+"""
+import os
+import tempfile
+import time
+import typing
+import wave
+
+import numpy as np
+
+from src.capture import WavReplay
+from src.segmenter import Segmenter
+
+RATE = 16000
+FRAME = RATE * 30 // 1000
+CHUNK = 256
+
+
+def synthetic_wav(filename: str, seconds: float, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    chunks, total = [], 0
+    while total < seconds * RATE:
+        n = int(rng.uniform(1.0, 3.0) * RATE)
+        chunks.append(np.sin(np.arange(n) * 0.2) * 8000 +
+                      rng.normal(0, 2000, n))
+        gap = int(rng.uniform(0.8, 1.5) * RATE)
+        chunks.append(rng.normal(0, 50, gap))
+        total += n + gap
+    with wave.open(filename, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(np.concatenate(chunks).astype('<i2').tobytes())
+
+
+def consume(filename: str, buffer: float, stall: float, speed: float):
+    capture = WavReplay(filename, RATE, chunk=CHUNK, seconds=buffer,
+                        speed=speed)
+    segmenter = Segmenter(RATE, vad='energy')
+    received, utterances = [], 0
+    with capture:
+        while True:
+            frame = capture.read(FRAME)
+            if frame is None:
+                break
+            received.append(frame)
+            if segmenter.push(frame) is not None:
+                utterances += 1
+                time.sleep(stall / speed)
+    return b''.join(received), utterances, capture.stats()
+
+
+def bench(wav: typing.Optional[str] = None,
+          seconds: float = 30.0,
+          stall: float = 2.0,
+          speed: float = 4.0):
+    tmp = None
+    if wav is None:
+        tmp = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
+        tmp.close()
+        synthetic_wav(tmp.name, seconds)
+        wav = tmp.name
+    try:
+        with wave.open(wav, 'rb') as wf:
+            source = wf.readframes(wf.getnframes())
+        duration = len(source) / 2 / RATE
+        print(f"{duration:.1f}s of audio, {stall}s stall per utterance, "
+              f"speed x{speed}")
+        for name, buffer in (('device', CHUNK * 4 / RATE), ('ring', 60.0)):
+            start_time = time.perf_counter()
+            received, utterances, stats = consume(wav, buffer, stall, speed)
+            elapsed = (time.perf_counter() - start_time) * speed
+            whole = len(source) // (FRAME * 2) * FRAME * 2
+            intact = received == source[:whole]
+            print(f"{name:>7} buffer {buffer:6.3f}s: {utterances} utterances, "
+                  f"{stats['overflows']} overflows, "
+                  f"{stats['dropped']:.2f}s lost, "
+                  f"{stats['underruns']} underruns, "
+                  f"audio intact: {intact}, wall {elapsed:.1f}s")
+            if stats['overflows'] == 0:
+                assert intact, name
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Scaling and delivery checks for the Redis Streams consumer pool. Uses a
+real Redis when `--url` is given, fakeredis otherwise.
+
+运行方式:
+    python3 -m benchmarks.consumer --chunks 200 --cost 0.02
+    python3 -m benchmarks.consumer --url redis://localhost:6379/15
+"""
+import asyncio
+import collections
+import time
+
+from src.consumer import StreamConsumer
+
+STREAM = 'BENCH:AUDIO_STREAM'
+GROUP = 'BENCH:WORKERS'
+
+
+def connect(url: str = None):
+    if url:
+        import aioredis
+        return aioredis.from_url(url)
+    import fakeredis
+    return fakeredis.FakeAsyncRedis()
+
+
+async def _fill(redis, chunks: int):
+    await redis.delete(STREAM)
+    for i in range(chunks):
+        await redis.xadd(STREAM, {'audio': str(i)})
+
+
+async def _drain(consumers, seen, chunks: int):
+    tasks = [asyncio.create_task(c.run()) for c in consumers]
+    while len(seen) < chunks:
+        await asyncio.sleep(0.01)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def scaling(redis, chunks: int, cost: float, processes: int,
+                  workers: int) -> float:
+    seen = collections.Counter()
+
+    async def handler(entry_id, fields):
+        await asyncio.sleep(cost)  # stands in for inference off the loop
+        seen[fields[b'audio']] += 1
+
+    await _fill(redis, chunks)
+    consumers = [
+        StreamConsumer(redis, handler, stream=STREAM, group=GROUP,
+                       name=f'proc{p}', workers=workers, max_backlog=0)
+        for p in range(processes)
+    ]
+    start_time = time.perf_counter()
+    await _drain(consumers, seen, chunks)
+    elapsed = time.perf_counter() - start_time
+    assert len(seen) == chunks and max(seen.values()) == 1, 'lost/duplicate'
+    await redis.delete(STREAM)
+    return chunks / elapsed
+
+
+async def crash_recovery(redis, chunks: int) -> None:
+    """ A consumer reads entries and dies before acking them, a second one
+    must reclaim and process every one of them. """
+    seen = collections.Counter()
+
+    async def handler(entry_id, fields):
+        seen[fields[b'audio']] += 1
+
+    await _fill(redis, chunks)
+    survivor = StreamConsumer(redis, handler, stream=STREAM, group=GROUP,
+                              name='survivor', workers=1, max_backlog=0,
+                              claim_idle=0.05, interval=0.05)
+    await survivor.setup()
+    # The crashed worker: read everything, ack nothing.
+    await redis.xreadgroup(GROUP, 'crashed', {STREAM: '>'}, count=chunks)
+    await asyncio.sleep(0.1)
+    await _drain([survivor], seen, chunks)
+    assert len(seen) == chunks, 'lost chunks after crash'
+    print(f"crash recovery: {survivor.reclaimed}/{chunks} chunks reclaimed")
+    await redis.delete(STREAM)
+
+
+async def shedding(redis, chunks: int, max_backlog: int) -> None:
+    await _fill(redis, chunks)
+    consumer = StreamConsumer(redis, None, stream=STREAM, group=GROUP,
+                              max_backlog=max_backlog)
+    await consumer.setup()
+    await consumer.shed()
+    entries = await redis.xrange(STREAM)
+    kept = [fields[b'audio'] for _, fields in entries]
+    expected = [str(i).encode() for i in range(chunks - max_backlog, chunks)]
+    assert kept == expected, 'shedding must drop the oldest chunks only'
+    print(f"shedding: dropped {consumer.dropped} oldest, kept newest "
+          f"{len(kept)}")
+    await redis.delete(STREAM)
+
+
+async def _main(url, chunks, cost):
+    redis = connect(url)
+    for processes, workers in ((1, 1), (1, 2), (1, 4), (2, 4)):
+        rate = await scaling(redis, chunks, cost, processes, workers)
+        print(f"{processes} process(es) x {workers} worker(s): "
+              f"{rate:8.1f} chunks/s")
+    await crash_recovery(redis, 20)
+    await shedding(redis, 50, 10)
+
+
+def bench(url: str = None, chunks: int = 200, cost: float = 0.02):
+    asyncio.run(_main(url, chunks, cost))
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Peak memory of decoding an upload: the old path (the whole upload read
+into bytes, then faster-whisper's decode_audio) against
+src.audio.decode_file streaming the spooled file in fixed-size chunks.
+
+Each run happens in a fresh process and reports how far the peak RSS
+grew during decoding. The output itself, 64 KB per second of 16 kHz
+float32, is listed separately: whatever is above it is decoder overhead,
+which should track `chunk` for decode_file and the file length for the
+old path.
+
+The input is a synthetic 44.1 kHz stereo file (speech-like tone bursts),
+so both paths also resample and downmix.
+
+运行方式:
+    python3 -m benchmarks.decode --minutes 10,30 --codec mp3
+    python3 -m benchmarks.decode --chunks 16384,65536,1048576
+"""
+import io
+import os
+import resource
+import tempfile
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+RATE = 44100
+FORMATS = {'mp3': 'mp3', 'aac': 'adts', 'flac': 'flac', 'opus': 'ogg',
+           'pcm_s16le': 'wav'}
+
+
+def synthetic(filename: str, codec: str, minutes: float) -> None:
+    import av
+    rng = np.random.default_rng(0)
+    with av.open(filename, 'w', format=FORMATS[codec]) as container:
+        stream = container.add_stream(
+            'libopus' if codec == 'opus' else codec,
+            rate=48000 if codec == 'opus' else RATE,
+            layout='stereo')
+        resampler = av.AudioResampler(format=stream.codec_context.format,
+                                      layout='stereo',
+                                      rate=stream.codec_context.sample_rate)
+        step = RATE  # one second per frame
+        for i in range(int(minutes * 60)):
+            t = np.arange(step) / RATE + i
+            tone = np.sin(2 * np.pi * rng.uniform(100, 300) * t)
+            tone *= (np.sin(2 * np.pi * 4 * t) > 0) * 0.3
+            frame = av.AudioFrame.from_ndarray(
+                np.stack([tone, tone]).astype(np.float32),
+                format='fltp',
+                layout='stereo')
+            frame.sample_rate = RATE
+            frame.pts = i * step
+            for converted in resampler.resample(frame):
+                for packet in stream.encode(converted):
+                    container.mux(packet)
+        for converted in resampler.resample(None):
+            for packet in stream.encode(converted):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+
+def _rss() -> int:
+    """ Peak resident set size in bytes. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure(method: str, filename: str,
+             chunk: int) -> typing.Tuple[int, float, int]:
+    # Import everything first so only decoding moves the peak, PyAV comes
+    # in with faster_whisper.audio.
+    from faster_whisper.audio import decode_audio
+
+    from src.audio import decode_file
+    before = _rss()
+    start_time = time.perf_counter()
+    if method == 'bytes':
+        with open(filename, 'rb') as f:
+            blob = f.read()  # what `await file.read()` did
+        audio = decode_audio(io.BytesIO(blob))
+    else:
+        with open(filename, 'rb') as f:
+            audio = decode_file(f, chunk_size=chunk)
+    return _rss() - before, time.perf_counter() - start_time, len(audio)
+
+
+def measure(method: str, filename: str, chunk: int = 64 * 1024):
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(_measure, method, filename, chunk).result()
+
+
+def bench(minutes: typing.Union[float, typing.Tuple[float, ...]] = (5, 20),
+          codec: str = 'mp3',
+          chunks: typing.Union[int, typing.Tuple[int, ...]] = (16384, 65536,
+                                                              1048576)):
+    # fire hands over "5,20" as a tuple, "20" as a number.
+    if isinstance(minutes, (int, float)):
+        minutes = (minutes, )
+    if isinstance(chunks, int):
+        chunks = (chunks, )
+    print(f"{'minutes':>7} {'file MB':>8} {'method':>14} {'output MB':>10} "
+          f"{'peak +MB':>9} {'overhead MB':>12} {'seconds':>8}")
+    for m in minutes:
+        fd, filename = tempfile.mkstemp(suffix='.' + FORMATS[codec])
+        os.close(fd)
+        try:
+            synthetic(filename, codec, m)
+            size = os.path.getsize(filename) / 2**20
+            runs = [('bytes', 0)] + [('stream', c) for c in chunks]
+            for method, chunk in runs:
+                grown, seconds, n = measure(method, filename, chunk or 65536)
+                output = n * 4 / 2**20
+                if method == 'stream':
+                    method = f'stream {chunk // 1024}K'
+                grown /= 2**20
+                print(f"{m:7.0f} {size:8.1f} {method:>14} {output:10.1f} "
+                      f"{grown:9.1f} {grown - output:12.1f} {seconds:8.2f}")
+        finally:
+            os.unlink(filename)
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+"""
+End-to-end latency, throughput and cost of every entry point, on a
+synthetic recording replayed like a microphone (src.capture.WavReplay,
+real time or `speed` times faster):
+
+    local   local_deploy.AudioRecorder + Transcriber threads
+    redis   client.py -> Redis -> server.py, fakeredis unless --redis_url
+    http    the FastAPI app, one upload per utterance cut on the client,
+            `concurrency` in flight
+    ws      the FastAPI app's WebSocket, cut by the server's VAD
+
+Utterance i of the recording is a run of tone bursts at PITCH + STEP * i
+Hz. FakeWhisperModel, plugged in wherever a WhisperModel is loaded, sleeps
+`latency` + `rtf` seconds per second of audio (the sleep releases the GIL
+like CTranslate2 does) and names every group of bursts by its pitch, so
+each result maps back to its utterance. Latency is the time from the
+utterance's last burst being replayed to its text arriving, so it covers
+VAD endpointing, transport, queueing and inference.
+
+Each path runs in a fresh process; CPU is that process's user + system
+time while replaying, RSS its peak. Results go to `output` as JSON, and
+`compare` prints the change between two such files, e.g. two commits.
+
+运行方式:
+    python3 -m benchmarks.e2e run --utterances 20 --speed 4 --output a.json
+    python3 -m benchmarks.e2e run --paths local,ws --latency 0.2 --rtf 0.3
+    python3 -m benchmarks.e2e run --paths redis --redis_url redis://localhost
+    python3 -m benchmarks.e2e compare a.json b.json
+"""
+import datetime
+import functools
+import io
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import typing
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+RATE = 16000
+PITCH = 200.0  # Hz of utterance 0
+STEP = 25.0  # Hz between utterances
+IDS = int((RATE / 2 - 500 - PITCH) // STEP)  # distinct pitches below Nyquist
+PATHS = ('local', 'redis', 'http', 'ws')
+
+
+def synthetic(utterances: int,
+              seed: int = 0) -> typing.Tuple[np.ndarray, typing.List[float]]:
+    """ int16 audio, and the end in seconds of each utterance. """
+    assert utterances <= IDS, f"at most {IDS} utterances"
+    rng = np.random.default_rng(seed)
+    pieces, ends, t = [], [], 0.0
+
+    def add(samples: np.ndarray) -> None:
+        nonlocal t
+        pieces.append(samples)
+        t += len(samples) / RATE
+
+    add(np.zeros(RATE))
+    for i in range(utterances):
+        for _ in range(rng.integers(2, 8)):
+            n = int(rng.uniform(0.2, 0.5) * RATE)
+            add(np.sin(2 * np.pi * (PITCH + STEP * i) * np.arange(n) / RATE) *
+                np.hanning(n)**0.1 * 0.3)
+            add(np.zeros(int(rng.uniform(0.05, 0.15) * RATE)))
+        ends.append(round(t, 3))
+        add(np.zeros(int(rng.uniform(1.0, 2.0) * RATE)))
+    audio = np.concatenate(pieces)
+    audio += rng.normal(0, 1e-3, len(audio))
+    return (audio * 32767).astype('<i2'), ends
+
+
+def to_wav(pcm: bytes) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+class Segment(typing.NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+class Info(typing.NamedTuple):
+    language: str
+    language_probability: float
+    duration: float
+
+
+class _FeatureExtractor:
+    n_samples = 0
+
+
+class FakeWhisperModel:
+    """ WhisperModel stand-in, see the module docstring. It has no batched
+    decoder (n_samples = 0), so src.models.transcribe_texts decodes the
+    app's batches clip by clip. """
+
+    def __init__(self,
+                 model_size: str,
+                 device: str = 'auto',
+                 compute_type: str = 'default',
+                 latency: float = 0.05,
+                 rtf: float = 0.05,
+                 **options) -> None:
+        self.model_size = model_size
+        self.latency = latency
+        self.rtf = rtf
+        self.feature_extractor = _FeatureExtractor()
+
+    def transcribe(self, audio, **options):
+        if not isinstance(audio, np.ndarray):
+            from src.audio import decode_file
+            audio = decode_file(audio)
+        duration = len(audio) / RATE
+        time.sleep(self.latency + self.rtf * duration)
+        return iter(self._bursts(audio)), Info('zh', 1.0, duration)
+
+    @staticmethod
+    def _bursts(audio: np.ndarray) -> typing.List[Segment]:
+        step = RATE // 100
+        n = len(audio) // step
+        loud = np.abs(audio[:n * step].reshape(n, step)).max(axis=1) > 0.05
+        segments, i = [], 0
+        while i < n:
+            if not loud[i]:
+                i += 1
+                continue
+            # Bursts less than 0.4 s apart belong to the same utterance.
+            j, quiet = i, 0
+            while j < n and quiet < 40:
+                quiet = 0 if loud[j] else quiet + 1
+                j += 1
+            end = j - quiet
+            if end - i >= 5:
+                burst = audio[i * step:end * step]
+                spectrum = np.abs(np.fft.rfft(burst))
+                pitch = np.argmax(spectrum) * RATE / len(burst)
+                segments.append(
+                    Segment(i / 100, end / 100,
+                            f' u{int(round((pitch - PITCH) / STEP))}'))
+            i = j
+        return segments
+
+
+class Arrivals:
+    """ First arrival time (monotonic) of every utterance id. """
+
+    def __init__(self) -> None:
+        self.t0 = 0.0  # when the replay started
+        self.times: typing.Dict[int, float] = {}
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self.t0 = time.monotonic()
+
+    def record(self, text: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for match in re.findall(r'u(\d+)', text):
+                if int(match) in self.times:
+                    self.duplicates += 1
+                else:
+                    self.times[int(match)] = now
+
+
+Runner = typing.Callable[[Arrivals], None]
+
+
+def _local(wav: str, speed: float, loader: typing.Callable,
+           options: dict) -> Runner:
+    from src import local_deploy
+
+    def run(arrivals: Arrivals) -> None:
+        arrivals.start()
+        with local_deploy.AudioRecorder(vad='energy', wav=wav,
+                                        speed=speed) as recorder:
+            with local_deploy.Transcriber('fake',
+                                          loader=loader) as transcriber:
+                recorder.start()
+                transcriber.start()
+                while True:
+                    text = local_deploy.Queues.text.get()
+                    if text is None:
+                        break
+                    arrivals.record(text)
+                recorder.join()
+                transcriber.join()
+
+    return run
+
+
+def _redis(wav: str, speed: float, loader: typing.Callable,
+           options: dict) -> Runner:
+    import asyncio
+
+    import aioredis
+    url = options.get('redis_url')
+    os.environ['REDIS_SERVER'] = url or 'redis://fakeredis'
+    if not url:
+        import fakeredis
+        server = fakeredis.FakeServer()
+
+        class FakeRedis(fakeredis.FakeAsyncRedis):
+            """ fakeredis answers blocking reads at once; an empty one
+            would have the consumer spin without yielding the loop. """
+
+            async def xread(self, *args, block=None, **kwargs):
+                response = await super().xread(*args, **kwargs)
+                if not response and block is not None:
+                    await asyncio.sleep(0.005)
+                return response
+
+            async def xreadgroup(self, *args, block=None, **kwargs):
+                response = await super().xreadgroup(*args, **kwargs)
+                if not response and block is not None:
+                    await asyncio.sleep(0.005)
+                return response
+
+        # client.py and server.py connect with aioredis.from_url, hand
+        # them clients of one in-process server instead.
+        aioredis.from_url = lambda *args, **kwargs: FakeRedis(server=server)
+    from src.models import registry
+    registry.loader = loader  # src.server loads its model with it
+    from src import client
+    from src import server as worker
+    from src.capture import WavReplay
+    from src.consumer import AUDIO_STREAM, result_stream
+    worker.METRICS_PORT = 0
+    client.VAD = 'energy'
+    client.g_capture = WavReplay(wav,
+                                 client.RATE,
+                                 client.CHANNELS,
+                                 client.CHUNK,
+                                 seconds=client.CAPTURE_BUFFER,
+                                 speed=speed)
+    expected, timeout = options['expected'], options['timeout']
+
+    async def main(arrivals: Arrivals) -> None:
+        redis = aioredis.from_url(os.environ['REDIS_SERVER'])
+        await redis.delete(AUDIO_STREAM)  # leftovers of an earlier run
+        tasks = [asyncio.create_task(worker.transcribe())]
+        await asyncio.sleep(0.1)  # consumer group in place
+        arrivals.start()
+        tasks.append(asyncio.create_task(client.main()))
+        key, last_id = result_stream(client.SESSION), '0'
+        deadline = time.monotonic() + timeout
+        while len(arrivals.times) < expected and \
+                time.monotonic() < deadline:
+            response = await redis.xread({key: last_id}, block=100)
+            for _, entries in response or []:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    arrivals.record(json.loads(fields[b'result'])['text'])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await redis.close()
+
+    return lambda arrivals: asyncio.run(main(arrivals))
+
+
+def _app(loader: typing.Callable):
+    os.environ.setdefault('VAD', 'energy')
+    from src.models import registry
+    registry.loader = loader
+    from fastapi.testclient import TestClient
+
+    from loguru import logger
+
+    from src.docker import whisper
+    logger.remove()  # a line per request would drown the results
+    return TestClient(whisper.app)
+
+
+def _http(wav: str, speed: float, loader: typing.Callable,
+          options: dict) -> Runner:
+    http = _app(loader)
+    from src.capture import WavReplay
+    from src.segmenter import Segmenter
+
+    def post(arrivals: Arrivals, pcm: bytes) -> None:
+        response = http.post('/v1/audio/transcriptions',
+                             files={'file': ('u.wav', to_wav(pcm))},
+                             data={'vad': 'energy'})
+        arrivals.record(response.json().get('text', ''))
+
+    def run(arrivals: Arrivals) -> None:
+        capture = WavReplay(wav, RATE, speed=speed)
+        segmenter = Segmenter(RATE, vad='energy', max_duration=30.0)
+        with http, ThreadPoolExecutor(options['concurrency']) as pool:
+            arrivals.start()
+            capture.start()
+            while True:
+                frame = capture.read(segmenter.frame_samples, timeout=1.0)
+                if frame is None and not capture.closed:
+                    continue
+                utterance = segmenter.push(frame) if frame is not None \
+                    else segmenter.flush()
+                if utterance is not None:
+                    pool.submit(post, arrivals, utterance.pcm)
+                if frame is None:
+                    break
+        capture.stop()
+
+    return run
+
+
+def _ws(wav: str, speed: float, loader: typing.Callable,
+        options: dict) -> Runner:
+    http = _app(loader)
+    from src.capture import WavReplay
+
+    def send(websocket, capture) -> None:
+        while True:
+            pcm = capture.read(RATE // 10, timeout=1.0)  # 100 ms
+            if pcm is None:
+                if capture.closed:
+                    break
+                continue
+            websocket.send_bytes(pcm)
+        websocket.send_text(json.dumps({"type": "end"}))
+
+    def run(arrivals: Arrivals) -> None:
+        capture = WavReplay(wav, RATE, speed=speed)
+        with http, http.websocket_connect('/v1/audio/stream') as websocket:
+            arrivals.start()
+            capture.start()
+            sender = threading.Thread(target=send,
+                                      args=(websocket, capture))
+            sender.start()
+            while True:
+                event = websocket.receive_json()
+                if event["type"] == "end":
+                    break
+                if event["type"] == "segment":
+                    arrivals.record(event["text"])
+            sender.join()
+        capture.stop()
+
+    return run
+
+
+RUNNERS = {'local': _local, 'redis': _redis, 'http': _http, 'ws': _ws}
+
+
+def _cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _measure(path: str, wav: str, speed: float, latency: float, rtf: float,
+             options: dict) -> dict:
+    logging.disable(logging.INFO)
+    loader = functools.partial(FakeWhisperModel, latency=latency, rtf=rtf)
+    run = RUNNERS[path](wav, speed, loader, options)
+    arrivals = Arrivals()
+    cpu, start_time = _cpu(), time.perf_counter()
+    run(arrivals)
+    return {
+        't0': arrivals.t0,
+        'times': arrivals.times,
+        'duplicates': arrivals.duplicates,
+        'wall': time.perf_counter() - start_time,
+        'cpu': _cpu() - cpu,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
+
+
+def measure(path: str, wav: str, speed: float, latency: float, rtf: float,
+            options: dict) -> dict:
+    """ One path in a fresh process, so imports, globals and peak RSS do
+    not leak between paths. """
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(_measure, path, wav, speed, latency, rtf,
+                           options).result()
+
+
+def summarize(raw: dict, ends: typing.List[float], speed: float,
+              duration: float) -> dict:
+    latencies = [
+        raw['times'][i] - raw['t0'] - end / speed
+        for i, end in enumerate(ends) if i in raw['times']
+    ]
+    p50, p90, p99 = (np.percentile(latencies, [50, 90, 99])
+                     if latencies else (float('nan'), ) * 3)
+    return {
+        'utterances': len(ends),
+        'received': len(latencies),
+        'duplicates': raw['duplicates'],
+        'latency_p50': round(float(p50), 4),
+        'latency_p90': round(float(p90), 4),
+        'latency_p99': round(float(p99), 4),
+        'latency_max': round(max(latencies, default=float('nan')), 4),
+        'wall': round(raw['wall'], 3),
+        'audio_per_second': round(duration / raw['wall'], 3),
+        'utterances_per_second': round(len(latencies) / raw['wall'], 3),
+        'cpu': round(raw['cpu'], 3),
+        'cpu_percent': round(raw['cpu'] / raw['wall'] * 100, 1),
+        'rss_mb': round(raw['rss'] / 2**20, 1)
+    }
+
+
+def _commit() -> typing.Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(paths: typing.Union[str, typing.Tuple[str, ...]] = PATHS,
+        utterances: int = 20,
+        speed: float = 4.0,
+        latency: float = 0.05,
+        rtf: float = 0.05,
+        concurrency: int = 8,
+        redis_url: typing.Optional[str] = None,
+        timeout: float = 30.0,
+        seed: int = 0,
+        output: typing.Optional[str] = None):
+    # fire hands over "local,ws" as a tuple, "local" as a string.
+    if isinstance(paths, str):
+        paths = (paths, )
+    audio, ends = synthetic(utterances, seed)
+    duration = len(audio) / RATE
+    params = dict(utterances=utterances,
+                  speed=speed,
+                  latency=latency,
+                  rtf=rtf,
+                  concurrency=concurrency,
+                  redis=redis_url or 'fakeredis',
+                  seed=seed)
+    options = dict(concurrency=concurrency,
+                   redis_url=redis_url,
+                   expected=utterances,
+                   timeout=duration / speed + timeout)
+    print(f"{duration:.0f}s of audio, {utterances} utterances, replayed at "
+          f"{speed:g}x; model {latency * 1e3:.0f} ms + {rtf:g} x audio")
+    print(f"{'path':>6} {'recv':>7} {'p50 ms':>7} {'p90 ms':>7} "
+          f"{'p99 ms':>7} {'audio s/s':>9} {'cpu %':>6} {'rss MB':>7}")
+    results = {}
+    fd, wav = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        with open(wav, 'wb') as f:
+            f.write(to_wav(audio.tobytes()))
+        for path in paths:
+            try:
+                raw = measure(path, wav, speed, latency, rtf, options)
+            except Exception as e:
+                # e.g. aioredis, which does not import on Python 3.11+
+                results[path] = {'error': repr(e)}
+                print(f"{path:>6} failed: {e!r}")
+                continue
+            r = results[path] = summarize(raw, ends, speed, duration)
+            print(f"{path:>6} {r['received']:3d}/{r['utterances']:<3d} "
+                  f"{r['latency_p50'] * 1e3:7.0f} "
+                  f"{r['latency_p90'] * 1e3:7.0f} "
+                  f"{r['latency_p99'] * 1e3:7.0f} "
+                  f"{r['audio_per_second']:9.2f} {r['cpu_percent']:6.1f} "
+                  f"{r['rss_mb']:7.1f}")
+    finally:
+        os.unlink(wav)
+    report = {
+        'commit': _commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': results
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {output}")
+    return None
+
+
+COMPARED = ('received', 'latency_p50', 'latency_p90', 'latency_p99',
+            'audio_per_second', 'cpu', 'rss_mb')
+
+
+def compare(before: str, after: str):
+    """ Metric by metric change between two `run --output` files. """
+    with open(before) as f:
+        a = json.load(f)
+    with open(after) as f:
+        b = json.load(f)
+    if a['params'] != b['params']:
+        print(f"warning: different parameters\n  {a['params']}\n  "
+              f"{b['params']}")
+    print(f"{a['commit']} -> {b['commit']}")
+    for path in b['results']:
+        if 'error' in b['results'][path] or \
+                'error' in a['results'].get(path, {'error': None}):
+            continue
+        print(path)
+        for key in COMPARED:
+            old, new = a['results'][path][key], b['results'][path][key]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else ''
+            print(f"  {key:>18} {old:10.4g} -> {new:<10.4g} {change}")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire({'run': run, 'compare': compare})
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Throughput of K inference threads sharing one model against K worker
+processes (src/inference.py), for K in 1/2/4/8.
+
+The default `stub` model spends `cost` CPU seconds per second of audio in
+pure Python, the share of a real transcription that holds the GIL (segment
+iteration, tokenizer decoding, filtering), so threads cannot scale on it
+and processes scale up to the core count. `--model tiny` (or a local model
+directory) measures the real thing; threads then share one WhisperModel
+with num_workers=K, as faster-whisper recommends.
+
+运行方式:
+    python3 -m benchmarks.inference --clips 32 --seconds 5
+    python3 -m benchmarks.inference --model tiny --workers 1,2,4
+"""
+import functools
+import os
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.inference import InferencePool
+from src.models import ModelRegistry
+
+RATE = 16000
+
+
+class Segment(typing.NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+class BusyModel:
+    """ WhisperModel stand-in burning `cost` CPU seconds per audio second
+    while holding the GIL. """
+
+    def __init__(self,
+                 model_size: str,
+                 cost: float = 0.05,
+                 **options) -> None:
+        self.model_size = model_size
+        self.cost = cost
+
+    def transcribe(self, audio: np.ndarray, **options):
+        duration = len(audio) / RATE
+        deadline = time.thread_time() + duration * self.cost
+        n = 0
+        while time.thread_time() < deadline:
+            n += sum(range(1000)) & 1
+        return iter([Segment(0.0, duration, f' {n}')]), {
+            'duration': duration
+        }
+
+
+def _threads(model: str, loader: typing.Optional[typing.Callable], k: int,
+             clips: typing.List[np.ndarray]) -> float:
+    cores = os.cpu_count() or 1
+    registry = ModelRegistry(loader=loader,
+                             cpu_threads=cores,
+                             num_workers=k)
+    registry.warmup(model, 'cpu', 'int8')
+
+    def run(audio):
+        segments, _ = registry.get(model, 'cpu', 'int8').transcribe(
+            audio, beam_size=1)
+        return list(segments)
+
+    with ThreadPoolExecutor(k) as pool:
+        start_time = time.perf_counter()
+        list(pool.map(run, clips))
+        return time.perf_counter() - start_time
+
+
+def _processes(model: str, loader: typing.Optional[typing.Callable], k: int,
+               clips: typing.List[np.ndarray]) -> float:
+    with InferencePool(k, 'cpu', 'int8', loader=loader).start([model]) as pool:
+        with ThreadPoolExecutor(k) as threads:
+            start_time = time.perf_counter()
+            list(
+                threads.map(
+                    lambda audio: pool.transcribe(model, audio, beam_size=1),
+                    clips))
+            return time.perf_counter() - start_time
+
+
+def bench(model: str = 'stub',
+          workers: typing.Union[str, typing.Tuple[int, ...]] = (1, 2, 4, 8),
+          clips: int = 32,
+          seconds: float = 5.0,
+          cost: float = 0.05):
+    if isinstance(workers, str):
+        workers = tuple(int(k) for k in workers.split(','))
+    # A partial of a module-level class pickles into the workers.
+    loader = functools.partial(BusyModel, cost=cost) \
+        if model == 'stub' else None
+    rng = np.random.default_rng(0)
+    audios = [
+        rng.normal(0, 0.1, int(seconds * RATE)).astype(np.float32)
+        for _ in range(clips)
+    ]
+    total = clips * seconds
+    print(f"{model}: {clips} clips of {seconds}s, {os.cpu_count()} cores")
+    print(f"{'K':>3} {'threads x rt':>13} {'processes x rt':>15} "
+          f"{'speedup':>8}")
+    for k in workers:
+        threads = _threads(model, loader, k, audios)
+        processes = _processes(model, loader, k, audios)
+        print(f"{k:>3} {total / threads:13.1f} {total / processes:15.1f} "
+              f"{threads / processes:8.2f}")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Voice-chat replies against a local OpenAI-compatible stub server: how
+long the recorder loop stalls per question, and how soon the first token
+shows up, for the old blocking call (the whole completion, then
+`time.sleep(1)`) against src.llm.ChatStage.
+
+The stub streams `tokens` tokens `delay` seconds apart, or answers with
+one JSON body when the request does not ask for a stream. It records
+every request, which the checks afterwards use: an interrupted reply
+stops early and is remembered as far as it got, and no request carries
+more history than the budget allows.
+
+运行方式:
+    python3 -m benchmarks.llm --tokens 40 --delay 0.02
+"""
+import json
+import statistics
+import threading
+import time
+import typing
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.llm import ChatStage, count_tokens
+
+
+class Stub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tokens: int, delay: float) -> None:
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.tokens = tokens
+        self.delay = delay
+        self.requests: typing.List[dict] = []
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers['Content-Length'])
+        body = json.loads(self.rfile.read(length))
+        self.server.requests.append(body)
+        words = [f'w{i} ' for i in range(self.server.tokens)]
+        if not body.get('stream'):
+            time.sleep(self.server.delay * len(words))
+            data = json.dumps({
+                'choices': [{
+                    'message': {
+                        'role': 'assistant',
+                        'content': ''.join(words)
+                    }
+                }]
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        events = [{'choices': [{'delta': {'content': w}}]} for w in words]
+        try:
+            for event in events + ['[DONE]']:
+                time.sleep(self.server.delay)
+                line = event if isinstance(event, str) else json.dumps(event)
+                chunk = f'data: {line}\n\n'.encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client interrupted the reply
+
+
+def blocking(url: str, question: str) -> str:
+    """ What local_deploy_openai.ask did, minus the SDK. """
+    request = urllib.request.Request(
+        url + '/chat/completions',
+        data=json.dumps({
+            'model': 'stub',
+            'messages': [{
+                'role': 'user',
+                'content': question
+            }]
+        }).encode(),
+        headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        reply = json.load(response)["choices"][0]["message"]["content"]
+    time.sleep(1)
+    return reply
+
+
+def bench(questions: int = 5,
+          interval: float = 2.0,
+          tokens: int = 40,
+          delay: float = 0.02,
+          budget: int = 200):
+    stub = Stub(tokens, delay)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    question = '请用三句话介绍一下长江。'
+
+    stalls = []
+    start_time = time.perf_counter()
+    for _ in range(questions):
+        begin = time.perf_counter()
+        blocking(stub.url, question)
+        stalls.append(time.perf_counter() - begin)
+    old_total = time.perf_counter() - start_time
+    print(f"blocking:  recorder stalled {statistics.mean(stalls) * 1e3:.0f}"
+          f" ms per question, first token after the whole reply")
+
+    first, done, asked = [], [], 0.0
+
+    def on_token(token: str) -> None:
+        if len(first) == len(done):
+            first.append(time.perf_counter() - asked)
+
+    stage = ChatStage(stub.url,
+                      model='stub',
+                      budget=budget,
+                      on_token=on_token,
+                      on_reply=lambda reply, finished: done.append(finished))
+
+    stalls = []
+    with stage:
+        for _ in range(questions):
+            asked = time.perf_counter()
+            future = stage.ask(question)
+            stalls.append(time.perf_counter() - asked)
+            future.result()
+            time.sleep(max(0.0, interval - tokens * delay))
+    print(f"ChatStage: recorder stalled {statistics.mean(stalls) * 1e3:.2f}"
+          f" ms per question, first token after "
+          f"{statistics.mean(first) * 1e3:.0f} ms "
+          f"(blocking total {old_total:.1f}s)")
+    assert all(done) and stage.replies == questions
+    assert max(stalls) < 0.05, stalls
+
+    # The user starts talking again a few tokens into the reply.
+    stub.requests.clear()
+    with ChatStage(stub.url, model='stub', on_token=lambda t: None,
+                   on_reply=lambda r, f: None) as stage:
+        future = stage.ask('第一个问题')
+        time.sleep(delay * 5.5)
+        stage.interrupt()
+        time.sleep(delay * 3)
+        assert future.cancelled()
+        partial = stage.history.messages()[-1]['content']
+        assert 0 < len(partial.split()) < tokens, partial
+        stage.ask('第二个问题').result()
+        sent = stub.requests[-1]['messages']
+        assert [m['role'] for m in sent] == ['user', 'assistant', 'user']
+        assert sent[1]['content'] == partial
+        assert stage.interrupted == 1 and stage.replies == 1
+    print(f"interrupted after {len(partial.split())} of {tokens} tokens, "
+          f"partial reply kept in the history")
+
+    # Every request fits the budget, the latest question always goes out.
+    stub.requests.clear()
+    with ChatStage(stub.url, model='stub', system='你是一个助手', budget=budget,
+                   on_token=lambda t: None,
+                   on_reply=lambda r, f: None) as stage:
+        for i in range(10):
+            stage.ask(f'问题 {i}').result()
+    sizes = [
+        sum(count_tokens(m['content']) for m in r['messages'])
+        for r in stub.requests
+    ]
+    assert max(sizes) <= budget, sizes
+    assert stub.requests[-1]['messages'][-1]['content'] == '问题 9'
+    print(f"history within {budget} tokens: largest request {max(sizes)}, "
+          f"{len(stub.requests[-1]['messages'])} messages in the last one")
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Long-form chunking (src/longform.py) against a single pass over the whole
+recording: the stitched segments must match in text and, within
+`tolerance` seconds, in timestamps. Also reports the wall-clock speedup.
+
+The audio is synthetic "speech": tone bursts whose pitch encodes a word,
+separated by short pauses, with longer pauses between sentences and the
+odd minute of silence. ToneModel stands in for Whisper, it finds the
+bursts by energy and names each by its pitch, so its timestamps are
+exact in both modes and any drift comes from the chunking. It sleeps
+`latency` seconds per second of audio to stand for inference; the sleep
+releases the GIL like CTranslate2 does, so chunks decode in parallel.
+
+运行方式:
+    python3 -m benchmarks.longform --minutes 20 --parallel 8
+    python3 -m benchmarks.longform --vad webrtc --tolerance 0.05
+"""
+import asyncio
+import time
+import typing
+
+import numpy as np
+
+from src import longform
+
+RATE = 16000
+WORDS = [f'w{i}' for i in range(20)]
+PITCH = 300.0  # Hz of the first word, then 50 Hz apart
+
+
+def synthetic(minutes: float, seed: int = 0):
+    """ Audio and the (start, end, word) of every burst. """
+    rng = np.random.default_rng(seed)
+    chunks, truth, t = [], [], 0.0
+
+    def add(samples: np.ndarray) -> None:
+        nonlocal t
+        chunks.append(samples)
+        t += len(samples) / RATE
+
+    while t < minutes * 60:
+        if rng.random() < 0.03:
+            add(np.zeros(int(rng.uniform(10, 60) * RATE)))
+        for _ in range(rng.integers(3, 15)):
+            word = rng.integers(len(WORDS))
+            n = int(rng.uniform(0.15, 0.6) * RATE)
+            tone = np.sin(2 * np.pi * (PITCH + 50 * word) * np.arange(n) /
+                          RATE) * np.hanning(n)**0.1 * 0.5
+            truth.append((round(t, 2), round(t + n / RATE, 2), WORDS[word]))
+            add(tone)
+            add(np.zeros(int(rng.uniform(0.1, 0.3) * RATE)))
+        add(np.zeros(int(rng.uniform(0.5, 2.0) * RATE)))
+    audio = np.concatenate(chunks).astype(np.float32)
+    audio += rng.normal(0, 1e-3, len(audio)).astype(np.float32)
+    return audio, truth
+
+
+class ToneModel:
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+
+    def transcribe(self, audio: np.ndarray) -> typing.List[dict]:
+        time.sleep(len(audio) / RATE * self.latency)
+        step = RATE // 100
+        n = len(audio) // step
+        loud = np.abs(audio[:n * step].reshape(n, step)).max(axis=1) > 0.05
+        segments, i = [], 0
+        while i < n:
+            if not loud[i]:
+                i += 1
+                continue
+            j = i
+            while j < n and loud[j]:
+                j += 1
+            if j - i >= 5:
+                burst = audio[i * step:j * step]
+                spectrum = np.abs(np.fft.rfft(burst))
+                pitch = np.argmax(spectrum) * RATE / len(burst)
+                word = int(round((pitch - PITCH) / 50))
+                segments.append({
+                    "id": len(segments),
+                    "start": round(i / 100, 2),
+                    "end": round(j / 100, 2),
+                    "text": WORDS[min(max(word, 0), len(WORDS) - 1)]
+                })
+            i = j
+        return segments
+
+
+async def run_long(audio: np.ndarray, model: ToneModel, vad: str,
+                   parallel: int) -> typing.List[dict]:
+    chunks = longform.plan(audio, RATE, vad=vad)
+    loop = asyncio.get_running_loop()
+
+    async def run(piece):
+        return await loop.run_in_executor(None, model.transcribe, piece)
+
+    return [
+        segment async for segment in longform.transcribe(
+            audio, chunks, run, parallel)
+    ]
+
+
+def bench(minutes: float = 10.0,
+          parallel: int = 8,
+          vad: str = 'energy',
+          latency: float = 0.02,
+          tolerance: float = 0.02):
+    audio, truth = synthetic(minutes)
+    model = ToneModel(latency)
+    start_time = time.perf_counter()
+    single = model.transcribe(audio)
+    single_time = time.perf_counter() - start_time
+    chunks = longform.plan(audio, RATE, vad=vad)
+    start_time = time.perf_counter()
+    stitched = asyncio.run(run_long(audio, model, vad, parallel))
+    long_time = time.perf_counter() - start_time
+
+    lengths = [c.end - c.start for c in chunks]
+    print(f"{len(audio) / RATE:.0f}s, {len(truth)} words, {len(chunks)} "
+          f"chunks of {min(lengths):.1f}-{max(lengths):.1f}s, "
+          f"{sum(c.continued for c in chunks)} forced cuts, "
+          f"{len(audio) / RATE - sum(lengths):.0f}s of silence skipped")
+    print(f"single pass {single_time:.2f}s, long-form x{parallel} "
+          f"{long_time:.2f}s, speedup {single_time / long_time:.1f}x")
+    assert len(single) == len(truth), (len(single), len(truth))
+    assert [s["text"] for s in stitched] == [s["text"] for s in single]
+    drift = max(
+        max(abs(a["start"] - b["start"]), abs(a["end"] - b["end"]))
+        for a, b in zip(stitched, single))
+    assert drift <= tolerance, drift
+    assert [s["id"] for s in stitched] == list(range(len(stitched)))
+    print(f"{len(stitched)} segments identical, max timestamp drift "
+          f"{drift:.3f}s")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
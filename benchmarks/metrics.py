@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Cost of the instrumentation in src/metrics.py: nanoseconds per histogram
+observation and counter increment, from one thread and from `threads`
+at once (each metric takes a lock), and the time to render a scrape.
+
+An utterance is observed a handful of times on its way through the
+pipeline, so anything in the microseconds is noise next to decoding.
+
+运行方式:
+    python3 -m benchmarks.metrics --n 200000 --threads 4
+"""
+import threading
+import time
+
+from src import metrics
+
+
+def _rate(function, n: int, threads: int) -> float:
+    """ Nanoseconds per call, over all threads. """
+    per_thread = n // threads
+
+    def run() -> None:
+        for _ in range(per_thread):
+            function()
+
+    start_time = time.perf_counter()
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start_time) / (per_thread * threads) * 1e9
+
+
+def bench(n: int = 200000, threads: int = 4):
+    registry = metrics.Registry()
+    histogram = metrics.Histogram('bench_seconds', 'Bench', ('stage', ),
+                                  registry=registry)
+    counter = metrics.Counter('bench', 'Bench', ('reason', ),
+                              registry=registry)
+    calls = {
+        'histogram.observe': lambda: histogram.observe(0.3, stage='decode'),
+        'counter.inc': lambda: counter.inc(reason='queue_full'),
+    }
+    print(f"{'call':>18} {'1 thread ns':>12} {f'{threads} threads ns':>14}")
+    for name, call in calls.items():
+        print(f"{name:>18} {_rate(call, n, 1):12.0f} "
+              f"{_rate(call, n, threads):14.0f}")
+
+    expected = n // threads * threads + n
+    assert histogram.count(stage='decode') == expected
+    assert counter.value(reason='queue_full') == expected
+    for stage in range(50):
+        histogram.observe(stage / 10, stage=str(stage))
+    start_time = time.perf_counter()
+    text = registry.render()
+    render_time = time.perf_counter() - start_time
+    lines = [line for line in text.splitlines() if '_bucket' in line]
+    counts = [int(line.rsplit(' ', 1)[1]) for line in lines]
+    # Buckets are cumulative within each series.
+    step = len(histogram.buckets)
+    for i in range(0, len(counts), step):
+        assert counts[i:i + step] == sorted(counts[i:i + step])
+    print(f"render: {len(text.splitlines())} lines in "
+          f"{render_time * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Post-processing latency per utterance, against the number of segments in
+it: one punctuation call per segment (the old local_deploy_openai loop)
+against PostStage, which makes one call per batch of queued utterances.
+
+The stub model costs `latency` seconds per call plus `per_text` per text,
+roughly what ct-punc does on CPU. Utterances arrive every `interval`
+seconds and the sink stalls `sink` seconds on each, like a chat reply, so
+the stage also has to catch up on a backlog.
+
+运行方式:
+    python3 -m benchmarks.postprocess --latency 0.05 --sink 0.5
+"""
+import statistics
+import time
+import typing
+
+from src.postprocess import PostStage, StubPunctuation
+
+
+def serial(segments: int, utterances: int, model: StubPunctuation,
+           interval: float, sink: float) -> typing.List[float]:
+    """ Latency from the end of recognition to the sink, for the old
+    inline loop: the next utterance waits for the previous one. """
+    latencies, now = [], 0.0
+    for i in range(utterances):
+        now = max(now, i * interval)
+        start_time = time.perf_counter()
+        for _ in range(segments):
+            model(['这是一个测试'])
+        now += time.perf_counter() - start_time
+        latencies.append(now - i * interval)
+        time.sleep(sink)
+        now += sink
+    return latencies
+
+
+def staged(segments: int, utterances: int, model: StubPunctuation,
+           interval: float, sink: float) -> typing.List[float]:
+    latencies = []
+    origin = time.perf_counter()
+
+    def done(text: str, submitted: float) -> None:
+        latencies.append(time.perf_counter() - submitted)
+        time.sleep(sink)
+
+    with PostStage(model, done) as stage:
+        for i in range(utterances):
+            time.sleep(max(0.0, origin + i * interval - time.perf_counter()))
+            stage.submit(['这是一个测试'] * segments, time.perf_counter())
+    return latencies
+
+
+def bench(segments: typing.Tuple[int, ...] = (1, 4, 16),
+          utterances: int = 10,
+          interval: float = 0.5,
+          latency: float = 0.05,
+          per_text: float = 0.002,
+          sink: float = 0.0):
+    if isinstance(segments, int):
+        segments = (segments, )
+    print(f"{'segments':>8} {'calls':>12} {'serial ms':>10} "
+          f"{'stage ms':>9}")
+    for n in segments:
+        old = StubPunctuation(latency, per_text)
+        new = StubPunctuation(latency, per_text)
+        a = serial(n, utterances, old, interval, sink)
+        b = staged(n, utterances, new, interval, sink)
+        assert len(b) == utterances
+        print(f"{n:8d} {old.calls:5d} -> {new.calls:<4d} "
+              f"{statistics.mean(a) * 1e3:10.0f} "
+              f"{statistics.mean(b) * 1e3:9.0f}")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
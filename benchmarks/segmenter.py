@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Endpointing cost of the Segmenter against the original recorder loop, which
+rebuilt a list over the 30-frame window on every frame.
+
+VAD decisions are precomputed from a speech/silence Markov chain so only
+the endpointing itself is measured, webrtcvad costs the same in both.
+
+`cuts` feeds continuous speech with short pauses and checks the forced
+cuts of max_duration: every utterance stays bounded and is cut at a quiet
+frame rather than mid-word.
+
+运行方式:
+    python3 -m benchmarks.segmenter bench --hours 2
+    python3 -m benchmarks.segmenter cuts --minutes 10 --max-duration 30
+"""
+import collections
+import time
+
+import numpy as np
+
+from src.segmenter import Segmenter
+from src.vad import EnergyVAD
+
+RATE = 16000
+FRAME_DURATION = 30
+FRAME_SAMPLES = RATE * FRAME_DURATION // 1000
+
+
+def synthetic_flags(frames: int, seed: int = 0) -> np.ndarray:
+    """ Speech turns of ~3 s and pauses of ~1.5 s, with 10% flipped
+    decisions to mimic VAD noise. """
+    rng = np.random.default_rng(seed)
+    flags = np.empty(frames, dtype=bool)
+    i, speech = 0, False
+    while i < frames:
+        n = int(rng.exponential(100 if speech else 50)) + 1
+        flags[i:i + n] = speech
+        i += n
+        speech = not speech
+    noise = rng.random(frames) < 0.1
+    return flags ^ noise
+
+
+def legacy(frames, flags):
+    """ The loop from local_deploy.AudioRecorder.run before the Segmenter. """
+    MAXLEN = 30
+    watcher = collections.deque(maxlen=MAXLEN)
+    triggered, ratio = False, 0.5
+    buffered, utterances = [], 0
+    for frame, is_speech in zip(frames, flags):
+        watcher.append(is_speech)
+        buffered.append(frame)
+        if not triggered:
+            num_voiced = len([x for x in watcher if x])
+            if num_voiced > ratio * watcher.maxlen:
+                triggered = True
+                watcher.clear()
+                buffered = buffered[-MAXLEN:]
+        else:
+            num_unvoiced = len([x for x in watcher if not x])
+            if num_unvoiced > ratio * watcher.maxlen:
+                triggered = False
+                b''.join(buffered)
+                buffered.clear()
+                utterances += 1
+    return utterances
+
+
+def streaming(frames, flags):
+    segmenter = Segmenter(RATE, FRAME_DURATION, vad=lambda frame: False)
+    utterances = 0
+    for frame, is_speech in zip(frames, flags):
+        if segmenter.step(frame, bool(is_speech)) is not None:
+            utterances += 1
+    return utterances
+
+
+def offline(audio, flags):
+    segmenter = Segmenter(RATE, FRAME_DURATION, vad=lambda frame: False)
+    return len(segmenter.segment(audio, flags))
+
+
+def bench(hours: float = 1.0):
+    n = int(hours * 3600 * 1000 / FRAME_DURATION)
+    flags = synthetic_flags(n)
+    audio = np.zeros(n * FRAME_SAMPLES, dtype='<i2')
+    frame = audio[:FRAME_SAMPLES].tobytes()
+    frames = [frame] * n
+    print(f"{hours:.1f} h of audio, {n} frames")
+    counts = {}
+    for name, run in (('legacy loop', lambda: legacy(frames, flags)),
+                      ('Segmenter', lambda: streaming(frames, flags)),
+                      ('offline', lambda: offline(audio, flags))):
+        start_time = time.perf_counter()
+        utterances = run()
+        elapsed = time.perf_counter() - start_time
+        print(f"{name:>12}: {elapsed:6.2f}s  "
+              f"{elapsed / n * 1e6:6.2f} us/frame  "
+              f"x{hours * 3600 / elapsed:8.0f} real time  "
+              f"{utterances} utterances")
+        counts[name] = utterances
+    # Same endpoints; offline also returns the utterance still open at the
+    # end, which the streaming loops never close.
+    assert counts['Segmenter'] == counts['legacy loop']
+    assert counts['offline'] - counts['Segmenter'] in (0, 1)
+
+
+def continuous_speech(seconds: float, seed: int = 0) -> np.ndarray:
+    """ Syllables of ~200 ms with a ~50 ms dip between them, pauses
+    are rarely long enough to end an utterance. """
+    rng = np.random.default_rng(seed)
+    chunks, total = [], 0
+    while total < seconds * RATE:
+        n = int(rng.uniform(0.12, 0.3) * RATE)
+        t = np.arange(n)
+        tone = np.sin(2 * np.pi * rng.uniform(120, 300) * t / RATE)
+        chunks.append(tone * (0.3 + 0.7 * np.hanning(n)) * 12000 +
+                      rng.normal(0, 800, n))
+        gap = int(rng.uniform(0.03, 0.07) * RATE)
+        chunks.append(rng.normal(0, 100, gap))
+        total += n + gap
+    return np.concatenate(chunks).astype('<i2')
+
+
+def cuts(minutes: float = 10.0,
+         max_duration: float = 30.0,
+         search: float = 2.0,
+         overlap: float = 0.2):
+    audio = continuous_speech(minutes * 60)
+    segmenter = Segmenter(RATE, FRAME_DURATION, vad=EnergyVAD(RATE),
+                          max_duration=max_duration, search=search,
+                          overlap=overlap)
+    frames = audio[:len(audio) // FRAME_SAMPLES * FRAME_SAMPLES].reshape(
+        -1, FRAME_SAMPLES)
+    energy = np.mean(frames.astype(np.float64)**2, axis=1)
+    utterances, peak = [], 0
+    for frame in frames:
+        utterance = segmenter.push(frame.tobytes())
+        peak = max(peak, sum(len(f) for f in segmenter._frames))
+        if utterance is not None:
+            utterances.append(utterance)
+    lengths = np.array([u.end - u.start for u in utterances])
+    # Energy of the last frame kept before each forced cut.
+    at_cut = np.array([
+        energy[int(round(u.end / segmenter.frame_time)) - 1]
+        for u, after in zip(utterances, utterances[1:]) if after.continued
+    ])
+    forced = sum(u.continued for u in utterances)
+    print(f"{minutes:.0f} min of continuous speech, "
+          f"{len(utterances)} utterances, {forced} forced cuts")
+    print(f"  utterance length max {lengths.max():.2f}s "
+          f"(limit {max_duration}s), mean {lengths.mean():.2f}s")
+    print(f"  peak buffered audio {peak / 2 / RATE:.2f}s")
+    print(f"  frame energy at cuts: median {np.median(at_cut):.0f}, "
+          f"all frames median {np.median(energy):.0f}")
+    assert lengths.max() <= max_duration + 1e-6
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire({'bench': bench, 'cuts': cuts})
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Cold start: how long importing each entry point takes in a fresh
+interpreter, and which heavy packages (faster-whisper and CTranslate2,
+PyAV, FunASR, aioredis) it pulls in; then the time to the first
+transcript of a fresh process, with and without `preload`.
+
+Imports are measured without REDIS_SERVER set, an entry point that fails
+to import is reported with its error. With `check` every entry point must
+import without any of the heavy packages.
+
+The first transcript needs a real model, `model` by name (downloaded into
+MODEL_DIR when it is set and the model is not there yet) or a local
+directory. A load is timed, then with preload one warm-up inference, then
+two transcriptions of `seconds` of audio: the first one is what the first
+request waits for.
+
+运行方式:
+    python3 -m benchmarks.startup
+    MODEL_DIR=~/models python3 -m benchmarks.startup --model tiny
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import typing
+
+MODULES = ('src.models', 'src.server', 'src.client', 'src.local_deploy',
+           'src.local_deploy_openai', 'src.docker.whisper')
+HEAVY = ('faster_whisper', 'ctranslate2', 'av', 'funasr', 'aioredis')
+
+_IMPORT = """
+import json, sys, time
+start_time = time.perf_counter()
+error = None
+try:
+    import {module}
+except BaseException as e:
+    error = repr(e)
+seconds = time.perf_counter() - start_time
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps(dict(seconds=seconds, error=error, heavy=heavy)))
+"""
+
+_FIRST = """
+import json, time
+start_time = time.perf_counter()
+import numpy as np
+from src.models import load_model, warmup_model
+times = dict(imports=time.perf_counter() - start_time)
+model = load_model({model!r}, 'cpu', 'int8')
+times['load'] = time.perf_counter() - start_time - sum(times.values())
+if {preload!r}:
+    warmup_model(model)
+times['warmup'] = time.perf_counter() - start_time - sum(times.values())
+rng = np.random.default_rng(0)
+audio = (0.1 * rng.standard_normal(int({seconds!r} * 16000))).astype(np.float32)
+for name in ('first', 'second'):
+    segments, _ = model.transcribe(audio, beam_size=5)
+    list(segments)
+    times[name] = time.perf_counter() - start_time - sum(times.values())
+times['to_first'] = times['imports'] + times['load'] + times['warmup'] + \\
+    times['first']
+print(json.dumps(times))
+"""
+
+
+def _python(code: str) -> dict:
+    env = dict(os.environ)
+    env.pop('REDIS_SERVER', None)
+    result = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True,
+                            text=True,
+                            env=env)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines() or ['exit code']
+        return {'error': lines[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def imports(repeat: int = 5) -> typing.Dict[str, dict]:
+    results = {}
+    for module in MODULES:
+        runs = [
+            _python(_IMPORT.format(module=module, heavy=HEAVY))
+            for _ in range(repeat)
+        ]
+        results[module] = dict(runs[-1],
+                               seconds=statistics.median(
+                                   r.get('seconds', 0.0) for r in runs))
+    return results
+
+
+def bench(model: str = 'tiny',
+          seconds: float = 5.0,
+          repeat: int = 5,
+          check: bool = True):
+    print(f"{'module':>24} {'import ms':>10}  heavy packages / error")
+    results = imports(repeat)
+    for module, result in results.items():
+        note = result['error'] or ', '.join(result['heavy']) or '-'
+        print(f"{module:>24} {result['seconds'] * 1e3:10.0f}  {note}")
+    if check:
+        for module, result in results.items():
+            assert result['error'] is None, (module, result['error'])
+            assert not result['heavy'], (module, result['heavy'])
+
+    print(f"\nfirst transcript of {seconds:g}s with {model}, seconds:")
+    columns = ('imports', 'load', 'warmup', 'first', 'second', 'to_first')
+    print(f"{'preload':>8} " + ' '.join(f'{c:>8}' for c in columns))
+    for preload in (False, True):
+        times = _python(
+            _FIRST.format(model=model, preload=preload, seconds=seconds))
+        if 'error' in times:
+            print(f"{str(preload):>8} failed: {times['error']}")
+            continue
+        print(f"{str(preload):>8} " +
+              ' '.join(f'{times[c]:8.2f}' for c in columns))
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Latency of the streaming (LocalAgreement) mode against utterance mode.
+
+Audio is replayed in real time (or `--speed` times faster) into a
+StreamingTranscriber backed by a stub model. The synthetic corpus encodes
+every word as a short tone, the stub "recognises" each tone by its pitch,
+garbles a word that is cut off by the end of the buffer (like Whisper does)
+and costs `base + per_second * buffer seconds`.
+
+运行方式:
+    python3 -m benchmarks.streaming --seconds 20 --speed 4
+    python3 -m benchmarks.streaming --wav a.wav --wav b.wav
+"""
+import time
+import typing
+import wave
+
+import numpy as np
+
+from src.audio import pcm16_to_float32, resample
+from src.streaming import StreamingTranscriber, Word
+
+RATE = 16000
+WORD, GAP, PAUSE = 0.35, 0.05, 0.5
+
+
+def synthetic_speech(seconds: float, seed: int = 0) -> np.ndarray:
+    """ A tone per word, a longer pause every 8 words marks a segment. """
+    rng = np.random.default_rng(seed)
+    chunks, t = [], 0.0
+    while t < seconds:
+        for _ in range(8):
+            freq = rng.integers(20, 80) * 10
+            n = int(WORD * RATE)
+            chunks.append(0.3 * np.sin(2 * np.pi * freq * np.arange(n) / RATE))
+            chunks.append(np.zeros(int(GAP * RATE)))
+            t += WORD + GAP
+        chunks.append(np.zeros(int(PAUSE * RATE)))
+        t += PAUSE
+    return np.concatenate(chunks).astype(np.float32)
+
+
+def load_wav(filename: str) -> np.ndarray:
+    with wave.open(filename, 'rb') as wf:
+        assert wf.getsampwidth() == 2, 'only 16-bit PCM WAV'
+        audio = pcm16_to_float32(wf.readframes(wf.getnframes()))
+        if wf.getnchannels() > 1:
+            audio = audio.reshape(-1, wf.getnchannels()).mean(axis=1)
+        return resample(audio, wf.getframerate(), RATE)
+
+
+class StubModel:
+    def __init__(self, base: float, per_second: float, speed: float):
+        self.base = base
+        self.per_second = per_second
+        self.speed = speed
+        self.calls: typing.List[typing.Tuple[float, float]] = []
+
+    def __call__(self, audio: np.ndarray, context: str):
+        duration = len(audio) / RATE
+        start_time = time.perf_counter()
+        time.sleep((self.base + self.per_second * duration) / self.speed)
+        hop = RATE // 100
+        energy = np.sqrt(np.mean(
+            audio[:len(audio) // hop * hop].reshape(-1, hop)**2, axis=1))
+        voiced = np.concatenate([[False], energy > 0.05, [False]])
+        edges = np.flatnonzero(np.diff(voiced.astype(int)))
+        segments, words = [], []
+        for start, end in zip(edges[::2], edges[1::2]):
+            chunk = audio[start * hop:end * hop]
+            crossings = np.count_nonzero(np.diff(np.signbit(chunk)))
+            freq = int(round(crossings / 2 / (len(chunk) / RATE), -1))
+            text = ' w{}'.format(freq)
+            if end == len(energy):
+                text += '?'  # cut-off word, unstable
+            if words and start / 100 - words[-1].end > PAUSE * 0.8:
+                segments.append(words)
+                words = []
+            words.append(Word(start / 100, end / 100, text))
+        if words:
+            segments.append(words)
+        self.calls.append((duration, time.perf_counter() - start_time))
+        return segments
+
+
+def replay(audio: np.ndarray, step: float, speed: float, model: StubModel,
+           max_buffer: float):
+    online = StreamingTranscriber(model, max_buffer=max_buffer)
+    chunk = int(step * RATE)
+    first_partial, finals = None, []
+    start_time = time.perf_counter()
+    max_buffer_seen = 0.0
+    for i in range(0, len(audio), chunk):
+        # Wait until this chunk has been "spoken".
+        due = start_time + (i + chunk) / RATE / speed
+        time.sleep(max(0.0, due - time.perf_counter()))
+        online.insert_audio(audio[i:i + chunk])
+        max_buffer_seen = max(max_buffer_seen, online.buffer_duration)
+        events = online.process()
+        now = (time.perf_counter() - start_time) * speed
+        for event in events:
+            if event.kind == 'partial' and first_partial is None:
+                first_partial = now - event.start
+        for word in online.committed[len(finals):]:
+            finals.append(now - word.end)
+    online.finish()
+    return first_partial, np.array(finals), max_buffer_seen
+
+
+def bench(seconds: float = 20,
+          wav: typing.List[str] = (),
+          step: float = 1.0,
+          speed: float = 4.0,
+          base: float = 0.05,
+          per_second: float = 0.03,
+          max_buffer: float = 10.0):
+    corpus = [load_wav(f) for f in wav] if wav else [synthetic_speech(seconds)]
+    for audio in corpus:
+        duration = len(audio) / RATE
+        model = StubModel(base, per_second, speed)
+        first_partial, finals, max_buffer_seen = replay(
+            audio, step, speed, model, max_buffer)
+        costs = np.array([c for _, c in model.calls]) * speed
+        print(f"audio {duration:.1f}s, step {step}s, speed x{speed}")
+        if first_partial is not None:
+            print(f"  first partial after {first_partial:.2f}s of its word")
+        if len(finals):
+            print(f"  final latency p50 {np.percentile(finals, 50):.2f}s  "
+                  f"p90 {np.percentile(finals, 90):.2f}s  "
+                  f"({len(finals)} words)")
+        print(f"  model call mean {costs.mean() * 1000:.0f} ms, "
+              f"max {costs.max() * 1000:.0f} ms, "
+              f"buffer peak {max_buffer_seen:.1f}s")
+        # Utterance mode on continuous speech: nothing is shown before the
+        # end of the audio, then the whole thing is decoded at once.
+        whole = base + per_second * duration
+        print(f"  utterance mode: first text after {duration + whole:.2f}s, "
+              f"single decode {whole * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Accuracy against CPU cost of the VAD backends in src/vad.py.
+
+The labelled corpus is synthetic: "speech" is a pitch-varying glottal pulse
+train through two formant resonators with a syllable-rate envelope and the
+odd fricative burst, "non-speech" is silence, mains hum or steady noise.
+Background noise at `snr` dB is laid over everything. Frame labels come
+from the generator, so precision/recall are exact. Silero is trained on
+real voices and mostly rejects the synthetic one, treat its recall here as
+a lower bound and its CPU cost as the useful number.
+
+Each backend is timed per frame (what a live recorder does) and in batches
+(the offline segmenter), as CPU seconds per hour of audio.
+
+运行方式:
+    python3 -m benchmarks.vad --minutes 10 --snr 10
+    python3 -m benchmarks.vad --backends energy,silero
+"""
+import time
+import typing
+
+import numpy as np
+
+from src import vad
+
+RATE = 16000
+FRAME = RATE * 30 // 1000
+
+
+def _resonator(x: np.ndarray, freq: float, bandwidth: float) -> np.ndarray:
+    r = np.exp(-np.pi * bandwidth / RATE)
+    a1, a2 = -2 * r * np.cos(2 * np.pi * freq / RATE), r * r
+    y = np.zeros_like(x)
+    for i in range(2, len(x)):
+        y[i] = x[i] - a1 * y[i - 1] - a2 * y[i - 2]
+    return y
+
+
+def _speech(seconds: float, rng: np.random.Generator) -> np.ndarray:
+    n = int(seconds * RATE)
+    pitch = rng.uniform(100, 220) * (1 + 0.15 * np.sin(
+        2 * np.pi * rng.uniform(0.5, 2) * np.arange(n) / RATE))
+    phase = np.cumsum(pitch / RATE)
+    pulses = np.diff(np.floor(phase), prepend=0.0)
+    voiced = _resonator(pulses, rng.uniform(400, 800), 80) + \
+        0.5 * _resonator(pulses, rng.uniform(1100, 2200), 120)
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3, 6) *
+                                  np.arange(n) / RATE)**2
+    signal = voiced * envelope
+    for _ in range(int(seconds * 2)):
+        start = rng.integers(0, max(1, n - RATE // 10))
+        signal[start:start + RATE // 10] += rng.normal(0, 0.3, RATE // 10)
+    return signal / (np.abs(signal).max() + 1e-9) * rng.uniform(0.2, 0.6)
+
+
+def _nonspeech(seconds: float, rng: np.random.Generator) -> np.ndarray:
+    n = int(seconds * RATE)
+    kind = rng.integers(0, 3)
+    if kind == 0:
+        return np.zeros(n)
+    if kind == 1:
+        return 0.05 * np.sin(2 * np.pi * 50 * np.arange(n) / RATE)
+    return rng.normal(0, 0.02, n)
+
+
+def corpus(seconds: float, snr: float, seed: int = 0):
+    """ Returns int16 audio and one label per 30 ms frame. """
+    rng = np.random.default_rng(seed)
+    chunks, labels, t = [], [], 0.0
+    speech = False
+    while t < seconds:
+        duration = round(rng.uniform(0.6, 3.0) / 0.03) * 0.03
+        chunk = _speech(duration, rng) if speech else _nonspeech(
+            duration, rng)
+        chunks.append(chunk)
+        labels.append(np.full(int(round(duration / 0.03)), speech))
+        t += duration
+        speech = not speech
+    audio = np.concatenate(chunks)
+    noise = rng.normal(0, 1, len(audio))
+    level = np.sqrt(np.mean(audio**2))
+    audio = audio + noise * level / 10**(snr / 20)
+    audio = np.clip(audio, -1, 1)
+    labels = np.concatenate(labels)
+    n = min(len(labels), len(audio) // FRAME)
+    return (audio[:n * FRAME] * 32767).astype('<i2'), labels[:n]
+
+
+def _score(flags: np.ndarray, labels: np.ndarray) -> typing.Dict[str, float]:
+    tp = np.count_nonzero(flags & labels)
+    fp = np.count_nonzero(flags & ~labels)
+    fn = np.count_nonzero(~flags & labels)
+    precision = tp / max(1, tp + fp)
+    recall = tp / max(1, tp + fn)
+    return {
+        'accuracy': np.mean(flags == labels),
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / max(1e-9, precision + recall)
+    }
+
+
+def bench(minutes: float = 5.0,
+          snr: float = 20.0,
+          backends: typing.Union[str, typing.Tuple[str, ...]] = vad.BACKENDS,
+          batch: int = 100):
+    if isinstance(backends, str):
+        backends = backends.split(',')
+    audio, labels = corpus(minutes * 60, snr)
+    frames = audio.reshape(-1, FRAME)
+    hours = len(audio) / RATE / 3600
+    print(f"{len(audio) / RATE:.0f}s of audio, {len(frames)} frames, "
+          f"{labels.mean():.0%} speech, SNR {snr} dB")
+    print(f"{'backend':>8} {'acc':>6} {'prec':>6} {'recall':>6} {'f1':>6} "
+          f"{'cpu s/h frame':>14} {'cpu s/h batch':>14}")
+    for name in backends:
+        try:
+            detector = vad.create(name, RATE)
+        except (ImportError, RuntimeError) as e:
+            print(f"{name:>8} skipped: {e}")
+            continue
+        start = time.process_time()
+        streamed = np.array([detector(f.tobytes()) for f in frames])
+        per_frame = (time.process_time() - start) / hours
+        detector.reset()
+        start = time.process_time()
+        flags = np.concatenate([
+            detector.batch(frames[i:i + batch])
+            for i in range(0, len(frames), batch)
+        ])
+        per_batch = (time.process_time() - start) / hours
+        assert np.mean(streamed == flags) > 0.99, name
+        s = _score(flags, labels)
+        print(f"{name:>8} {s['accuracy']:6.3f} {s['precision']:6.3f} "
+              f"{s['recall']:6.3f} {s['f1']:6.3f} "
+              f"{per_frame:14.1f} {per_batch:14.1f}")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
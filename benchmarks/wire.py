@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Compare the old per-utterance WAV path (write output.wav, read it back,
+decode with av on the server) with the binary frame format.
+
+运行方式:
+    python3 -m benchmarks.wire --seconds 5 --utterances 50
+"""
+import io
+import os
+import tempfile
+import time
+import typing
+import wave
+
+import numpy as np
+
+from src import protocol
+from src.audio import load_audio
+
+RATE = 16000
+
+
+def synthetic_utterance(seconds: float, seed: int = 0) -> bytes:
+    """ Speech-like int16 PCM: a few modulated harmonics plus noise. """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * RATE)) / RATE
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    voice = sum(np.sin(2 * np.pi * k * f0 * t) / k for k in range(1, 6))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    signal = 0.2 * voice * envelope + 0.01 * rng.standard_normal(len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes()
+
+
+def wav_path(pcm: bytes, workdir: str) -> typing.Tuple[bytes, np.ndarray]:
+    filename = os.path.join(workdir, 'output.wav')
+    with wave.open(filename, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(pcm)
+    with open(filename, 'rb') as f:
+        blob = f.read()
+    from faster_whisper.audio import decode_audio
+    return blob, decode_audio(io.BytesIO(blob), sampling_rate=RATE)
+
+
+def frame_path(pcm: bytes, codec: str) -> typing.Tuple[bytes, np.ndarray]:
+    blob = protocol.encode(pcm, 1, time.time(), codec=codec)
+    return blob, load_audio(blob)
+
+
+def bench(seconds: float = 5, utterances: int = 50):
+    pcm = synthetic_utterance(seconds)
+    expected = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+
+    # Round trip: the frame format must be lossless for int16 PCM.
+    for codec in protocol.CODECS:
+        header, payload = protocol.decode(
+            protocol.encode(pcm, 7, 1.5, codec=codec))
+        assert payload == pcm and header.sequence == 7
+        assert header.timestamp == 1.5 and header.codec == codec
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cases = [('wav+disk+av', lambda: wav_path(pcm, workdir))]
+        cases += [(f'frame/{codec}', lambda c=codec: frame_path(pcm, c))
+                  for codec in protocol.CODECS]
+        for name, run in cases:
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            for _ in range(utterances):
+                blob, audio = run()
+            cpu = (time.process_time() - cpu_start) / utterances
+            wall = (time.perf_counter() - wall_start) / utterances
+            assert np.allclose(audio, expected, atol=1e-3)
+            print(f"{name:>12}: {len(blob) / seconds / 1024:8.1f} KiB/s  "
+                  f"cpu {cpu * 1000:7.2f} ms  wall {wall * 1000:7.2f} ms "
+                  f"per utterance")
+
+
+if __name__ == "__main__":
+    import fire
+    fire.Fire(bench)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+import io
+import sys
+import typing
+import wave
+
+import numpy as np
+
+from . import protocol
+
+SAMPLE_RATE = 16000
+DECODE_CHUNK = 64 * 1024  # bytes PyAV reads from the file at a time
+
+
+class AudioTooLong(ValueError):
+    """ The audio is over the duration limit given to decode_file. """
+
+
+def is_invalid_data(error: BaseException) -> bool:
+    """ Whether PyAV refused the input as not audio it can decode. PyAV is
+    imported with the first decode, without it no error can be its own.
+    """
+    av = sys.modules.get('av')
+    return av is not None and isinstance(error, av.error.InvalidDataError)
+
+
+def pcm16_to_float32(data: bytes) -> np.ndarray:
+    """ Little-endian int16 PCM to float32 samples in [-1, 1). """
+    return np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+
+
+def resample(audio: np.ndarray, orig_rate: int, sample_rate: int) -> np.ndarray:
+    """ Linear-interpolation resampling, good enough for speech input. """
+    if orig_rate == sample_rate:
+        return audio
+    n = int(round(len(audio) * sample_rate / orig_rate))
+    x = np.arange(n, dtype=np.float64) * orig_rate / sample_rate
+    return np.interp(x, np.arange(len(audio)), audio).astype(np.float32)
+
+
+def frame_to_float32(header: protocol.Header,
+                     pcm: bytes,
+                     sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    if header.sample_width != 2:
+        raise protocol.ProtocolError(
+            f"Unsupported sample width: {header.sample_width}")
+    audio = pcm16_to_float32(pcm)
+    if header.channels > 1:
+        audio = audio.reshape(-1, header.channels).mean(axis=1)
+    return resample(audio, header.sample_rate, sample_rate)
+
+
+def load_audio(blob: bytes, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """ Decode an audio blob in memory into mono float32 samples.
+
+    Protocol frames and 16-bit mono WAV at the target rate are read straight
+    into NumPy. Anything else goes through the av decoder bundled with
+    faster-whisper.
+    """
+    if protocol.is_frame(blob):
+        header, pcm = protocol.decode(blob)
+        return frame_to_float32(header, pcm, sample_rate)
+    if blob[:4] == b'RIFF' and blob[8:12] == b'WAVE':
+        with wave.open(io.BytesIO(blob), 'rb') as wf:
+            if (wf.getnchannels() == 1 and wf.getsampwidth() == 2
+                    and wf.getframerate() == sample_rate):
+                return pcm16_to_float32(wf.readframes(wf.getnframes()))
+    return decode_file(io.BytesIO(blob), sample_rate)
+
+
+def decode_file(file: typing.Union[str, typing.BinaryIO],
+                sample_rate: int = SAMPLE_RATE,
+                max_duration: float = 0.0,
+                chunk_size: int = DECODE_CHUNK) -> np.ndarray:
+    """ Decode a path or seekable file object into mono float32 samples.
+
+    PyAV pulls `chunk_size` bytes at a time and every decoded frame is
+    resampled straight into one output array, sized from the container's
+    duration when it has one. Besides that array memory stays at a few
+    chunks, whatever the file size. Raises AudioTooLong before decoding
+    when the container says it is longer than `max_duration` seconds (0:
+    no limit), or as soon as the decoded audio is.
+    """
+    import av
+    limit = int(max_duration * sample_rate) if max_duration else 0
+    with av.open(file, mode='r', buffer_size=chunk_size,
+                 metadata_errors='ignore') as container:
+        stream = container.streams.audio[0]
+        if stream.duration is not None and stream.time_base is not None:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            duration = container.duration / av.time_base
+        else:
+            duration = 0.0
+        if limit and duration > max_duration:
+            raise AudioTooLong(
+                f"{duration:.1f}s of audio, the limit is {max_duration:g}s")
+        audio = np.empty(int(duration * sample_rate) + sample_rate,
+                         dtype=np.float32)
+        n = 0
+        # s16 like faster-whisper: float output downmixes at another gain.
+        resampler = av.AudioResampler(format='s16',
+                                      layout='mono',
+                                      rate=sample_rate)
+        # Codec frames are small, resampling about a second at a time
+        # saves most of the per-call overhead.
+        fifo = av.AudioFifo()
+        group = stream.rate or sample_rate
+
+        def append(frames) -> None:
+            nonlocal n
+            for frame in frames:
+                samples = frame.to_ndarray().reshape(-1)
+                if n + len(samples) > len(audio):
+                    # No duration or a wrong one, grow geometrically.
+                    audio.resize(max(2 * len(audio), n + len(samples)),
+                                 refcheck=False)
+                np.multiply(samples,
+                            1 / 32768.0,
+                            out=audio[n:n + len(samples)],
+                            casting='unsafe')
+                n += len(samples)
+            if limit and n > limit:
+                raise AudioTooLong(
+                    f"More than {max_duration:g}s of audio")
+
+        for packet in container.demux(stream):
+            try:
+                frames = packet.decode()
+            except av.error.InvalidDataError:
+                continue  # skip a corrupt packet like faster-whisper does
+            for frame in frames:
+                frame.pts = None
+                fifo.write(frame)
+                if fifo.samples >= group:
+                    append(resampler.resample(fifo.read()))
+        if fifo.samples:
+            append(resampler.resample(fifo.read()))
+        append(resampler.resample(None))
+    audio.resize(n, refcheck=False)
+    return audio
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+import asyncio
+import collections
+import logging
+import time
+import typing
+
+from .executor import cpu_pool
+
+
+class QueueFull(Exception):
+    """ Raised by BatchScheduler.submit when the pending queue is full. """
+
+
+class BatchScheduler:
+    """ Dynamic micro-batching in front of a blocking batch function.
+
+    Requests that arrive within `max_queue_delay` seconds of the first
+    pending one, up to `max_batch_size`, are handed to `batch_fn` as a single
+    list and each caller gets its own result back. Batches run one at a time,
+    so concurrent callers share the model instead of competing for it.
+
+    Args:
+        batch_fn: blocking callable, takes a list of items and returns a list
+            of results in the same order.
+        max_batch_size: upper bound of items per batch, 1 disables batching.
+        max_queue_delay: how long (seconds) the first item of a batch may wait
+            for others to join.
+        max_queue_size: pending items allowed before submit raises QueueFull,
+            slots taken with reserve count against it too.
+    """
+
+    def __init__(self,
+                 batch_fn: typing.Callable[[typing.List[typing.Any]],
+                                           typing.List[typing.Any]],
+                 max_batch_size: int = 8,
+                 max_queue_delay: float = 0.01,
+                 max_queue_size: int = 64) -> None:
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_queue_delay = max_queue_delay
+        self.max_queue_size = max_queue_size
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._task: typing.Optional[asyncio.Task] = None
+        # Enqueue times, FIFO like the queue itself.
+        self._times: typing.Deque[float] = collections.deque()
+        self._reserved = 0
+
+    @property
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def queue_delay(self) -> float:
+        """ Seconds the oldest pending request has been waiting. """
+        return time.monotonic() - self._times[0] if self._times else 0.0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+        self._times.clear()
+
+    def _full(self) -> bool:
+        return 0 < self.max_queue_size <= self.qsize + self._reserved
+
+    def reserve(self) -> typing.Callable[[], None]:
+        """ Admits work that runs outside the batches (e.g. decoding with
+        timestamps) against the same limit as submit: raises QueueFull when
+        it is reached, otherwise returns the function that frees the slot.
+        """
+        if self._full():
+            raise QueueFull(f"{self.qsize + self._reserved} requests pending")
+        self._reserved += 1
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._reserved -= 1
+
+        return release
+
+    async def submit(self, item: typing.Any) -> typing.Any:
+        if self._queue is None:
+            raise RuntimeError("BatchScheduler is not started")
+        if self._full():
+            raise QueueFull(f"{self.qsize + self._reserved} requests pending")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise QueueFull(
+                f"{self._queue.qsize()} requests pending") from None
+        self._times.append(time.monotonic())
+        return await future
+
+    async def _get(self) -> typing.Tuple[typing.Any, asyncio.Future]:
+        entry = await self._queue.get()
+        if self._times:
+            self._times.popleft()
+        return entry
+
+    async def _collect(self) -> typing.List[typing.Tuple[typing.Any, asyncio.Future]]:
+        batch = [await self._get()]
+        deadline = time.monotonic() + self.max_queue_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Drop requests whose callers already went away.
+        return [(item, f) for item, f in batch if not f.done()]
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = await cpu_pool.run(self.batch_fn, items)
+            except Exception as e:
+                logging.error(e, exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Content-addressed cache of transcription results.
+
+Keys hash the decoded PCM together with every setting that changes the
+output (model, prompt, language, beam size, VAD...), so a retried upload
+hits no matter how it was encoded on the wire. Values are anything JSON
+serialisable.
+
+Two tiers: an in-process LRU bounded by the encoded size of its values,
+and optionally Redis with a TTL, shared by every worker. A Redis hit is
+copied into the local tier.
+"""
+import hashlib
+import json
+import logging
+import threading
+import typing
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_PREFIX = 'STS:CACHE:'
+
+
+def fingerprint(audio: np.ndarray, **settings) -> str:
+    """ Hex digest of the samples and the settings, key order does not
+    matter. """
+    # sha256 has hardware support on most CPUs, faster than blake2b here.
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(audio, dtype=np.float32).data)
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+class ResultCache:
+    """ Two-tier result cache.
+
+    Args:
+        max_bytes: budget of the in-process tier, least recently used
+            entries are evicted first. 0 disables the tier.
+        redis: optional aioredis client for the shared tier.
+        ttl: seconds a Redis entry lives.
+    """
+
+    def __init__(self,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 redis=None,
+                 ttl: int = 24 * 3600) -> None:
+        self.max_bytes = max_bytes
+        self.redis = redis
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, typing.Tuple[typing.Any, int]]' = \
+            OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0  # bytes held by the local tier
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.redis_hits) / lookups
+            if lookups else 0.0
+        }
+
+    def _get_local(self, key: str) -> typing.Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put_local(self, key: str, value: typing.Any, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    async def get(self, key: str) -> typing.Any:
+        """ Cached value or None. """
+        value = self._get_local(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.redis is not None:
+            try:
+                blob = await self.redis.get(CACHE_PREFIX + key)
+            except Exception as e:
+                # The cache is an optimisation, never fail a request on it.
+                logging.warning('Result cache read failed: {}'.format(e))
+                blob = None
+            if blob is not None:
+                value = json.loads(blob)
+                self._put_local(key, value, len(blob))
+                self.redis_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: typing.Any) -> None:
+        blob = json.dumps(value, ensure_ascii=False).encode()
+        self._put_local(key, value, len(blob))
+        if self.redis is not None:
+            try:
+                await self.redis.set(CACHE_PREFIX + key, blob, ex=self.ttl)
+            except Exception as e:
+                logging.warning('Result cache write failed: {}'.format(e))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+Audio capture decoupled from whoever consumes it.
+
+PortAudio calls `_callback` on its own thread with every chunk, the chunk
+is copied into a preallocated int16 ring buffer and the consumer (VAD,
+WAV building, even a blocking transcribe) reads fixed-size frames at its
+own pace. With one producer and one consumer each side only moves its own
+index, so no lock is needed; an Event just wakes a waiting reader.
+
+When the consumer falls more than `seconds` behind, new chunks are
+dropped and counted in `overflows`, reads that time out waiting for audio
+are counted in `underruns`.
+"""
+import logging
+import threading
+import time
+import typing
+import wave
+
+import numpy as np
+
+
+class Capture:
+    """ Microphone capture through the PyAudio callback API.
+
+    Args:
+        sample_rate (int): capture rate in Hz.
+        channels (int): interleaved channels.
+        chunk (int): frames per PortAudio callback.
+        seconds (float): ring buffer capacity.
+    """
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 channels: int = 1,
+                 chunk: int = 256,
+                 seconds: float = 60.0) -> None:
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.chunk = chunk
+        self.sample_width = 2
+        self._ring = np.zeros(int(seconds * sample_rate) * channels,
+                              dtype='<i2')
+        self._write = 0  # total samples written, producer only
+        self._read = 0  # total samples read, consumer only
+        self._ready = threading.Event()
+        self._closed = False
+        self.overflows = 0  # chunks dropped because the ring was full
+        self.dropped = 0  # samples in those chunks
+        self.device_overflows = 0  # overflows reported by PortAudio
+        self.underruns = 0  # reads that timed out
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def available(self) -> int:
+        """ Samples waiting to be read. """
+        return self._write - self._read
+
+    def stats(self) -> typing.Dict[str, float]:
+        return {
+            'buffered': self.available / self.channels / self.sample_rate,
+            'overflows': self.overflows,
+            'dropped': self.dropped / self.channels / self.sample_rate,
+            'device_overflows': self.device_overflows,
+            'underruns': self.underruns
+        }
+
+    def _push(self, data: bytes) -> None:
+        samples = np.frombuffer(data, dtype='<i2')
+        n, size = len(samples), len(self._ring)
+        if n > size - (self._write - self._read):
+            self.overflows += 1
+            self.dropped += n
+        else:
+            start = self._write % size
+            head = min(n, size - start)
+            self._ring[start:start + head] = samples[:head]
+            self._ring[:n - head] = samples[head:]
+            self._write += n  # publish only once the copy is done
+        self._ready.set()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        import pyaudio
+        if status & pyaudio.paInputOverflow:
+            self.device_overflows += 1
+        self._push(in_data)
+        return None, pyaudio.paContinue
+
+    def read(self,
+             frames: int,
+             timeout: typing.Optional[float] = None) -> typing.Optional[bytes]:
+        """ Blocks for `frames` frames of PCM, returns None on timeout or
+        once the capture is closed and drained.
+        """
+        n, size = frames * self.channels, len(self._ring)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._write - self._read < n:
+            if self._closed:
+                return None
+            self._ready.clear()
+            if self._write - self._read >= n:
+                break
+            wait = None if deadline is None else deadline - time.monotonic()
+            if (wait is not None and wait <= 0) or \
+                    not self._ready.wait(wait):
+                self.underruns += 1
+                return None
+        start = self._read % size
+        head = min(n, size - start)
+        data = np.concatenate([self._ring[start:start + head],
+                               self._ring[:n - head]]).tobytes()
+        self._read += n
+        return data
+
+    def start(self) -> 'Capture':
+        import pyaudio
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(format=pyaudio.paInt16,
+                                        channels=self.channels,
+                                        rate=self.sample_rate,
+                                        input=True,
+                                        frames_per_buffer=self.chunk,
+                                        stream_callback=self._callback)
+        self._stream.start_stream()
+        return self
+
+    def stop(self) -> None:
+        self._closed = True
+        self._ready.set()
+        self._stream.stop_stream()
+        self._stream.close()
+        self._audio.terminate()
+        if self.overflows or self.device_overflows:
+            logging.warning('Audio capture lost data: {}'.format(self.stats()))
+
+    def __enter__(self) -> 'Capture':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+class WavReplay(Capture):
+    """ Stand-in for the microphone: replays a 16-bit WAV file through the
+    same callback path at real-time rate (or `speed` times faster), so the
+    recorders run without a sound card. The file must match `sample_rate`
+    and `channels`.
+    """
+
+    def __init__(self,
+                 filename: str,
+                 sample_rate: int = 16000,
+                 channels: int = 1,
+                 chunk: int = 256,
+                 seconds: float = 60.0,
+                 speed: float = 1.0) -> None:
+        super().__init__(sample_rate, channels, chunk, seconds)
+        self.filename = filename
+        self.speed = speed
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def _replay(self) -> None:
+        with wave.open(self.filename, 'rb') as wf:
+            if (wf.getframerate(), wf.getnchannels(),
+                    wf.getsampwidth()) != (self.sample_rate, self.channels,
+                                           2):
+                raise ValueError('{} is not {} Hz, {} channel 16-bit'.format(
+                    self.filename, self.sample_rate, self.channels))
+            start_time, sent = time.monotonic(), 0
+            while not self._closed:
+                data = wf.readframes(self.chunk)
+                if not data:
+                    break
+                sent += len(data) // 2 // self.channels
+                due = start_time + sent / self.sample_rate / self.speed
+                time.sleep(max(0.0, due - time.monotonic()))
+                self._push(data)
+        self._closed = True
+        self._ready.set()
+
+    def start(self) -> 'WavReplay':
+        self._thread = threading.Thread(target=self._replay, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._closed = True
+        self._ready.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -1,102 +1,210 @@
 import asyncio
-import collections
-import wave
-from collections import deque
+import json
+import threading
+import time
+import typing
+import uuid
 
-import aioredis
-import pyaudio
-import webrtcvad
 import logging
+from . import executor, metrics, protocol
+from .capture import Capture, WavReplay
 from .utils import asyncformer
-from .config import REDIS_SERVER
+from .config import redis_server
+from .consumer import AUDIO_STREAM, result_stream
+from .segmenter import Segmenter, stitch
 
 # Audio recording parameters
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
 CHUNK = 256
 FRAME_DURATION = 30  # 毫秒
 FRAME_SIZE = int(RATE * FRAME_DURATION / 1000)
-
-g_frames = deque(maxlen=100)
-audio = pyaudio.PyAudio()
-logging.basicConfig(level=logging.INFO)
-
-# for audio recording
-stream = audio.open(format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK)
-
-
-async def sync_audio():
-    # Sync audio to redis server list STS:AUDIO
-    async with aioredis.from_url(REDIS_SERVER) as redis:
+CAPTURE_BUFFER = 60.0  # seconds of audio the capture ring buffer holds
+
+VAD = 'webrtc'  # see src/vad.py, the name travels with each utterance
+MAX_UTTERANCE = 30.0  # seconds, longer speech is cut at a quiet frame
+QUEUE_SIZE = 100  # utterances waiting for upload
+MAX_BATCH = 16  # utterances pushed to redis in one round trip
+METRICS_PORT = 9101  # Prometheus /metrics of this client, 0 disables it
+
+g_codec = 'raw'  # negotiated with the server in sync_audio
+g_sequence = 0
+g_dropped = 0
+g_continued = set()  # sequences that overlap the previous one
+g_stop = threading.Event()
+SESSION = uuid.uuid4().hex  # routes this client's results back to it
+# PortAudio fills the ring from its callback thread, the recording thread
+# reads frames from it; created and opened in main.
+g_capture: typing.Optional[Capture] = None
+
+
+def enqueue(queue: asyncio.Queue, content: bytes):
+    # Runs on the event loop. When uploads fall behind, the oldest utterance
+    # is dropped, loudly, so the newest speech still gets through.
+    global g_dropped
+    if queue.full():
+        queue.get_nowait()
+        g_dropped += 1
+        metrics.DROPPED.inc(reason='upload_queue')
+        logging.warning(
+            'Upload queue full, dropped oldest utterance ({} so far)'.format(
+                g_dropped))
+    queue.put_nowait(content)
+
+
+async def sync_audio(queue: asyncio.Queue):
+    # Sync audio to redis server stream STS:AUDIO_STREAM
+    global g_codec
+    import aioredis
+    async with aioredis.from_url(redis_server()) as redis:
+        codecs = [c.decode() for c in await redis.smembers('STS:CODECS')]
+        g_codec = protocol.negotiate(protocol.CODECS, codecs)
+        logging.info('Audio codec: {}'.format(g_codec))
         while True:
-            if g_frames:
-                content = g_frames.pop()
-                await redis.rpush('STS:AUDIOS', content)
-                logging.info('Sync audio to redis server')
-
-
-def export_wav(data, filename):
-    wf = wave.open(filename, 'wb')
-    wf.setnchannels(CHANNELS)
-    wf.setsampwidth(audio.get_sample_size(FORMAT))
-    wf.setframerate(RATE)
-    wf.writeframes(b''.join(data))
-    wf.close()
-
-
-def record_until_silence():
-    frames = collections.deque(maxlen=30)  # 保存最近 30 个帧
-    tmp = collections.deque(maxlen=1000)
-    vad = webrtcvad.Vad()
-    vad.set_mode(1)  # 敏感度，0 到 3，0 最不敏感，3 最敏感
-    triggered = False
-    frames.clear()
-    ratio = 0.5
-    while True:
-        frame = stream.read(FRAME_SIZE)
-        is_speech = vad.is_speech(frame, RATE)
-        if not triggered:
-            frames.append((frame, is_speech))
-            tmp.append(frame)
-            num_voiced = len([f for f, speech in frames if speech])
-            if num_voiced > ratio * frames.maxlen:
-                logging.info("start recording...")
-                triggered = True
-                frames.clear()
+            batch = [await queue.get()]
+            while len(batch) < MAX_BATCH and not queue.empty():
+                batch.append(queue.get_nowait())
+            with metrics.STAGE_SECONDS.time(stage='upload'):
+                async with redis.pipeline(transaction=False) as pipe:
+                    for content in batch:
+                        # 'vad' tells the server the audio is already
+                        # segmented.
+                        pipe.xadd(AUDIO_STREAM, {
+                            'audio': content,
+                            'session': SESSION,
+                            'vad': VAD
+                        })
+                    await pipe.execute()
+            logging.info('Sync {} audio chunk(s) to redis server'.format(
+                len(batch)))
+
+
+async def receive_results():
+    # Block on this session's result stream, one round trip per result.
+    import aioredis
+    key = result_stream(SESSION)
+    last_id = '0'  # fresh session id, nothing to skip
+    texts = {}  # sequence -> text, to stitch forced cuts
+    async with aioredis.from_url(redis_server()) as redis:
+        while True:
+            response = await redis.xread({key: last_id}, block=0)
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    result = json.loads(fields[b'result'])
+                    latency = result.get('latency')
+                    if latency is not None:
+                        metrics.STAGE_SECONDS.observe(latency, stage='total')
+                    text, sequence = result['text'], result.get('sequence')
+                    if sequence is not None:
+                        if sequence in g_continued and sequence - 1 in texts:
+                            text = stitch(texts[sequence - 1], text)
+                        g_continued.discard(sequence)
+                        texts[sequence] = result['text']
+                        if len(texts) > 100:
+                            texts.pop(min(texts))
+                    print('[{}] {}'.format(
+                        '-' if latency is None else '{:.2f}s'.format(latency),
+                        text))
+
+
+def encode_frames(data, timestamp: float) -> bytes:
+    global g_sequence
+    g_sequence += 1
+    frame = protocol.encode(b''.join(data),
+                            sequence=g_sequence,
+                            timestamp=timestamp,
+                            sample_rate=RATE,
+                            channels=CHANNELS,
+                            sample_width=g_capture.sample_width,
+                            codec=g_codec)
+    metrics.FRAME_BYTES.observe(len(frame), codec=g_codec)
+    return frame
+
+
+def record_until_silence(segmenter: Segmenter) -> typing.Optional[bytes]:
+    while not g_stop.is_set():
+        frame = g_capture.read(FRAME_SIZE, timeout=1.0)
+        if frame is None:
+            if not g_capture.closed:
+                continue
+            # Replay finished, hand over what is left and stop recording.
+            g_stop.set()
+            utterance = segmenter.flush()
         else:
-            frames.append((frame, is_speech))
-            tmp.append(frame)
-            num_unvoiced = len([f for f, speech in frames if not speech])
-            if num_unvoiced > ratio * frames.maxlen:
-                logging.info("stop recording...")
-                export_wav(tmp, 'output.wav')
-                with open('output.wav', 'rb') as f:
-                    g_frames.appendleft(f.read())
-                break
-
-
-async def record_audio():
-    while True:
-        await asyncformer(record_until_silence)
+            triggered = segmenter.triggered
+            utterance = segmenter.push(frame)
+            if segmenter.triggered and not triggered:
+                logging.info("start recording...")
+        if utterance is not None:
+            logging.info("stop recording...")
+            # Silence the VAD waited for, plus audio captured but not read.
+            backlog = g_capture.available / CHANNELS / RATE
+            metrics.STAGE_SECONDS.observe(
+                segmenter.trailing_silence + backlog, stage='endpoint')
+            duration = utterance.end - utterance.start
+            content = encode_frames([utterance.pcm], time.time() - duration)
+            if utterance.continued:
+                g_continued.add(g_sequence)
+            return content
+    return None
+
+
+def record_forever(loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+    # Recording thread, hands every utterance to the event loop.
+    segmenter = Segmenter(sample_rate=RATE,
+                          frame_duration=FRAME_DURATION,
+                          vad=VAD,
+                          max_duration=MAX_UTTERANCE)
+    overflows = 0
+    while not g_stop.is_set():
+        content = record_until_silence(segmenter)
+        if content is not None:
+            loop.call_soon_threadsafe(enqueue, queue, content)
+        if g_capture.overflows != overflows:
+            metrics.DROPPED.inc(g_capture.overflows - overflows,
+                                reason='capture_overflow')
+            overflows = g_capture.overflows
+            logging.warning('Capture buffer full, audio lost: {}'.format(
+                g_capture.stats()))
+
+
+async def record_audio(queue: asyncio.Queue):
+    await asyncformer(record_forever, asyncio.get_running_loop(), queue)
 
 
 async def main():
+    global g_capture
+    if g_capture is None:
+        g_capture = Capture(RATE, CHANNELS, CHUNK, seconds=CAPTURE_BUFFER)
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    metrics.QUEUE_DEPTH.track(queue.qsize, queue='upload')
+    metrics.QUEUE_DEPTH.track(lambda: g_capture.available // CHANNELS,
+                              queue='capture_samples')
+    g_capture.start()
     try:
-        task2 = asyncio.create_task(record_audio())
-        task3 = asyncio.create_task(sync_audio())
-        await asyncio.gather(task2, task3)
-    except KeyboardInterrupt:
-        stream.stop_stream()
-        stream.close()
-        audio.terminate()
-
-
-def api():
+        task2 = asyncio.create_task(record_audio(queue))
+        task3 = asyncio.create_task(sync_audio(queue))
+        task4 = asyncio.create_task(receive_results())
+        await asyncio.gather(task2, task3, task4)
+    finally:
+        g_stop.set()
+        executor.shutdown()
+        g_capture.stop()
+
+
+def api(wav: typing.Optional[str] = None, metrics_port: int = METRICS_PORT):
+    """ Record from the microphone, or replay a 16 kHz mono WAV file in
+    real time with `--wav`. Prometheus metrics are served on
+    `metrics_port`, 0 disables them.
+    """
+    global g_capture
+    logging.basicConfig(level=logging.INFO)
+    if metrics_port:
+        metrics.serve(metrics_port)
+    if wav is not None:
+        g_capture = WavReplay(wav, RATE, CHANNELS, CHUNK,
+                              seconds=CAPTURE_BUFFER)
     return asyncio.run(main())
 
 
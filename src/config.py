@@ -1,11 +1,16 @@
 import os
 
-from dotenv import load_dotenv
 
-load_dotenv()
-REDIS_SERVER = os.getenv('REDIS_SERVER')
-
-if REDIS_SERVER is None:
-    raise EnvironmentError(
-        "The REDIS_SERVER environment variable is not set. "
-        "Please set it in your .env file or as an environment variable.")
+def redis_server() -> str:
+    """ $REDIS_SERVER, from the environment or a .env file. Read when a
+    connection is made, so importing the modules that need it does not
+    require it to be set.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    url = os.getenv('REDIS_SERVER')
+    if url is None:
+        raise EnvironmentError(
+            "The REDIS_SERVER environment variable is not set. "
+            "Please set it in your .env file or as an environment variable.")
+    return url
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+import asyncio
+import logging
+import os
+import socket
+import time
+import typing
+
+from . import metrics
+
+AUDIO_STREAM = 'STS:AUDIO_STREAM'
+GROUP = 'STS:WORKERS'
+DEAD_LETTER_STREAM = 'STS:AUDIO_DEAD'
+RESULT_TTL = 3600  # seconds a session's results outlive its last update
+
+
+def result_stream(session: str) -> str:
+    return 'STS:RESULTS:{}'.format(session)
+
+
+def queued_seconds(entry_id: bytes) -> float:
+    """ Seconds since the entry was added. Entry ids start with the XADD
+    time in ms, on the Redis clock, so the client's clock plays no part. """
+    added = int(entry_id.split(b'-')[0]) / 1000
+    return max(0.0, time.time() - added)
+
+
+Handler = typing.Callable[[bytes, typing.Dict[bytes, bytes]],
+                          typing.Awaitable[None]]
+
+
+class StreamConsumer:
+    """ Reliable Redis Streams consumer with N concurrent workers.
+
+    Every worker reads from a shared consumer group, so any number of
+    workers and server processes can share one stream. An entry is acked
+    (and deleted) only after its handler returns. Entries left pending, by
+    a crashed worker or a handler that raised, are claimed again once idle
+    for `claim_idle` seconds; one delivered `max_deliveries` times already
+    is moved to the `dead_letter` stream instead. When the stream holds
+    more than `max_backlog` entries the oldest are trimmed one by one,
+    newer audio is never dropped for it.
+
+    Args:
+        redis: aioredis client.
+        handler: coroutine called with the id and fields of each entry.
+        workers: concurrent workers in this process.
+        max_backlog: stream length above which the oldest entries are
+            dropped, 0 disables load shedding.
+        claim_idle: seconds before a pending entry is considered orphaned,
+            longer than the slowest handler call or entries still being
+            handled are delivered twice.
+        max_deliveries: deliveries of an entry before it is dead-lettered.
+        dead_letter: stream that keeps the entries given up on.
+        interval: seconds between trim/reclaim passes.
+    """
+
+    def __init__(self,
+                 redis,
+                 handler: Handler,
+                 stream: str = AUDIO_STREAM,
+                 group: str = GROUP,
+                 name: typing.Optional[str] = None,
+                 workers: int = 2,
+                 max_backlog: int = 10,
+                 claim_idle: float = 300.0,
+                 max_deliveries: int = 3,
+                 dead_letter: str = DEAD_LETTER_STREAM,
+                 interval: float = 1.0,
+                 block: float = 0.1) -> None:
+        self.redis = redis
+        self.handler = handler
+        self.stream = stream
+        self.group = group
+        self.name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self.claim_idle = claim_idle
+        self.max_deliveries = max_deliveries
+        self.dead_letter = dead_letter
+        self.interval = interval
+        self.block = block
+        self.processed = 0
+        self.reclaimed = 0
+        self.failed = 0
+        self.dead = 0
+        self.dropped = 0
+
+    async def setup(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.stream,
+                                           self.group,
+                                           id='0',
+                                           mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def _handle(self, entry_id: bytes,
+                      fields: typing.Dict[bytes, bytes]) -> None:
+        metrics.STAGE_SECONDS.observe(queued_seconds(entry_id), stage='queue')
+        try:
+            await self.handler(entry_id, fields)
+        except Exception as e:
+            # Left pending, so it is retried once idle for claim_idle.
+            logging.error(e, exc_info=True)
+            self.failed += 1
+            return
+        await self._ack(entry_id)
+        self.processed += 1
+
+    async def _ack(self, entry_id: bytes) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+
+    async def _bury(self, entry_id: bytes,
+                    fields: typing.Dict[bytes, bytes]) -> None:
+        """ Moves an entry to the dead-letter stream. """
+        await self.redis.xadd(self.dead_letter,
+                              {**fields, b'id': entry_id},
+                              maxlen=1000,
+                              approximate=True)
+        await self._ack(entry_id)
+        self.dead += 1
+        metrics.DROPPED.inc(reason='dead_letter')
+        logging.warning('Chunk %s failed %d times, moved to %s', entry_id,
+                        self.max_deliveries, self.dead_letter)
+
+    async def _worker(self, index: int) -> None:
+        consumer = '{}-{}'.format(self.name, index)
+        block = int(self.block * 1000)
+        while True:
+            response = await self.redis.xreadgroup(self.group,
+                                                   consumer,
+                                                   {self.stream: '>'},
+                                                   count=1,
+                                                   block=block)
+            for _, entries in response or []:
+                for entry_id, fields in entries:
+                    await self._handle(entry_id, fields)
+
+    async def shed(self) -> int:
+        if not self.max_backlog:
+            return 0
+        dropped = await self.redis.xtrim(self.stream,
+                                         maxlen=self.max_backlog,
+                                         approximate=False)
+        if dropped:
+            self.dropped += dropped
+            metrics.DROPPED.inc(dropped, reason='backlog')
+            logging.warning('Backlog over %d, dropped %d oldest chunks',
+                            self.max_backlog, dropped)
+        return dropped
+
+    async def reclaim(self) -> int:
+        consumer = '{}-reclaim'.format(self.name)
+        min_idle_time = int(self.claim_idle * 1000)
+        # XPENDING for the delivery counts, then XCLAIM, which only one
+        # process gets while the entry is idle.
+        pending = await self.redis.xpending_range(self.stream,
+                                                  self.group,
+                                                  min='-',
+                                                  max='+',
+                                                  count=100)
+        idle = [
+            p for p in pending if p['time_since_delivered'] >= min_idle_time
+        ]
+        claimed = 0
+        for p in idle[:self.workers]:
+            entries = await self.redis.xclaim(self.stream, self.group,
+                                              consumer, min_idle_time,
+                                              [p['message_id']])
+            if not entries:
+                continue
+            entry_id, fields = entries[0]
+            if not fields:
+                # Trimmed while pending, nothing left to process.
+                await self.redis.xack(self.stream, self.group, entry_id)
+                continue
+            if p['times_delivered'] >= self.max_deliveries:
+                await self._bury(entry_id, fields)
+                continue
+            claimed += 1
+            await self._handle(entry_id, fields)
+        self.reclaimed += claimed
+        return claimed
+
+    async def _maintain(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.shed()
+            await self.reclaim()
+            metrics.QUEUE_DEPTH.set(await self.redis.xlen(self.stream),
+                                    queue='redis')
+
+    async def run(self) -> None:
+        await self.setup()
+        tasks = [self._worker(i) for i in range(self.workers)]
+        await asyncio.gather(self._maintain(), *tasks)
@@ -1,63 +1,163 @@
 #!/usr/bin/env python
 import asyncio
+import json
 import os
+import time
 import typing
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from contextlib import asynccontextmanager
 from io import BytesIO
 
-import av
-from fastapi import FastAPI, File, HTTPException, UploadFile
-from faster_whisper import WhisperModel
+import numpy as np
+from fastapi import (FastAPI, File, Form, HTTPException, UploadFile,
+                     WebSocket, WebSocketDisconnect)
 from loguru import logger
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import (JSONResponse, PlainTextResponse,
+                                 StreamingResponse)
+
+from .. import executor, longform, metrics, protocol
+from ..audio import (SAMPLE_RATE, AudioTooLong, decode_file,
+                     frame_to_float32, is_invalid_data, pcm16_to_float32)
+from ..batching import BatchScheduler, QueueFull
+from ..cache import ResultCache, fingerprint
+from ..executor import cpu_pool
+from ..formats import RESPONSE_FORMATS, sse, to_srt, to_vtt
+from ..inference import InferencePool
+from ..models import Router, parse_fallbacks, registry, transcribe_texts
+from ..segmenter import Segmenter, stitch
+from ..utils import asyncformer
 
 # Accept the following environment variables from Docker
 MODEL_SIZE = os.getenv('MODEL', 'base')
+# Other models a request may pick with its `model` field, loaded on first
+# use and evicted least recently used beyond MODEL_MEMORY_MB (0: no limit)
+MODELS = [m for m in os.getenv('MODELS', '').split(',') if m]
+MODEL_MEMORY_MB = int(os.getenv('MODEL_MEMORY_MB', '0'))
+# Under load, e.g. FALLBACK=large-v3:small,small:base moves requests to the
+# cheaper model once the queue wait exceeds SLO_MS
+FALLBACK = os.getenv('FALLBACK', '')
+SLO_MS = float(os.getenv('SLO_MS', '2000'))
 PROMPT = os.getenv('PROMPT', '基于FastWhisper的低延迟语音转写服务')
+DEVICE = os.getenv('DEVICE', 'auto')
+COMPUTE_TYPE = os.getenv('COMPUTE_TYPE', 'default')
+WARMUP = os.getenv('WARMUP', '1') == '1'
+# Micro-batching of concurrent requests, BATCH_SIZE=1 turns it off
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '8'))
+BATCH_DELAY_MS = float(os.getenv('BATCH_DELAY_MS', '10'))
+QUEUE_SIZE = int(os.getenv('QUEUE_SIZE', '64'))
+# Utterances a WebSocket may have waiting for decode before reads pause
+STREAM_QUEUE = int(os.getenv('STREAM_QUEUE', '4'))
+# VAD backend that segments WebSocket audio, see src/vad.py
+VAD = os.getenv('VAD', 'webrtc')
+# Longer WebSocket speech is cut at a quiet frame, seconds
+MAX_UTTERANCE = float(os.getenv('MAX_UTTERANCE', '30'))
+# Result cache for repeated uploads: in-process MB (0 disables), and an
+# optional shared redis tier, e.g. CACHE_REDIS=redis://redis:6379/0
+CACHE_MB = float(os.getenv('CACHE_MB', '64'))
+CACHE_REDIS = os.getenv('CACHE_REDIS', '')
+CACHE_TTL = int(os.getenv('CACHE_TTL', str(24 * 3600)))
+# CPU-only nodes: run inference in PROCESSES worker processes with
+# CPU_THREADS each (0: cores / PROCESSES) instead of threads in this one
+PROCESSES = int(os.getenv('PROCESSES', '0'))
+CPU_THREADS = int(os.getenv('CPU_THREADS', '0'))
+# Uploads over MAX_UPLOAD_MB or MAX_DURATION seconds are refused with 413
+# (0: no limit), the rest decoded DECODE_CHUNK_KB at a time
+MAX_UPLOAD_MB = float(os.getenv('MAX_UPLOAD_MB', '200'))
+MAX_DURATION = float(os.getenv('MAX_DURATION', '7200'))
+DECODE_CHUNK_KB = int(os.getenv('DECODE_CHUNK_KB', '64'))
+# Uploads longer than LONG_FORM seconds (0: never) are cut into ~30 s chunks
+# at silence, LONG_FORM_PARALLEL of them decoded at a time. Set NUM_WORKERS
+# (or PROCESSES) above 1 so the model really runs them in parallel.
+LONG_FORM = float(os.getenv('LONG_FORM', '60'))
+LONG_FORM_PARALLEL = int(os.getenv('LONG_FORM_PARALLEL', '8'))
+NUM_WORKERS = int(os.getenv('NUM_WORKERS', '1'))
+BEAM_SIZE = 5
+
+
+router = Router(MODEL_SIZE, MODELS, parse_fallbacks(FALLBACK), SLO_MS / 1000)
 
 
 class ValidateFileTypeMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         if request.method.lower() == "post":
+            # Refuse before the body is spooled, when the client says.
+            length = request.headers.get("content-length")
+            if MAX_UPLOAD_MB and length and length.isdigit() and \
+                    int(length) > MAX_UPLOAD_MB * 1024 * 1024:
+                return JSONResponse(status_code=413,
+                                    content={"message": "File too large"})
             try:
                 logger.info(f"Request: {request.url}")
                 response = await call_next(request)
                 return response
-            except av.error.InvalidDataError:
-                return JSONResponse(status_code=400,
-                                    content={"message": "Invalid file type"})
             except Exception as e:
+                if is_invalid_data(e):
+                    return JSONResponse(
+                        status_code=400,
+                        content={"message": "Invalid file type"})
                 return JSONResponse(status_code=500,
                                     content={"message": str(e)})
+        return await call_next(request)
 
 
-app = FastAPI()
-app.add_middleware(ValidateFileTypeMiddleware)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load (and optionally warm up) the model before accepting traffic, the
+    # readiness probe stays 503 until this is done.
+    app.state.ready = False
+    registry.max_bytes = MODEL_MEMORY_MB * 1024 * 1024
+    registry.options = dict(num_workers=NUM_WORKERS)
+    app.state.inference = None
+    if PROCESSES:
+        # Each worker loads and warms up its own copy.
+        app.state.inference = await asyncformer(
+            InferencePool(PROCESSES,
+                          DEVICE,
+                          COMPUTE_TYPE,
+                          cpu_threads=CPU_THREADS,
+                          max_bytes=registry.max_bytes).start, [MODEL_SIZE])
+    elif WARMUP:
+        period = await asyncformer(registry.warmup, MODEL_SIZE, DEVICE,
+                                   COMPUTE_TYPE)
+        logger.info(f"Model {MODEL_SIZE} warmed up in {period:.2f}s")
+    else:
+        await asyncformer(registry.get, MODEL_SIZE, DEVICE, COMPUTE_TYPE)
+    redis = None
+    if CACHE_REDIS:
+        import aioredis
+        redis = aioredis.from_url(CACHE_REDIS)
+    app.state.cache = ResultCache(int(CACHE_MB * 1024 * 1024),
+                                  redis=redis,
+                                  ttl=CACHE_TTL)
+    app.state.schedulers = {}
+    await _scheduler(MODEL_SIZE)
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    for scheduler in app.state.schedulers.values():
+        await scheduler.stop()
+    if redis is not None:
+        await redis.close()
+    if app.state.inference is not None:
+        app.state.inference.shutdown()
+    registry.clear()
+    executor.shutdown()
 
 
-async def asyncformer(sync_func: typing.Callable, *args, **kwargs):
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(pool, sync_func, *args, **kwargs)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ValidateFileTypeMiddleware)
 
 
 class Transcriber:
-    _instance = None
-
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(Transcriber, cls).__new__(cls)
-            # Put any initialization here.
-        return cls._instance
-
     def __init__(
             self,
             model_size: str,
-            device: str = "auto",
-            compute_type: str = "default",
-            prompt: str = PROMPT) -> None:
+            device: str = DEVICE,
+            compute_type: str = COMPUTE_TYPE,
+            prompt: str = PROMPT,
+            pool: typing.Optional[InferencePool] = None) -> None:
         """ FasterWhisper 语音转写
 
         Args:
@@ -66,41 +166,530 @@ class Transcriber:
             device (str, optional): 模型运行设备。
             compute_type (str, optional): 计算类型。默认为"default"。
             prompt (str, optional): 初始提示。如果需要转写简体中文，可以使用简体中文提示。
+            pool (InferencePool, optional): 在其工作进程中推理，而不是本进程。
         """
-        super().__init__()
         self.model_size = model_size
         self.device = device
         self.compute_type = compute_type
         self.prompt = prompt
+        self.pool = pool
+
+    @property
+    def _model(self):
+        # Shared across requests, loaded once per process by the registry.
+        # Looked up on every use so an evicted model is really released.
+        return registry.get(self.model_size, self.device, self.compute_type)
 
     def __enter__(self) -> 'Transcriber':
-        self._model = WhisperModel(self.model_size,
-                                   device=self.device,
-                                   compute_type=self.compute_type)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         pass
 
+    def _accept(self, t: str) -> bool:
+        if self.prompt in t.strip():
+            return False
+        return bool(t.strip().replace('.', ''))
+
+    async def transcribe(self,
+                         audio: typing.Union[bytes, np.ndarray],
+                         vad_filter: bool = True):
+        """ Returns the transcription info and an async iterator of segment
+        dicts. Segments are decoded lazily, one per CPU pool job, so the
+        first one is available long before the whole file is done.
+        """
+        if isinstance(audio, bytes):
+            audio = BytesIO(audio)
+        if self.pool is not None:
+            # Workers answer with the whole list, no lazy first segment.
+            if isinstance(audio, BytesIO):
+                audio = await cpu_pool.run(
+                    metrics.timed(decode_file, 'decode'), audio)
+            start_time = time.perf_counter()
+            segments, info = await cpu_pool.run(self.pool.transcribe,
+                                                self.model_size,
+                                                audio,
+                                                beam_size=BEAM_SIZE,
+                                                initial_prompt=self.prompt,
+                                                vad_filter=vad_filter)
+            return info, self._iterate(iter(segments), info, start_time)
+        start_time = time.perf_counter()
+        segments, info = await cpu_pool.run(self._model.transcribe,
+                                            audio,
+                                            beam_size=BEAM_SIZE,
+                                            initial_prompt=self.prompt,
+                                            vad_filter=vad_filter)
+        return info, self._iterate(segments, info, start_time)
+
+    async def _iterate(self, segments, info,
+                       start_time: float) -> typing.AsyncGenerator[dict, None]:
+        index = 0
+        while True:
+            segment = await cpu_pool.run(next, segments, None)
+            if segment is None:
+                # Counts the time the caller took between segments too.
+                metrics.observe_inference(time.perf_counter() - start_time,
+                                          info.duration, index)
+                return
+            if self._accept(segment.text):
+                yield {
+                    "id": index,
+                    "start": round(segment.start, 2),
+                    "end": round(segment.end, 2),
+                    "text": segment.text
+                }
+                index += 1
+
     async def __call__(self, audio: bytes) -> typing.AsyncGenerator[str, None]:
-        def _process():
-            return self._model.transcribe(BytesIO(audio),
-                                          initial_prompt=self.prompt,
-                                          vad_filter=True)
-
-        segments, info = await asyncformer(_process)
-        for segment in segments:
-            t = segment.text
-            if self.prompt in t.strip():
-                continue
-            if t.strip().replace('.', ''):
-                logger.info(t)
-                yield t
+        _, segments = await self.transcribe(audio)
+        async for segment in segments:
+            logger.info(segment["text"])
+            yield segment["text"]
+
+    def transcribe_batch(
+        self, items: typing.List[typing.Tuple[np.ndarray, bool]]
+    ) -> typing.List[typing.List[str]]:
+        """ Blocking batched transcription of (16 kHz audio, vad_filter)
+        items, returns the segment texts of each input. A batch of one, and
+        clips longer than 30 s, go through the regular path, which runs
+        faster-whisper's VAD when vad_filter is set.
+        """
+        start_time = time.perf_counter()
+        if self.pool is not None:
+            results = self.pool.transcribe_texts(self.model_size, items,
+                                                 self.prompt, BEAM_SIZE)
+        else:
+            results = transcribe_texts(self._model, items, self.prompt,
+                                       BEAM_SIZE)
+        results = [[t for t in texts if self._accept(t)] for texts in results]
+        # The batch's time is shared out by audio length, so the sum is the
+        # model time and every item has the batch's real-time factor.
+        seconds = time.perf_counter() - start_time
+        durations = [len(audio) / SAMPLE_RATE for audio, _ in items]
+        total = sum(durations) or 1.0
+        for duration, texts in zip(durations, results):
+            metrics.observe_inference(seconds * duration / total, duration,
+                                      len(texts))
+        return results
+
+
+@app.get("/health/live")
+async def _live():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def _ready():
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {
+        "status": "ready",
+        "model": MODEL_SIZE,
+        "loaded": [key[0] for key in registry.loaded],
+        "degraded": router.degraded,
+        "inference": app.state.inference.stats()
+        if app.state.inference is not None else None
+    }
+
+
+async def _scheduler(model_size: str) -> BatchScheduler:
+    """ The micro-batching queue of a model, created on first use. """
+    scheduler = app.state.schedulers.get(model_size)
+    if scheduler is None:
+        stt = Transcriber(model_size, pool=app.state.inference)
+        scheduler = BatchScheduler(stt.transcribe_batch,
+                                   max_batch_size=BATCH_SIZE,
+                                   max_queue_delay=BATCH_DELAY_MS / 1000,
+                                   max_queue_size=QUEUE_SIZE)
+        app.state.schedulers[model_size] = scheduler
+        metrics.QUEUE_DEPTH.track(scheduler.qsize, queue=f'batch_{model_size}')
+        await scheduler.start()
+    return scheduler
+
+
+def _busy() -> HTTPException:
+    metrics.DROPPED.inc(reason='queue_full')
+    return HTTPException(status_code=429,
+                         detail="Too many pending transcription requests")
+
+
+async def _admit(model_size: str) -> typing.Callable[[], None]:
+    """ A slot in the model's queue for a request decoded outside the
+    batches, the returned function frees it. 429 when the queue is full. """
+    scheduler = await _scheduler(model_size)
+    try:
+        return scheduler.reserve()
+    except QueueFull:
+        raise _busy() from None
+
+
+def _queue_delay(model_size: str) -> float:
+    scheduler = app.state.schedulers.get(model_size)
+    return scheduler.queue_delay if scheduler is not None else 0.0
+
+
+async def _route(requested: str) -> str:
+    """ Model for a request: the one it names, or a cheaper fallback while
+    that one's queue is over the SLO. Loads it if needed. """
+    try:
+        model_size = router.resolve(requested)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    model_size = router.degrade(model_size, _queue_delay)
+    if app.state.inference is None:
+        await asyncformer(registry.get, model_size, DEVICE, COMPUTE_TYPE)
+    return model_size
+
+
+@app.get("/metrics")
+async def _metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(),
+                             media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/cache/stats")
+async def _cache_stats():
+    return app.state.cache.stats()
+
+
+async def _cache_key(audio: np.ndarray, vad_filter: bool, kind: str,
+                     model_size: str) -> str:
+    # Everything that changes the output is part of the key.
+    return await cpu_pool.run(fingerprint,
+                              audio,
+                              kind=kind,
+                              model=model_size,
+                              prompt=PROMPT,
+                              language=None,
+                              beam_size=BEAM_SIZE,
+                              vad_filter=vad_filter)
+
+
+def _is_long(audio: np.ndarray) -> bool:
+    return bool(LONG_FORM) and len(audio) > LONG_FORM * SAMPLE_RATE
+
+
+async def _decode(audio: np.ndarray,
+                  vad_filter: bool,
+                  model_size: str,
+                  info: dict,
+                  long_form: bool = True) -> typing.AsyncGenerator[dict, None]:
+    """ Segment dicts as they are decoded, `info` receives the language
+    and duration. Long audio is split at silence and its chunks decoded
+    concurrently, see src/longform.py.
+    """
+    if not (long_form and _is_long(audio)):
+        with Transcriber(model_size, pool=app.state.inference) as stt:
+            result, segments = await stt.transcribe(audio, vad_filter)
+            info.update(language=result.language, duration=result.duration)
+            async for segment in segments:
+                yield segment
+        return
+
+    languages = Counter()
+
+    async def run(piece: np.ndarray) -> typing.List[dict]:
+        chunk_info = {}
+        segments = [
+            segment async for segment in _decode(
+                piece, vad_filter, model_size, chunk_info, long_form=False)
+        ]
+        languages[chunk_info["language"]] += 1
+        return segments
+
+    chunks = await cpu_pool.run(longform.plan, audio, SAMPLE_RATE, vad=VAD)
+    async for segment in longform.transcribe(audio, chunks, run,
+                                             LONG_FORM_PARALLEL):
+        yield segment
+    info.update(language=languages.most_common(1)[0][0]
+                if languages else None,
+                duration=len(audio) / SAMPLE_RATE)
+
+
+async def _texts(audio: np.ndarray, vad_filter: bool,
+                 model_size: str) -> typing.List[str]:
+    """ Segment texts through the batching queue, long audio as batched
+    ~30 s chunks. """
+    scheduler = await _scheduler(model_size)
+    if not _is_long(audio):
+        return await scheduler.submit((audio, vad_filter))
+
+    async def run(piece: np.ndarray) -> typing.List[dict]:
+        texts = await scheduler.submit((piece, vad_filter))
+        # No timestamps on this path, one segment per chunk.
+        end = len(piece) / SAMPLE_RATE
+        return [{"start": 0.0, "end": end, "text": t} for t in texts]
+
+    chunks = await cpu_pool.run(longform.plan, audio, SAMPLE_RATE, vad=VAD)
+    return [
+        segment["text"] async for segment in longform.transcribe(
+            audio, chunks, run, LONG_FORM_PARALLEL) if segment["text"]
+    ]
+
+
+async def _segments(audio: np.ndarray, vad_filter: bool,
+                    model_size: str) -> dict:
+    """ language, duration and segment dicts, from the cache if we have
+    seen this audio with these settings before. """
+    key = await _cache_key(audio, vad_filter, "segments", model_size)
+    result = await app.state.cache.get(key)
+    if result is None:
+        release = await _admit(model_size)
+        try:
+            info = {}
+            segments = [
+                segment async for segment in _decode(
+                    audio, vad_filter, model_size, info)
+            ]
+        finally:
+            release()
+        result = dict(info, segments=segments)
+        await app.state.cache.set(key, result)
+    return result
+
+
+def _delta(segment: dict) -> str:
+    return sse({
+        "type": "transcript.text.delta",
+        "delta": segment["text"],
+        "segment": segment
+    })
+
+
+async def _events(
+        audio: np.ndarray, vad_filter: bool, model_size: str,
+        release: typing.Callable[[], None]
+) -> typing.AsyncGenerator[str, None]:
+    """ Server-sent events of the segments, `release` frees the queue
+    slot the request was admitted with once they are all sent. """
+    try:
+        key = await _cache_key(audio, vad_filter, "segments", model_size)
+        result = await app.state.cache.get(key)
+        if result is None:
+            info, segments = {}, []
+            async for segment in _decode(audio, vad_filter, model_size,
+                                         info):
+                segments.append(segment)
+                yield _delta(segment)
+            await app.state.cache.set(key, dict(info, segments=segments))
+        else:
+            segments = result["segments"]
+            for segment in segments:
+                yield _delta(segment)
+    finally:
+        release()
+    yield sse({
+        "type": "transcript.text.done",
+        "text": ','.join(segment["text"] for segment in segments)
+    })
 
 
 @app.post("/v1/audio/transcriptions")
-async def _transcribe(file: UploadFile = File(...)):
-    with Transcriber(MODEL_SIZE) as stt:
-        audio = await file.read()
-        text = ','.join([seg async for seg in stt(audio)])
-        return {"text": text}
+async def _transcribe(file: UploadFile = File(...),
+                      response_format: str = Form("json"),
+                      stream: bool = Form(False),
+                      vad: str = Form(""),
+                      model: str = Form("")):
+    # `vad` names the detector that already cut this clip on the client,
+    # faster-whisper's own VAD pass is skipped for such uploads.
+    vad_filter = not vad
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"response_format must be one of {RESPONSE_FORMATS}")
+    if MAX_UPLOAD_MB and (file.size or 0) > MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail="File too large")
+    try:
+        # Straight from the spooled upload, never the whole file in memory.
+        audio = await cpu_pool.run(metrics.timed(decode_file, 'decode'),
+                                   file.file,
+                                   max_duration=MAX_DURATION,
+                                   chunk_size=DECODE_CHUNK_KB * 1024)
+    except AudioTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    model_size = await _route(model)
+    # Tells the client which model answered, it differs under fallback.
+    headers = {"x-whisper-model": model_size}
+    if stream:
+        # Admitted now, the 429 cannot be sent once the stream has started.
+        release = await _admit(model_size)
+        return StreamingResponse(_events(audio, vad_filter, model_size,
+                                         release),
+                                 media_type="text/event-stream",
+                                 headers=headers)
+
+    if response_format in ("json", "text"):
+        key = await _cache_key(audio, vad_filter, "texts", model_size)
+        segments = await app.state.cache.get(key)
+        if segments is None:
+            try:
+                segments = await _texts(audio, vad_filter, model_size)
+            except QueueFull:
+                raise _busy() from None
+            await app.state.cache.set(key, segments)
+        text = ','.join(segments)
+        logger.info(text)
+        if response_format == "text":
+            return PlainTextResponse(text, headers=headers)
+        return JSONResponse({"text": text}, headers=headers)
+
+    # Timestamped formats need the segment-level path, admitted against
+    # the same queue limit.
+    result = await _segments(audio, vad_filter, model_size)
+    segments = result["segments"]
+    if response_format == "srt":
+        return PlainTextResponse(to_srt(segments), headers=headers)
+    if response_format == "vtt":
+        return PlainTextResponse(to_vtt(segments),
+                                 media_type="text/vtt",
+                                 headers=headers)
+    return JSONResponse(
+        {
+            "task": "transcribe",
+            "language": result["language"],
+            "duration": result["duration"],
+            "text": ','.join(segment["text"] for segment in segments),
+            "segments": segments
+        },
+        headers=headers)
+
+
+def _pcm(data: bytes) -> bytes:
+    """ 16 kHz mono int16 PCM of a binary WebSocket message, raw or a
+    protocol frame. """
+    if not protocol.is_frame(data):
+        return data
+    # At most an utterance of 48 kHz stereo, whatever the client claims.
+    header, data = protocol.decode(data,
+                                   max_size=int(MAX_UTTERANCE * 48000 * 4))
+    if header.sample_rate != 16000 or header.channels != 1:
+        data = (frame_to_float32(header, data) *
+                32767).astype('<i2').tobytes()
+    return data
+
+
+@app.websocket("/v1/audio/stream")
+async def _stream(websocket: WebSocket):
+    """ Binary messages carry 16 kHz mono int16 PCM (or protocol frames),
+    the server segments them with VAD and answers with one JSON event per
+    decoded segment. Send {"type": "end"} to flush and close. The `model`
+    query parameter picks the model.
+    """
+    await websocket.accept()
+    try:
+        requested = router.resolve(websocket.query_params.get("model", ""))
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    segmenter = Segmenter(vad=VAD, max_duration=MAX_UTTERANCE)
+    # Bounded per connection: when decoding falls behind, we stop reading
+    # the socket and TCP pushes back on the client.
+    pending = asyncio.Queue(maxsize=STREAM_QUEUE)
+
+    async def transcribe() -> None:
+        index, previous = 0, ''
+        while True:
+            utterance = await pending.get()
+            if utterance is None:
+                return
+            audio = pcm16_to_float32(utterance.pcm)
+            # Routed per utterance so a long session follows the load.
+            model_size = await _route(requested)
+            scheduler = await _scheduler(model_size)
+            try:
+                # Already cut by our segmenter, no second VAD pass.
+                segments = await scheduler.submit((audio, False))
+            except QueueFull:
+                metrics.DROPPED.inc(reason='queue_full')
+                await websocket.send_json({
+                    "type": "error",
+                    "start": utterance.start,
+                    "end": utterance.end,
+                    "message": "Server busy, segment dropped"
+                })
+                continue
+            text = ','.join(segments)
+            # After a forced cut the overlap may have been transcribed twice.
+            if utterance.continued:
+                text, previous = stitch(previous, text), text
+            else:
+                previous = text
+            await websocket.send_json({
+                "type": "segment",
+                "index": index,
+                "start": utterance.start,
+                "end": utterance.end,
+                "text": text,
+                "model": model_size
+            })
+            index += 1
+
+    async def decode() -> bool:
+        """ Runs transcribe, False when it failed: the client then gets an
+        error event and the socket is closed with 1011. """
+        try:
+            await transcribe()
+            return True
+        except Exception as e:
+            logger.exception(f"WebSocket transcription failed: {e}")
+            try:
+                await websocket.send_json({"type": "error", "message": str(e)})
+                await websocket.close(code=1011, reason="Transcription failed")
+            except Exception:
+                pass  # the client is gone already
+            return False
+
+    async def put(item) -> bool:
+        """ Queues for the decoder, False once it has stopped: nothing
+        would take the item and a full queue would block forever. """
+        if decoder.done():
+            return False
+        putter = asyncio.ensure_future(pending.put(item))
+        await asyncio.wait({putter, decoder},
+                           return_when=asyncio.FIRST_COMPLETED)
+        if putter.done():
+            return True
+        putter.cancel()
+        return False
+
+    decoder = asyncio.create_task(decode())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect" or decoder.done():
+                break
+            data = message.get("bytes")
+            if data is not None:
+                try:
+                    data = _pcm(data)
+                except ValueError as e:
+                    # 1007: the message is not audio we can read.
+                    await websocket.close(code=1007, reason=str(e))
+                    return
+                for utterance in segmenter.feed(data):
+                    if not await put(utterance):
+                        return
+                continue
+            try:
+                event = json.loads(message.get("text") or '{}')
+            except ValueError:
+                await websocket.close(code=1007, reason="Invalid JSON")
+                return
+            if not isinstance(event, dict):
+                await websocket.close(code=1003,
+                                      reason="Expected a JSON object")
+                return
+            if event.get("type") == "end":
+                utterance = segmenter.flush()
+                if utterance is not None and not await put(utterance):
+                    return
+                if not await put(None) or not await decoder:
+                    return
+                await websocket.send_json({"type": "end"})
+                await websocket.close()
+                return
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Whatever ended the session, no decode outlives it.
+        decoder.cancel()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+import asyncio
+import functools
+import os
+import threading
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', os.cpu_count() or 1))
+IO_WORKERS = int(os.getenv('IO_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
+
+
+class Pool:
+    """ Long-lived, bounded thread pool shared by the whole process.
+
+    The underlying executor is created on first use and recreated after
+    shutdown, so an app can be started and stopped several times (e.g. in
+    tests) without leaking threads.
+    """
+
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._started = 0
+        self._finished = 0
+        self._cancelled = 0
+        self._futures: typing.Set[Future] = set()
+
+    @property
+    def queue_depth(self) -> int:
+        """ Jobs submitted but not yet picked up by a worker. """
+        return self._submitted - self._started - self._cancelled
+
+    @property
+    def in_flight(self) -> int:
+        """ Jobs currently running on a worker. """
+        return self._started - self._finished
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.name)
+            return self._executor
+
+    def _wrap(self, func: typing.Callable) -> typing.Any:
+        with self._lock:
+            self._started += 1
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._finished += 1
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+            if future.cancelled():
+                self._cancelled += 1
+
+    async def run(self, sync_func: typing.Callable, *args, **kwargs) -> typing.Any:
+        func = functools.partial(sync_func, *args, **kwargs)
+        executor = self._get_executor()
+        with self._lock:
+            self._submitted += 1
+        future = executor.submit(self._wrap, func)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures = list(self._futures)
+        if executor is not None:
+            # Jobs no worker has picked up yet are dropped (cancel_futures
+            # needs Python 3.9), running ones finish.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=wait)
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            'max_workers': self.max_workers,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+        }
+
+
+# Model inference and audio decoding
+cpu_pool = Pool('cpu', CPU_WORKERS)
+# Blocking I/O: microphone reads, file and network access
+io_pool = Pool('io', IO_WORKERS)
+
+
+def shutdown(wait: bool = True) -> None:
+    cpu_pool.shutdown(wait=wait)
+    io_pool.shutdown(wait=wait)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+import json
+import typing
+
+RESPONSE_FORMATS = ('json', 'text', 'verbose_json', 'srt', 'vtt')
+
+
+def _timestamp(seconds: float, separator: str) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return '{:02d}:{:02d}:{:02d}{}{:03d}'.format(hours, minutes, secs,
+                                                 separator, millis)
+
+
+def to_srt(segments: typing.List[dict]) -> str:
+    blocks = [
+        '{}\n{} --> {}\n{}\n'.format(i, _timestamp(seg['start'], ','),
+                                     _timestamp(seg['end'], ','),
+                                     seg['text'].strip())
+        for i, seg in enumerate(segments, 1)
+    ]
+    return '\n'.join(blocks)
+
+
+def to_vtt(segments: typing.List[dict]) -> str:
+    blocks = [
+        '{} --> {}\n{}\n'.format(_timestamp(seg['start'], '.'),
+                                 _timestamp(seg['end'], '.'),
+                                 seg['text'].strip()) for seg in segments
+    ]
+    return 'WEBVTT\n\n' + '\n'.join(blocks)
+
+
+def sse(event: dict) -> str:
+    """ One Server-Sent Events message. """
+    return 'data: {}\n\n'.format(json.dumps(event, ensure_ascii=False))
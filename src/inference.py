@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Whisper inference in K worker processes, for CPU-only deployments.
+
+Threads sharing one WhisperModel only run CTranslate2 in parallel; audio
+decoding, segment iteration and text handling in Python take turns on the
+GIL. Here each worker process loads its own copy of the model with
+`cpu_threads` set so that K x threads matches the core count, and inter
+op parallelism (`num_workers`) left at 1 since a worker handles one job
+at a time.
+
+Audio does not go through the pipe: the caller writes every clip of a
+job into one shared memory segment and only sends its name and the clip
+offsets, the worker copies the samples out and answers with plain texts
+or segments.
+"""
+import logging
+import os
+import threading
+import typing
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .models import ModelKey, registry, transcribe_texts
+
+Span = typing.Tuple[int, int]
+
+
+def _share(audios: typing.List[np.ndarray]
+           ) -> typing.Tuple[SharedMemory, typing.List[Span]]:
+    total = sum(len(a) for a in audios)
+    shm = SharedMemory(create=True, size=max(1, total * 4))
+    buffer = np.ndarray((total, ), dtype=np.float32, buffer=shm.buf)
+    spans, offset = [], 0
+    for audio in audios:
+        buffer[offset:offset + len(audio)] = audio
+        spans.append((offset, len(audio)))
+        offset += len(audio)
+    del buffer  # no export may outlive the mapping
+    return shm, spans
+
+
+def _attach(name: str, spans: typing.List[Span]) -> typing.List[np.ndarray]:
+    shm = SharedMemory(name=name)
+    try:
+        total = sum(n for _, n in spans)
+        buffer = np.ndarray((total, ), dtype=np.float32, buffer=shm.buf)
+        # A memcpy per clip, the segment is closed before inference.
+        audios = [buffer[start:start + n].copy() for start, n in spans]
+        del buffer
+    finally:
+        shm.close()
+    return audios
+
+
+# Worker side, run in the pool processes.
+
+def _init(max_bytes: int, loader: typing.Optional[typing.Callable],
+          options: dict, preload: typing.List[ModelKey]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    registry.max_bytes = max_bytes
+    registry.loader = loader
+    registry.options = options
+    for key in preload:
+        registry.warmup(*key)
+
+
+def _transcribe(key: ModelKey, name: str, spans: typing.List[Span],
+                options: dict):
+    audio, = _attach(name, spans)
+    segments, info = registry.get(*key).transcribe(audio, **options)
+    return list(segments), info
+
+
+def _texts(key: ModelKey, name: str, spans: typing.List[Span],
+           vad_filters: typing.List[bool], prompt: typing.Optional[str],
+           beam_size: int) -> typing.List[typing.List[str]]:
+    audios = _attach(name, spans)
+    return transcribe_texts(registry.get(*key),
+                            list(zip(audios, vad_filters)),
+                            prompt=prompt,
+                            beam_size=beam_size)
+
+
+class InferencePool:
+    """ K processes, each with its own model instances.
+
+    Args:
+        processes: number of worker processes.
+        device, compute_type: as for WhisperModel.
+        cpu_threads: intra-op threads per worker, by default the cores
+            divided between the workers.
+        max_bytes: model memory budget of each worker, see ModelRegistry.
+        loader: replaces WhisperModel in the workers, must be picklable.
+
+    The methods block until the worker answers, call them from a thread
+    pool as with an in-process model.
+    """
+
+    def __init__(self,
+                 processes: int,
+                 device: str = "cpu",
+                 compute_type: str = "default",
+                 cpu_threads: int = 0,
+                 max_bytes: int = 0,
+                 loader: typing.Optional[typing.Callable] = None) -> None:
+        self.processes = processes
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads or max(
+            1, (os.cpu_count() or 1) // processes)
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self._executor: typing.Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.finished = 0
+        self._futures: typing.Set[Future] = set()
+
+    def start(self, preload: typing.Sequence[str] = ()) -> 'InferencePool':
+        """ Starts every worker and waits until each has loaded (and warmed
+        up) the `preload` models. """
+        options = dict(cpu_threads=self.cpu_threads, num_workers=1)
+        # spawn: forking a process that already runs threads is unsafe.
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=get_context('spawn'),
+            initializer=_init,
+            initargs=(self.max_bytes, self.loader, options,
+                      [self._key(m) for m in preload]))
+        # Idle workers are spawned one per pending job, so K jobs at once
+        # bring up all K and their initializers.
+        futures = [
+            self._executor.submit(os.getpid) for _ in range(self.processes)
+        ]
+        pids = {future.result() for future in futures}
+        logging.info('%d inference workers up, %d threads each', len(pids),
+                     self.cpu_threads)
+        return self
+
+    def _key(self, model_size: str) -> ModelKey:
+        return (model_size, self.device, self.compute_type)
+
+    def _run(self, fn: typing.Callable, model_size: str,
+             audios: typing.List[np.ndarray], *args) -> typing.Any:
+        if self._executor is None:
+            raise RuntimeError("InferencePool is not started")
+        shm, spans = _share(audios)
+        with self._lock:
+            self.submitted += 1
+        future = self._executor.submit(fn, self._key(model_size), shm.name,
+                                       spans, *args)
+        with self._lock:
+            self._futures.add(future)
+        try:
+            return future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+            with self._lock:
+                self._futures.discard(future)
+                self.finished += 1
+
+    def transcribe(self, model_size: str, audio: np.ndarray, **options):
+        """ model.transcribe in a worker, returns the list of segments and
+        the transcription info. """
+        return self._run(_transcribe, model_size,
+                         [np.asarray(audio, dtype=np.float32)], options)
+
+    def transcribe_texts(
+            self,
+            model_size: str,
+            items: typing.List[typing.Tuple[np.ndarray, bool]],
+            prompt: typing.Optional[str] = None,
+            beam_size: int = 5) -> typing.List[typing.List[str]]:
+        """ models.transcribe_texts in a worker. """
+        audios = [np.asarray(a, dtype=np.float32) for a, _ in items]
+        return self._run(_texts, model_size, audios,
+                         [vad_filter for _, vad_filter in items], prompt,
+                         beam_size)
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            'processes': self.processes,
+            'cpu_threads': self.cpu_threads,
+            'in_flight': self.submitted - self.finished
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures = list(self._futures)
+        if executor is not None:
+            # As cancel_futures, which needs Python 3.9: jobs not yet sent
+            # to a worker are dropped, their callers get CancelledError.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=wait)
+
+    def __enter__(self) -> 'InferencePool':
+        return self if self._executor is not None else self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.shutdown()
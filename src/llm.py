@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Voice-chat replies from any OpenAI-compatible chat completions endpoint,
+streamed token by token, without blocking the recorder.
+
+ChatStage runs an asyncio loop on its own thread with one pooled HTTP
+client (httpx, imported when the stage starts). `ask` queues a question
+and returns at once; tokens go to `on_token` as they arrive. A new
+question, or `interrupt` when the user starts talking again, cancels the
+reply in flight; what was said of it so far stays in the history.
+
+History keeps the system prompt and as many of the latest turns as fit
+in `budget` tokens, estimated by count_tokens unless a tokenizer is
+given.
+
+依赖安装:
+    pip3 install httpx
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import typing
+from concurrent.futures import Future
+
+_CJK = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+_WORD = re.compile(r'[^\s\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]+')
+
+
+def count_tokens(text: str) -> int:
+    """ Rough BPE token count: one per CJK character, one per four
+    characters of anything else, plus the per-message overhead. """
+    words = sum(math.ceil(len(w) / 4) for w in _WORD.findall(text))
+    return len(_CJK.findall(text)) + words + 4
+
+
+class History:
+    """ System prompt plus the latest turns within `budget` tokens. The
+    oldest turns go first; the last one is always kept. """
+
+    def __init__(self,
+                 system: str = '',
+                 budget: int = 2048,
+                 count: typing.Callable[[str], int] = count_tokens) -> None:
+        self.system = system
+        self.budget = budget
+        self.count = count
+        self.turns: typing.List[typing.Tuple[dict, int]] = []
+        self.tokens = count(system) if system else 0
+
+    def add(self, role: str, content: str) -> None:
+        cost = self.count(content)
+        self.turns.append(({"role": role, "content": content}, cost))
+        self.tokens += cost
+        while len(self.turns) > 1 and self.tokens > self.budget:
+            self.tokens -= self.turns.pop(0)[1]
+        # Replies must not lead the conversation.
+        while len(self.turns) > 1 and self.turns[0][0]["role"] != "user":
+            self.tokens -= self.turns.pop(0)[1]
+
+    def messages(self) -> typing.List[dict]:
+        system = [{"role": "system", "content": self.system}]
+        return (system if self.system else []) + [m for m, _ in self.turns]
+
+    def clear(self) -> None:
+        self.turns.clear()
+        self.tokens = self.count(self.system) if self.system else 0
+
+
+def _print_token(token: str) -> None:
+    sys.stdout.write(token)
+    sys.stdout.flush()
+
+
+def _print_reply(reply: str, finished: bool) -> None:
+    sys.stdout.write('\n' if finished else ' ……\n')
+    sys.stdout.flush()
+
+
+class ChatStage:
+    """ Streams chat completions on a background event loop.
+
+    Args:
+        base_url: OpenAI-compatible API root, default $OPENAI_BASE_URL or
+            https://api.openai.com/v1.
+        api_key: default $OPENAI_API_KEY.
+        model: default $OPENAI_MODEL or gpt-3.5-turbo.
+        system: system prompt.
+        budget: history size in tokens, see History.
+        on_token: called with every streamed piece of text.
+        on_reply: called with the reply and whether it finished (False if
+            it was interrupted or failed), after the last token.
+        max_connections: size of the HTTP connection pool.
+        **params: extra request fields, e.g. temperature.
+
+    Callbacks run on the stage thread.
+    """
+
+    def __init__(self,
+                 base_url: typing.Optional[str] = None,
+                 api_key: typing.Optional[str] = None,
+                 model: typing.Optional[str] = None,
+                 system: str = '',
+                 budget: int = 2048,
+                 on_token: typing.Callable[[str], None] = _print_token,
+                 on_reply: typing.Callable[[str, bool],
+                                           None] = _print_reply,
+                 timeout: float = 60.0,
+                 max_connections: int = 4,
+                 **params) -> None:
+        self.base_url = (base_url or os.getenv(
+            'OPENAI_BASE_URL', 'https://api.openai.com/v1')).rstrip('/')
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY', '')
+        self.model = model or os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+        self.history = History(system, budget)
+        self.on_token = on_token
+        self.on_reply = on_reply
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.params = params
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._thread: typing.Optional[threading.Thread] = None
+        self._client = None
+        self._task: typing.Optional[asyncio.Task] = None
+        self.replies = 0
+        self.interrupted = 0
+
+    async def _open(self) -> None:
+        import httpx
+        # One INFO line per request would break up the streamed replies.
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections))
+
+    async def _stream(self, messages: typing.List[dict]):
+        body = dict(self.params,
+                    model=self.model,
+                    messages=messages,
+                    stream=True)
+        async with self._client.stream('POST', '/chat/completions',
+                                       json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    return
+                choices = json.loads(data).get("choices") or [{}]
+                token = (choices[0].get("delta") or {}).get("content")
+                if token:
+                    yield token
+
+    async def _reply(self, question: str) -> str:
+        self.history.add("user", question)
+        pieces: typing.List[str] = []
+        finished = False
+        try:
+            async for token in self._stream(self.history.messages()):
+                pieces.append(token)
+                self.on_token(token)
+            finished = True
+        except asyncio.CancelledError:
+            self.interrupted += 1
+            raise
+        except Exception as e:
+            logging.error(e, exc_info=True)
+        finally:
+            reply = ''.join(pieces)
+            if reply:
+                self.history.add("assistant", reply)
+            if finished:
+                self.replies += 1
+            self.on_reply(reply, finished)
+        return reply
+
+    async def _cancel(self) -> None:
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.wait([task])
+
+    async def _ask(self, question: str) -> str:
+        await self._cancel()
+        self._task = asyncio.ensure_future(self._reply(question))
+        return await asyncio.shield(self._task)
+
+    def ask(self, question: str) -> 'Future[str]':
+        """ Starts answering `question`, cancelling the reply in flight.
+        Returns at once, with a future for the full reply. """
+        return asyncio.run_coroutine_threadsafe(self._ask(question),
+                                                self._loop)
+
+    def interrupt(self) -> None:
+        """ Cancels the reply in flight, if any; safe from any thread. """
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._cancel(), self._loop)
+
+    def start(self) -> 'ChatStage':
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+        return self
+
+    async def _close(self, wait: bool) -> None:
+        if self._task is not None:
+            if wait:
+                await asyncio.wait([self._task])
+            else:
+                await self._cancel()
+        await self._client.aclose()
+
+    def stop(self, wait: bool = True) -> None:
+        """ Finishes (or with wait=False cancels) the reply in flight and
+        closes the client. """
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(wait),
+                                         self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> 'ChatStage':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
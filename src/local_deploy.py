@@ -6,10 +6,12 @@
     pip3 install pyaudio webrtcvad faster-whisper
 
 运行方式:
-    python3 local_deploy.py
+    python3 -m src.local_deploy
+    MODEL_DIR=~/models python3 -m src.local_deploy  # 优先使用本地模型目录，缺失时下载到该目录
+    python3 -m src.local_deploy --stream  # 流式输出 partial / final 结果
+    python3 -m src.local_deploy --chat --base_url http://localhost:8000/v1  # 用大模型对话
 """
 
-import collections
 import io
 import logging
 import queue
@@ -18,12 +20,12 @@ import typing
 import wave
 from io import BytesIO
 
-import pyaudio
-import webrtcvad
-from faster_whisper import WhisperModel
-
-logging.basicConfig(level=logging.INFO,
-                    format='%(name)s - %(levelname)s - %(message)s')
+from .audio import pcm16_to_float32
+from .capture import Capture, WavReplay
+from .llm import ChatStage
+from .models import load_model, warmup_model
+from .segmenter import Segmenter, stitch
+from .streaming import StreamingTranscriber, whisper_words
 
 
 class Queues:
@@ -37,7 +39,9 @@ class Transcriber(threading.Thread):
             model_size: str,
             device: str = "auto",
             compute_type: str = "default",
-            prompt: str = '实时/低延迟语音转写服务，林黛玉、倒拔、杨柳树、鲁迅、周树人、关键词、转写正确') -> None:
+            prompt: str = '实时/低延迟语音转写服务，林黛玉、倒拔、杨柳树、鲁迅、周树人、关键词、转写正确',
+            loader: typing.Optional[typing.Callable] = None,
+            preload: bool = True) -> None:
         """ FasterWhisper 语音转写
 
         Args:
@@ -46,26 +50,36 @@ class Transcriber(threading.Thread):
             device (str, optional): 模型运行设备。
             compute_type (str, optional): 计算类型。默认为"default"。
             prompt (str, optional): 初始提示。如果需要转写简体中文，可以使用简体中文提示。
+            loader (callable, optional): 代替 WhisperModel 加载模型，基准测试用假模型。
+            preload (bool, optional): 加载后先用一秒静音推理一次，第一句话不必等待内核初始化。
         """
         super().__init__()
         self.model_size = model_size
         self.device = device
         self.compute_type = compute_type
         self.prompt = prompt
+        self.loader = loader
+        self.preload = preload
 
     def __enter__(self) -> 'Transcriber':
-        self._model = WhisperModel(self.model_size,
-                                   device=self.device,
-                                   compute_type=self.compute_type)
+        # 先查 MODEL_DIR 本地模型目录，见 models.load_model。
+        self._model = load_model(self.model_size,
+                                 self.device,
+                                 self.compute_type,
+                                 loader=self.loader)
+        if self.preload:
+            warmup_model(self._model)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         pass
 
-    def __call__(self, audio: bytes) -> typing.Generator[str, None, None]:
+    def __call__(self,
+                 audio: bytes,
+                 vad_filter: bool = True) -> typing.Generator[str, None, None]:
         segments, info = self._model.transcribe(BytesIO(audio),
                                                 initial_prompt=self.prompt,
-                                                vad_filter=True)
+                                                vad_filter=vad_filter)
         # if info.language != "zh":
         #     return {"error": "transcribe Chinese only"}
         for segment in segments:
@@ -75,13 +89,26 @@ class Transcriber(threading.Thread):
             if t.strip().replace('.', ''):
                 yield t
 
+    def streaming(self, max_buffer: float = 15.0) -> StreamingTranscriber:
+        return StreamingTranscriber(whisper_words(self._model, self.prompt),
+                                    max_buffer=max_buffer)
+
     def run(self):
+        previous = ''
         while True:
-            audio = Queues.audio.get()
+            item = Queues.audio.get()
+            if item is None:  # 回放结束
+                Queues.text.put(None)
+                return
+            audio, continued = item
             text = ''
-            for seg in self(audio):
+            # AudioRecorder has segmented it already, skip the second VAD.
+            for seg in self(audio, vad_filter=False):
+                if continued and not text:
+                    seg = stitch(previous, seg)
                 logging.info(seg)
                 text += seg
+            previous = text
             Queues.text.put(text)
 
 
@@ -92,103 +119,188 @@ class AudioRecorder(threading.Thread):
         rate (int, 可选): 采样率，默认为16000 Hz。
         chunk (int, 可选): 缓冲区中的帧数，默认为256。
         frame_duration (int, 可选): 每帧的持续时间（单位：毫秒），默认为30。
+        vad (str, 可选): VAD 后端，webrtc / energy / silero，默认为 webrtc。
+        max_duration (float, 可选): 单段语音的最长秒数，超过后在最安静处切开，默认为30。
+        wav (str, 可选): 回放 WAV 文件代替麦克风（实时速度），用于无声卡环境测试。
+        speed (float, 可选): 回放倍速，默认为1。
+        on_speech (callable, 可选): 检测到开始说话时调用，例如打断正在进行的回答。
     """
 
     def __init__(self,
                  channels: int = 1,
                  sample_rate: int = 16000,
                  chunk: int = 256,
-                 frame_duration: int = 30) -> None:
+                 frame_duration: int = 30,
+                 vad: str = 'webrtc',
+                 max_duration: float = 30.0,
+                 wav: typing.Optional[str] = None,
+                 speed: float = 1.0,
+                 on_speech: typing.Optional[typing.Callable[[], None]] = None
+                 ) -> None:
         super().__init__()
         self.sample_rate = sample_rate
         self.channels = channels
         self.chunk = chunk
+        self.frame_duration = frame_duration
+        self.vad = vad
+        self.max_duration = max_duration
+        self.wav = wav
+        self.speed = speed
+        self.on_speech = on_speech
         self.frame_size = (sample_rate * frame_duration // 1000)
-        self.__frames: typing.List[bytes] = []
 
     def __enter__(self) -> 'AudioRecorder':
-        self.vad = webrtcvad.Vad()
-        # 设置 VAD 的敏感度。参数是一个 0 到 3 之间的整数。0 表示对非语音最不敏感，3 最敏感。
-        self.vad.set_mode(1)
-
-        self.audio = pyaudio.PyAudio()
-        self.sample_width = self.audio.get_sample_size(pyaudio.paInt16)
-        self.stream = self.audio.open(format=pyaudio.paInt16,
-                                      channels=self.channels,
-                                      rate=self.sample_rate,
-                                      input=True,
-                                      frames_per_buffer=self.chunk)
+        # VAD 敏感度 mode 是 0 到 3 之间的整数。0 表示对非语音最不敏感，3 最敏感。
+        self.segmenter = Segmenter(sample_rate=self.sample_rate,
+                                   frame_duration=self.frame_duration,
+                                   vad=self.vad,
+                                   mode=1,
+                                   max_duration=self.max_duration)
+
+        # 录音在 PortAudio 回调线程中写入环形缓冲区，VAD 和转写再慢也不会丢音频。
+        if self.wav is None:
+            self.capture = Capture(self.sample_rate, self.channels,
+                                   self.chunk)
+        else:
+            self.capture = WavReplay(self.wav,
+                                     self.sample_rate,
+                                     self.channels,
+                                     self.chunk,
+                                     speed=self.speed)
+        self.sample_width = self.capture.sample_width
+        self.capture.start()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
-        self.stream.stop_stream()
-        self.stream.close()
-        self.audio.terminate()
+        self.capture.stop()
 
-    def __bytes__(self) -> bytes:
+    def to_wav(self, pcm: bytes) -> bytes:
         buf = io.BytesIO()
         with wave.open(buf, 'wb') as wf:
             wf.setnchannels(self.channels)
             wf.setsampwidth(self.sample_width)
             wf.setframerate(self.sample_rate)
-            wf.writeframes(b''.join(self.__frames))
-            self.__frames.clear()
+            wf.writeframes(pcm)
         return buf.getvalue()
 
-    def run(self):
-        """ Record audio until silence is detected.
+    def utterances(
+            self) -> typing.Generator[typing.Tuple[bytes, bool], None, None]:
+        """ Record audio until silence is detected, one WAV per utterance,
+        and whether it continues the previous one after a forced cut.
         """
-        MAXLEN = 30
-        watcher = collections.deque(maxlen=MAXLEN)
-        triggered, ratio = False, 0.5
         while True:
-            frame = self.stream.read(self.frame_size)
-            is_speech = self.vad.is_speech(frame, self.sample_rate)
-            watcher.append(is_speech)
-            self.__frames.append(frame)
-            if not triggered:
-                num_voiced = len([x for x in watcher if x])
-                if num_voiced > ratio * watcher.maxlen:
-                    logging.info("start recording...")
-                    triggered = True
-                    watcher.clear()
-                    self.__frames = self.__frames[-MAXLEN:]
-            else:
-                num_unvoiced = len([x for x in watcher if not x])
-                if num_unvoiced > ratio * watcher.maxlen:
-                    logging.info("stop recording...")
-                    triggered = False
-                    Queues.audio.put(bytes(self))
-                    logging.info("audio task number: {}".format(
-                        Queues.audio.qsize()))
+            frame = self.capture.read(self.frame_size)
+            if frame is None:  # 回放结束
+                utterance = self.segmenter.flush()
+                if utterance is not None:
+                    yield self.to_wav(utterance.pcm), utterance.continued
+                return
+            triggered = self.segmenter.triggered
+            utterance = self.segmenter.push(frame)
+            if self.segmenter.triggered and not triggered:
+                logging.info("start recording...")
+                if self.on_speech is not None:
+                    self.on_speech()
+            if utterance is not None:
+                logging.info("stop recording...")
+                yield self.to_wav(utterance.pcm), utterance.continued
+
+    def run(self):
+        for item in self.utterances():
+            Queues.audio.put(item)
+            logging.info("audio task number: {}".format(Queues.audio.qsize()))
+        Queues.audio.put(None)  # 回放结束，转写线程随之退出
 
 
 class Chat(threading.Thread):
-    def __init__(self, prompt: str) -> None:
-        super().__init__()
-        self.prompt = prompt
+    """ Answers every transcribed utterance with an LLM. The reply streams
+    to the console from ChatStage's event loop, so this thread only hands
+    texts over; `interrupt` cancels the reply when the user speaks again.
+    """
+    PROMPT = "Hey! I'm currently working on my English speaking skills and I was hoping you could help me out. If you notice any mistakes in my expressions or if something I say doesn't sound quite right, could you please correct me? And if everything's fine, just carry on with a normal conversation. I'd really appreciate it if you could reply in a conversational, spoken English style. This way, it feels more like a natural chat. Thanks a lot for your help!"
+
+    def __init__(self, prompt: str = PROMPT, **options) -> None:
+        super().__init__(daemon=True)
+        self.stage = ChatStage(system=prompt, **options)
+
+    def interrupt(self) -> None:
+        self.stage.interrupt()
 
     def run(self):
-        prompt = "Hey! I'm currently working on my English speaking skills and I was hoping you could help me out. If you notice any mistakes in my expressions or if something I say doesn't sound quite right, could you please correct me? And if everything's fine, just carry on with a normal conversation. I'd really appreciate it if you could reply in a conversational, spoken English style. This way, it feels more like a natural chat. Thanks a lot for your help!"
-        while True:
-            text = Queues.text.get()
-            if text:
-                import os
-                os.system('chat "{}"'.format(prompt + text))
-                prompt = ""
+        with self.stage:
+            while True:
+                text = Queues.text.get()
+                if text is None:
+                    return
+                if text:
+                    self.stage.ask(text)
 
 
-def main():
+def run_stream(step: float = 1.0,
+               model_size: str = "base",
+               wav: typing.Optional[str] = None,
+               preload: bool = True):
+    """ 流式模式：每 step 秒重新转写一次缓冲区，稳定的前缀作为 final 输出。
+    """
+    with AudioRecorder(channels=1, sample_rate=16000, wav=wav) as recorder:
+        with Transcriber(model_size=model_size,
+                         preload=preload) as transcriber:
+            online = transcriber.streaming()
+            capture = recorder.capture
+            while True:
+                pcm = capture.read(int(step * recorder.sample_rate))
+                if pcm is None:
+                    events = online.finish()
+                else:
+                    # 模型忙时积压的音频一并送入，不再按固定步长慢慢追赶。
+                    backlog = capture.available // recorder.channels
+                    if backlog:
+                        pcm += capture.read(backlog)
+                    online.insert_audio(pcm16_to_float32(pcm))
+                    events = online.process()
+                for event in events:
+                    logging.info("[{}] {:.2f}-{:.2f} {}".format(
+                        event.kind, event.start, event.end, event.text))
+                if pcm is None:
+                    return
+
+
+def main(stream: bool = False,
+         step: float = 1.0,
+         vad: str = 'webrtc',
+         wav: typing.Optional[str] = None,
+         chat: bool = False,
+         base_url: typing.Optional[str] = None,
+         model: typing.Optional[str] = None,
+         preload: bool = True):
+    """ chat: 把转写结果交给兼容 OpenAI 接口的大模型（base_url / model，
+    默认取 OPENAI_BASE_URL / OPENAI_MODEL），回答流式输出到终端。
+    preload: 录音前先预热模型，--nopreload 跳过。
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format='%(name)s - %(levelname)s - %(message)s')
+    if stream:
+        try:
+            run_stream(step, wav=wav, preload=preload)
+        except KeyboardInterrupt:
+            print("KeyboardInterrupt: terminating...")
+        return
     try:
-        with AudioRecorder(channels=1, sample_rate=16000) as recorder:
-            with Transcriber(model_size="base") as transcriber:
+        chatter = Chat(base_url=base_url, model=model) if chat else None
+        with AudioRecorder(channels=1, sample_rate=16000, vad=vad, wav=wav,
+                           on_speech=chatter.interrupt if chatter else None
+                           ) as recorder:
+            with Transcriber(model_size="base",
+                             preload=preload) as transcriber:
                 recorder.start()
                 transcriber.start()
-                # chat = Chat("")
-                # chat.start()
+                if chatter is not None:
+                    chatter.start()
 
                 recorder.join()
                 transcriber.join()
+                if chatter is not None:
+                    chatter.join()
 
     except KeyboardInterrupt:
         print("KeyboardInterrupt: terminating...")
@@ -197,4 +309,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    import fire
+    fire.Fire(main)
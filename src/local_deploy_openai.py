@@ -3,44 +3,42 @@
 在本地进行录音 + 转写的单脚本代码。不依赖于云服务（e.g., redis, socket），适合于离线使用。
 
 依赖安装:
-    pip3 install pyaudio webrtcvad faster-whisper
+    pip3 install pyaudio webrtcvad faster-whisper httpx
 
 运行方式:
-    python3 local_deploy.py
+    python3 -m src.local_deploy_openai
+    python3 -m src.local_deploy_openai --punc stub --wav a.wav  # 无标点模型、无声卡测试
+    python3 -m src.local_deploy_openai --base_url http://localhost:8000/v1  # 任意兼容 OpenAI 的服务
+    MODEL_DIR=~/models python3 -m src.local_deploy_openai  # 优先使用本地模型目录
 """
-from faster_whisper import WhisperModel
 from io import BytesIO
 import typing
 import io
-import collections
 import wave
-import time
 
-import pyaudio
-import webrtcvad
 import logging
-from funasr import AutoModel  #添加标点的模型
 
-#解决bug问题
-import os
-os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
+from .capture import Capture, WavReplay
+from .llm import ChatStage
+from .models import load_model, warmup_model
+from .postprocess import FunASRPunctuation, PostStage, StubPunctuation
+from .segmenter import Segmenter, stitch
 
-import openai
+import os
 
-openai.api_key="sk-********"  #填写你自己的key
+#实现标点符号的添加，在独立线程中批量处理
+PUNC_MODEL = r"E:\ct-punc"
+# 大模型的地址、key 和模型名默认取 OPENAI_BASE_URL / OPENAI_API_KEY / OPENAI_MODEL
+SYSTEM_PROMPT = "资深工作人员"
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(name)s - %(levelname)s - %(message)s')
 
-#实现标点符号的添加
-model1 = AutoModel(model="E:\ct-punc")
 class Transcriber(object):
     def __init__(self,
                  model_size: str = r"E:\whisper\faster-whisper-large-v3",
                  device: str = "auto",
                  compute_type: str = "default",
-                 prompt: str = '实时/低延迟语音转写服务'
+                 prompt: str = '实时/低延迟语音转写服务',
+                 preload: bool = True
                  ) -> None:
         """ FasterWhisper 语音转写
 
@@ -50,35 +48,36 @@ class Transcriber(object):
             device (str, optional): 模型运行设备。
             compute_type (str, optional): 计算类型。默认为"default"。
             prompt (str, optional): 初始提示。如果需要转写简体中文，可以使用简体中文提示。
+            preload (bool, optional): 加载后先推理一次，第一句话不必等待内核初始化。
         """
 
         self.model_size = model_size
         self.device = device
         self.compute_type = compute_type
         self.prompt = prompt
+        self.preload = preload
 
     def __enter__(self) -> 'Transcriber':
-        self._model = WhisperModel(self.model_size,
-                                  device=self.device,
-                                  compute_type=self.compute_type)
+        # 先查 MODEL_DIR 本地模型目录，见 models.load_model。
+        self._model = load_model(self.model_size, self.device,
+                                 self.compute_type)
+        if self.preload:
+            warmup_model(self._model)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         pass
 
     def __call__(self, audio: bytes) -> typing.Generator[str, None, None]:
+        """ Segment texts without punctuation, see PostStage. """
         segments, info = self._model.transcribe(BytesIO(audio),
                                                initial_prompt=self.prompt)
         if info.language != "zh":
             return {"error": "transcribe Chinese only"}
-        res_all = ""
         for segment in segments:
             t = segment.text
-
-            res1 = model1.generate(input=t)
-            res_all = res_all + res1[0]["text"]
-        if res_all.strip().replace('.', ''):
-            yield res_all
+            if t.strip().replace('.', ''):
+                yield t
 
 
 
@@ -89,114 +88,154 @@ class AudioRecorder(object):
         rate (int, 可选): 采样率，默认为16000 Hz。
         chunk (int, 可选): 缓冲区中的帧数，默认为256。
         frame_duration (int, 可选): 每帧的持续时间（单位：毫秒），默认为30。
+        vad (str, 可选): VAD 后端，webrtc / energy / silero，默认为 webrtc。
+        max_duration (float, 可选): 单段语音的最长秒数，超过后在最安静处切开，默认为30。
+        wav (str, 可选): 回放 WAV 文件代替麦克风（实时速度），用于无声卡环境测试。
+        on_speech (callable, 可选): 检测到开始说话时调用，例如打断正在进行的回答。
     """
 
     def __init__(self,
                  channels: int = 1,
                  sample_rate: int = 16000,
                  chunk: int = 256,
-                 frame_duration: int = 30) -> None:
+                 frame_duration: int = 30,
+                 vad: str = 'webrtc',
+                 max_duration: float = 30.0,
+                 wav: typing.Optional[str] = None,
+                 on_speech: typing.Optional[typing.Callable[[], None]] = None
+                 ) -> None:
         self.sample_rate = sample_rate
         self.channels = channels
         self.chunk = chunk
+        self.frame_duration = frame_duration
+        self.vad = vad
+        self.max_duration = max_duration
+        self.wav = wav
+        self.on_speech = on_speech
         self.frame_size = (sample_rate * frame_duration // 1000)
-        self.__frames: typing.List[bytes] = []
 
     def __enter__(self) -> 'AudioRecorder':
-        self.vad = webrtcvad.Vad()
-        # 设置 VAD 的敏感度。参数是一个 0 到 3 之间的整数。0 表示对非语音最不敏感，3 最敏感。
-        self.vad.set_mode(1)
-
-        self.audio = pyaudio.PyAudio()
-        self.sample_width = self.audio.get_sample_size(pyaudio.paInt16)
-        self.stream = self.audio.open(format=pyaudio.paInt16,
-                                      channels=self.channels,
-                                      rate=self.sample_rate,
-                                      input=True,
-                                      frames_per_buffer=self.chunk)
+        # VAD 敏感度 mode 是 0 到 3 之间的整数。0 表示对非语音最不敏感，3 最敏感。
+        self.segmenter = Segmenter(sample_rate=self.sample_rate,
+                                   frame_duration=self.frame_duration,
+                                   vad=self.vad,
+                                   mode=1,
+                                   max_duration=self.max_duration)
+
+        # 录音在 PortAudio 回调线程中写入环形缓冲区，VAD 和转写再慢也不会丢音频。
+        if self.wav is None:
+            self.capture = Capture(self.sample_rate, self.channels,
+                                   self.chunk)
+        else:
+            self.capture = WavReplay(self.wav, self.sample_rate,
+                                     self.channels, self.chunk)
+        self.sample_width = self.capture.sample_width
+        self.capture.start()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
-        self.stream.stop_stream()
-        self.stream.close()
-        self.audio.terminate()
+        self.capture.stop()
 
-    def __bytes__(self) -> bytes:
+    def to_wav(self, pcm: bytes) -> bytes:
         buf = io.BytesIO()
         with wave.open(buf, 'wb') as wf:
             wf.setnchannels(self.channels)
             wf.setsampwidth(self.sample_width)
             wf.setframerate(self.sample_rate)
-            wf.writeframes(b''.join(self.__frames))
-            self.__frames.clear()
+            wf.writeframes(pcm)
         return buf.getvalue()
 
-    def __iter__(self):
-        """ Record audio until silence is detected.
+    def utterances(
+            self) -> typing.Generator[typing.Tuple[bytes, bool], None, None]:
+        """ Record audio until silence is detected, one WAV per utterance,
+        and whether it continues the previous one after a forced cut.
         """
-        MAXLEN = 30
-        watcher = collections.deque(maxlen=MAXLEN)
-        triggered, ratio = False, 0.5
         while True:
-            frame = self.stream.read(self.frame_size)
-            is_speech = self.vad.is_speech(frame, self.sample_rate)
-            watcher.append(is_speech)
-            self.__frames.append(frame)
-            if not triggered:
-                num_voiced = len([x for x in watcher if x])
-                if num_voiced > ratio * watcher.maxlen:
-                    logging.info("start recording...")
-                    triggered = True
-                    watcher.clear()
-                    self.__frames = self.__frames[-MAXLEN:]
-            else:
-                num_unvoiced = len([x for x in watcher if not x])
-                if num_unvoiced > ratio * watcher.maxlen:
-                    logging.info("stop recording...")
-                    triggered = False
-                    yield bytes(self)
-
-
-def main():
+            frame = self.capture.read(self.frame_size)
+            if frame is None:  # 回放结束
+                utterance = self.segmenter.flush()
+                if utterance is not None:
+                    yield self.to_wav(utterance.pcm), utterance.continued
+                return
+            triggered = self.segmenter.triggered
+            utterance = self.segmenter.push(frame)
+            if self.segmenter.triggered and not triggered:
+                logging.info("start recording...")
+                if self.on_speech is not None:
+                    self.on_speech()
+            if utterance is not None:
+                logging.info("stop recording...")
+                yield self.to_wav(utterance.pcm), utterance.continued
+
+    def __iter__(self):
+        return self.utterances()
+
+
+def main(punc: str = PUNC_MODEL,
+         wav: typing.Optional[str] = None,
+         base_url: typing.Optional[str] = None,
+         model: typing.Optional[str] = None,
+         budget: int = 2048,
+         preload: bool = True):
+    """
+    Args:
+        punc: FunASR 标点模型路径，"stub" 使用测试用的假模型。
+        base_url: 兼容 OpenAI 的 API 地址，例如本地部署的模型。
+        model: 大模型名称。
+        budget: 保留的对话历史上限（token 数）。
+        preload: 录音前先预热转写和标点模型，--nopreload 跳过。
+    """
+    #解决bug问题，须在加载模型之前设置
+    os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(name)s - %(levelname)s - %(message)s')
+    previous = ''
+
+    def replied(reply: str, finished: bool) -> None:
+        if not finished:  # 被打断或请求失败（错误已记录在日志中）
+            print(" ……")
+            return
+        print()
+        logging.info(reply)
+        print("--------------------------------请继续询问！--------------------------------")
+
+    def answer(seg: str, continued: bool) -> None:
+        # 标点线程按顺序回调；长句被强制切开时，去掉与上一段重叠的词
+        nonlocal previous
+        if continued:
+            seg, previous = stitch(previous, seg), seg
+        else:
+            previous = seg
+        if seg.strip():
+            print("问：", seg)
+            print("GPT答：", end='', flush=True)
+            # 立即返回，回答在 ChatStage 的事件循环里流式输出
+            chat.ask(seg)
+
     try:
-        with AudioRecorder(channels=1, sample_rate=16000) as recorder:
+        if punc == 'stub':
+            punctuation = StubPunctuation()
+        else:
+            punctuation = FunASRPunctuation(punc)
+        if preload:
+            punctuation(['预热'])
+        chat = ChatStage(base_url,
+                         model=model,
+                         system=SYSTEM_PROMPT,
+                         budget=budget,
+                         on_reply=replied)
+        with chat, AudioRecorder(channels=1, sample_rate=16000, wav=wav,
+                                 on_speech=chat.interrupt) as recorder:
             # print("recorder")
-            with Transcriber(model_size=r"E:\whisper\faster-whisper-large-v3") as transcriber:  #选择本地的large-v3
-                # print("transcriber")
-                for audio in recorder:
-                    # print("audio")
-                    for seg in transcriber(audio):
-                        # print(seg)
-                        print("问：", seg)
-                        # time.sleep(0.5)
-                        messages = []
-                        system_message = "资深工作人员"
-                        system_message_dict = {
-                            "role": "system",
-                            "content": system_message
-                        }
-                        messages.append(system_message_dict)
-                        user_message_dict = {
-                            "role": "user",
-                            "content": seg
-                        }
-                        messages.append(user_message_dict)
-                        try:
-                            response = openai.ChatCompletion.create(
-                                model="gpt-3.5-turbo",
-                                messages=messages
-                            )
-                            # print(response)
-                            reply = response["choices"][0]["message"]["content"]
-                            print("++++++++++++++++++++++++++正在加速寻找答案！++++++++++++++++++++++++++")
-                            time.sleep(1)
-                            print("GPT答：", reply)
-                        except:
-                            time.sleep(1)
-                            print("**************************请不要密集提问！**************************")
-                        # time.sleep(0.5)
-                        logging.info(seg)
-                        print("--------------------------------请继续询问！--------------------------------")
+            with Transcriber(model_size=r"E:\whisper\faster-whisper-large-v3", preload=preload) as transcriber:  #选择本地的large-v3
+                # 加标点和提问在 PostStage 线程里进行，不阻塞录音和转写；
+                # 用户再次开口时打断正在输出的回答
+                with PostStage(punctuation, answer) as stage:
+                    for audio, continued in recorder:
+                        segments = list(transcriber(audio))
+                        if segments:
+                            stage.submit(segments, continued)
 
     except KeyboardInterrupt:
         print("KeyboardInterrupt: terminating...")
@@ -205,4 +244,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    import fire
+    fire.Fire(main)
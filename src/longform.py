@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Long-form transcription: cut a long recording into chunks of at most
+~30 s at silence, decode the chunks concurrently and stitch the segments
+back together on the recording's clock.
+
+Chunks tile the whole recording, each cut in the middle of the longest
+pause found in the last `search` seconds before the limit. Only chunks
+without a single voiced frame are skipped. With no pause at all the cut
+falls on the quietest frame and the next chunk starts `overlap` seconds
+earlier, flagged `continued`; the words decoded twice are then removed
+with segmenter.stitch.
+"""
+import asyncio
+import typing
+
+import numpy as np
+
+from . import vad as vads
+from .segmenter import stitch
+
+
+class Chunk(typing.NamedTuple):
+    start: float  # seconds
+    end: float
+    continued: bool = False  # starts inside speech, overlaps the previous
+
+
+def _longest_gap(
+        flags: np.ndarray) -> typing.Optional[typing.Tuple[int, int]]:
+    """ [i, j) of the longest run of unvoiced frames, the latest on ties. """
+    best, run_start = None, None
+    for i, voiced in enumerate(list(flags) + [True]):
+        if not voiced and run_start is None:
+            run_start = i
+        elif voiced and run_start is not None:
+            if best is None or i - run_start >= best[1] - best[0]:
+                best = (run_start, i)
+            run_start = None
+    return best
+
+
+def plan(audio: np.ndarray,
+         sample_rate: int = 16000,
+         chunk: float = 30.0,
+         search: float = 5.0,
+         overlap: float = 0.2,
+         vad: typing.Union[str, vads.VAD] = 'webrtc',
+         frame_duration: int = 30) -> typing.List[Chunk]:
+    """ Chunks of at most `chunk` seconds covering every voiced frame of
+    `audio` (float32 in [-1, 1] or int16).
+    """
+    if audio.dtype != np.int16:
+        audio = (np.clip(audio, -1, 1) * 32767).astype('<i2')
+    frame_samples = sample_rate * frame_duration // 1000
+    frame_time = frame_duration / 1000
+    n = len(audio) // frame_samples
+    frames = audio[:n * frame_samples].reshape(n, -1)
+    if isinstance(vad, str):
+        vad = vads.create(vad, sample_rate)
+    flags = np.asarray(vad.batch(frames), dtype=bool)
+    x = frames.astype(np.float32)
+    energies = np.einsum('ij,ij->i', x, x)
+
+    limit = max(1, int(chunk / frame_time))
+    search_frames = min(int(search / frame_time), limit - 1)
+    overlap_frames = int(overlap / frame_time)
+    chunks: typing.List[Chunk] = []
+    start, continued = 0, False
+    while start < n:
+        end, forced = start + limit, False
+        if end >= n:
+            cut = n
+        else:
+            low = end - search_frames
+            gap = _longest_gap(flags[low:end])
+            if gap is not None:
+                cut = low + (gap[0] + gap[1]) // 2
+            else:
+                window = energies[low:end]
+                cut = end - int(np.argmin(window[::-1]))
+                forced = True
+        if flags[start:cut].any():
+            # The last chunk also takes the samples after the last frame.
+            stop = len(audio) / sample_rate if cut == n else cut * frame_time
+            chunks.append(
+                Chunk(round(start * frame_time, 3), round(stop, 3),
+                      continued))
+        continued = forced
+        start = max(start + 1, cut - overlap_frames) if forced else cut
+    return chunks
+
+
+async def transcribe(
+    audio: np.ndarray,
+    chunks: typing.List[Chunk],
+    run: typing.Callable[[np.ndarray], typing.Awaitable[typing.List[dict]]],
+    parallel: int = 8,
+    sample_rate: int = 16000
+) -> typing.AsyncGenerator[dict, None]:
+    """ Decodes up to `parallel` chunks at a time with `run`, which returns
+    segment dicts (start, end, text, optionally id) relative to its chunk.
+    Yields the stitched segments in order, each chunk's as soon as it and
+    the ones before it are done.
+    """
+    limit = asyncio.Semaphore(parallel)
+
+    async def one(chunk: Chunk) -> typing.List[dict]:
+        async with limit:
+            return await run(audio[int(chunk.start * sample_rate):
+                                   int(chunk.end * sample_rate)])
+
+    tasks = [asyncio.ensure_future(one(chunk)) for chunk in chunks]
+    try:
+        # End and text as decoded (before stitching) of the last segment.
+        index, last_end, last_text = 0, None, ''
+        for chunk, task in zip(chunks, tasks):
+            segments = [
+                dict(segment,
+                     start=round(segment["start"] + chunk.start, 2),
+                     end=round(min(segment["end"] + chunk.start, chunk.end),
+                               2)) for segment in await task
+            ]
+            if chunk.continued and last_end is not None:
+                # The overlap was decoded by the previous chunk already.
+                segments = [s for s in segments if s["end"] > last_end]
+            for segment in segments:
+                text = segment["text"]
+                if chunk.continued and segment is segments[0]:
+                    segment["text"] = stitch(last_text, text)
+                if "id" in segment:
+                    segment["id"] = index
+                index += 1
+                last_end, last_text = segment["end"], text
+                yield segment
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+Latency and throughput of every pipeline stage, in the Prometheus text
+exposition format.
+
+Counters, gauges and histograms are kept in process, no client library
+needed. The FastAPI app serves them at /metrics; the Redis worker and the
+recording client, which have no HTTP server of their own, call `serve`
+for a small one on a port of their own.
+
+Stages (`whisper_stage_seconds{stage=...}`):
+    endpoint   end of the captured audio to the VAD closing the utterance
+               (trailing silence plus capture backlog), client
+    upload     one pipelined XADD round trip, client
+    queue      XADD to a worker picking the chunk up, by the Redis clock
+    decode     wire format or upload to float32 samples
+    inference  model time for one utterance or upload
+    total      capture to the result, by the client's clock
+"""
+import contextlib
+import functools
+import math
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+RTF_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+SIZE_BUCKETS = tuple(2**i for i in range(10, 24))  # 1 KiB to 8 MiB
+
+
+def _format(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Registry:
+
+    def __init__(self) -> None:
+        self.metrics: typing.List['Metric'] = []
+
+    def register(self, metric: 'Metric') -> None:
+        if any(m.name == metric.name for m in self.metrics):
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """ A metric family. Series are created on first use, one per set of
+    label values; every label must be given each time. """
+    kind = 'untyped'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labels: typing.Sequence[str] = (),
+                 registry: typing.Optional[Registry] = REGISTRY) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self._series: typing.Dict[tuple, typing.Any] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: typing.Dict[str, typing.Any]) -> tuple:
+        if len(labels) != len(self.labelnames) or set(labels) != set(
+                self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {self.labelnames}, got "
+                f"{tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: tuple, extra: typing.Tuple = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+    def _samples(
+            self
+    ) -> typing.Iterator[typing.Tuple[str, tuple, typing.Tuple, float]]:
+        raise NotImplementedError
+
+    @property
+    def family(self) -> str:
+        """ Name of the HELP and TYPE lines. """
+        return self.name
+
+    def render(self) -> typing.List[str]:
+        lines = [
+            f'# HELP {self.family} {self.documentation}',
+            f'# TYPE {self.family} {self.kind}'
+        ]
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, key, extra, value in samples:
+            lines.append(f'{self.name}{suffix}{self._labels(key, extra)} '
+                         f'{_format(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """ Samples are `<name>_total`, and so is the family in the text
+    format, as prometheus_client renders it. """
+    kind = 'counter'
+
+    @property
+    def family(self) -> str:
+        return self.name + '_total'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._series.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        for key, value in self._series.items():
+            yield '_total', key, (), value
+
+
+class Gauge(Metric):
+    """ Set directly, or `track` a callable read at every scrape. """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def track(self, function: typing.Callable[[], float], **labels) -> None:
+        self.set(function, **labels)
+
+    def value(self, **labels) -> float:
+        value = self._series.get(self._key(labels), 0.0)
+        return value() if callable(value) else value
+
+    def _samples(self):
+        for key, value in self._series.items():
+            yield '', key, (), value() if callable(value) else value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labels: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = LATENCY_BUCKETS,
+                 registry: typing.Optional[Registry] = REGISTRY) -> None:
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf, )
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> typing.Iterator[None]:
+        """ Observes the seconds spent in the block. """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self):
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield '_bucket', key, (('le', _format(bound)), ), cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), cumulative
+
+
+STAGE_SECONDS = Histogram('whisper_stage_seconds',
+                          'Seconds spent in each pipeline stage',
+                          labels=('stage', ))
+REAL_TIME_FACTOR = Histogram('whisper_real_time_factor',
+                             'Inference seconds per second of audio',
+                             buckets=RTF_BUCKETS)
+SEGMENTS = Histogram('whisper_segments_per_utterance',
+                     'Segments decoded from one utterance or upload',
+                     buckets=COUNT_BUCKETS)
+FRAME_BYTES = Histogram('whisper_frame_bytes',
+                        'Encoded size of one utterance on the wire',
+                        labels=('codec', ),
+                        buckets=SIZE_BUCKETS)
+AUDIO_SECONDS = Counter('whisper_audio_seconds',
+                        'Seconds of audio transcribed')
+UTTERANCES = Counter('whisper_utterances',
+                     'Utterances or uploads transcribed')
+DROPPED = Counter('whisper_dropped',
+                  'Audio chunks dropped, by where and why',
+                  labels=('reason', ))
+QUEUE_DEPTH = Gauge('whisper_queue_depth',
+                    'Items waiting in each queue',
+                    labels=('queue', ))
+
+
+def observe_inference(seconds: float, audio_seconds: float,
+                      segments: int) -> None:
+    """ Inference time, real-time factor, segment count and throughput of
+    one transcription. """
+    STAGE_SECONDS.observe(seconds, stage='inference')
+    if audio_seconds > 0:
+        REAL_TIME_FACTOR.observe(seconds / audio_seconds)
+    SEGMENTS.observe(segments)
+    AUDIO_SECONDS.inc(audio_seconds)
+    UTTERANCES.inc()
+
+
+def timed(function: typing.Callable, stage: str) -> typing.Callable:
+    """ `function`, observing its own run time as `stage`. For work handed
+    to a pool, where timing the await would count the wait as well. """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with STAGE_SECONDS.time(stage=stage):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port: int,
+          host: str = '0.0.0.0',
+          registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """ Serves /metrics from a daemon thread, for processes without an
+    HTTP server. """
+    handler = type('Handler', (_Handler, ), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+import logging
+import os
+import threading
+import time
+import typing
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+if typing.TYPE_CHECKING:
+    from faster_whisper import WhisperModel
+
+ModelKey = typing.Tuple[str, str, str]
+# Local store of CTranslate2 models, one directory per model (e.g.
+# $MODEL_DIR/large-v3/model.bin), looked up before the Hugging Face Hub.
+MODEL_DIR = os.getenv('MODEL_DIR', '')
+
+# Approximate float16 weight sizes in MB, by model family.
+MODEL_MB = {
+    'tiny': 75,
+    'base': 145,
+    'small': 485,
+    'medium': 1530,
+    'large': 3090,
+    'distil-small': 335,
+    'distil-medium': 790,
+    'distil-large': 1510,
+}
+
+
+def locate(model_size: str,
+           model_dir: typing.Optional[str] = None) -> typing.Optional[str]:
+    """ Directory of `model_size` when it is a path or in the local store
+    (as `<name>` or `faster-whisper-<name>`), None otherwise.
+    """
+    if os.path.isdir(model_size):
+        return model_size
+    model_dir = MODEL_DIR if model_dir is None else model_dir
+    if not model_dir:
+        return None
+    name = model_size.split('/')[-1]
+    for candidate in (name, 'faster-whisper-' + name):
+        path = os.path.join(model_dir, candidate)
+        if os.path.isfile(os.path.join(path, 'model.bin')):
+            return path
+    return None
+
+
+def fetch(model_size: str, model_dir: typing.Optional[str] = None) -> str:
+    """ Path of the model in the local store, downloading the converted
+    weights from the Hub into `<model_dir>/<name>` when they are missing.
+    """
+    model_dir = MODEL_DIR if model_dir is None else model_dir
+    path = locate(model_size, model_dir)
+    if path is not None:
+        return path
+    if not model_dir:
+        raise ValueError("No model directory, set MODEL_DIR")
+    from faster_whisper.utils import download_model
+    start_time = time.time()
+    path = download_model(model_size,
+                          output_dir=os.path.join(model_dir,
+                                                  model_size.split('/')[-1]))
+    logging.info('Model %s stored in %s in %.2fs', model_size, path,
+                 time.time() - start_time)
+    return path
+
+
+def load_model(model_size: str,
+               device: str = "auto",
+               compute_type: str = "default",
+               loader: typing.Optional[typing.Callable] = None,
+               model_dir: typing.Optional[str] = None,
+               **options) -> 'WhisperModel':
+    """ WhisperModel from the local store, or from the Hub when there is
+    none; with a store the weights are kept there for the next start.
+    `loader` replaces WhisperModel and gets `model_size` as is.
+    """
+    if loader is not None:
+        return loader(model_size,
+                      device=device,
+                      compute_type=compute_type,
+                      **options)
+    from faster_whisper import WhisperModel
+    model_dir = MODEL_DIR if model_dir is None else model_dir
+    path = fetch(model_size, model_dir) if model_dir else locate(model_size)
+    return WhisperModel(path or model_size,
+                        device=device,
+                        compute_type=compute_type,
+                        **options)
+
+
+def warmup_model(model: 'WhisperModel') -> None:
+    """ One inference on a second of silence, so the first real request
+    does not pay for kernel setup and allocator growth.
+    """
+    segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32),
+                                   beam_size=1)
+    for _ in segments:
+        pass
+
+
+def model_bytes(model_size: str, compute_type: str = "default") -> int:
+    """ Rough memory footprint of a model, used for the registry budget.
+    Local model directories are measured, known names looked up.
+    """
+    path = locate(model_size)
+    if path is not None:
+        return sum(
+            os.path.getsize(os.path.join(path, name))
+            for name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, name)))
+    name = model_size.split('/')[-1].replace('faster-whisper-', '')
+    family = max((f for f in MODEL_MB if name.startswith(f)),
+                 key=len,
+                 default=None)
+    size = MODEL_MB.get(family, 1000) * 1024 * 1024
+    if compute_type.startswith('int8'):
+        return size // 2
+    if compute_type == 'float32':
+        return size * 2
+    return size
+
+
+class ModelRegistry:
+    """ Process-wide store of loaded WhisperModel instances.
+
+    Models are keyed by (model_size, device, compute_type) and loaded at most
+    once. CTranslate2 models are safe to call from several threads, so the
+    same instance is handed out to every caller.
+
+    With `max_bytes` set, loading a model that would exceed the budget
+    first drops the least recently used ones. Requests already running on a
+    dropped model finish normally, its memory is freed after them.
+
+    `options` are extra WhisperModel arguments such as cpu_threads, and
+    `loader` replaces the WhisperModel class itself (benchmarks use stubs).
+    Models are looked up in the local store first, see load_model.
+    """
+
+    def __init__(self,
+                 max_bytes: int = 0,
+                 loader: typing.Optional[typing.Callable] = None,
+                 **options) -> None:
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.options = options
+        self._models: 'OrderedDict[ModelKey, WhisperModel]' = OrderedDict()
+        self._locks: typing.Dict[ModelKey, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @property
+    def loaded(self) -> typing.List[ModelKey]:
+        """ Loaded models, least recently used first. """
+        return list(self._models)
+
+    def _evict_for(self, key: ModelKey) -> None:
+        need = model_bytes(key[0], key[2])
+        with self._lock:
+            used = sum(model_bytes(k[0], k[2]) for k in self._models)
+            while self._models and used + need > self.max_bytes:
+                evicted, _ = self._models.popitem(last=False)
+                used -= model_bytes(evicted[0], evicted[2])
+                self.evictions += 1
+                logging.info('Model %s evicted to stay within %d MB',
+                             evicted, self.max_bytes // 1024 // 1024)
+
+    def _key_lock(self, key: ModelKey) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self,
+            model_size: str,
+            device: str = "auto",
+            compute_type: str = "default") -> 'WhisperModel':
+        key = (model_size, device, compute_type)
+        model = self._models.get(key)
+        if model is not None:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+            return model
+        # Per-key lock: concurrent first requests wait for one load instead
+        # of each loading their own copy of the weights.
+        with self._key_lock(key):
+            model = self._models.get(key)
+            if model is None:
+                if self.max_bytes:
+                    self._evict_for(key)
+                start_time = time.time()
+                model = load_model(model_size,
+                                   device,
+                                   compute_type,
+                                   loader=self.loader,
+                                   **self.options)
+                with self._lock:
+                    self._models[key] = model
+                logging.info('Model %s loaded in %.2fs', key,
+                             time.time() - start_time)
+        return model
+
+    def is_loaded(self,
+                  model_size: str,
+                  device: str = "auto",
+                  compute_type: str = "default") -> bool:
+        return (model_size, device, compute_type) in self._models
+
+    def warmup(self,
+               model_size: str,
+               device: str = "auto",
+               compute_type: str = "default") -> float:
+        """ Load the model and run one inference on a second of silence, so
+        the first real request does not pay for kernel setup. Returns the
+        time spent in seconds.
+        """
+        start_time = time.time()
+        warmup_model(self.get(model_size, device, compute_type))
+        return time.time() - start_time
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._locks.clear()
+
+
+def _encode(model: 'WhisperModel', features: np.ndarray):
+    """ Encoder output for a (batch, n_mels, frames) feature array.
+    WhisperModel.encode adds a batch axis of its own before 1.0, so the
+    batch goes to the CTranslate2 model directly.
+    """
+    import ctranslate2
+    # As faster-whisper: with several GPUs the next job may run elsewhere.
+    to_cpu = model.model.device == "cuda" and len(
+        model.model.device_index) > 1
+    features = np.ascontiguousarray(features, dtype=np.float32)
+    return model.model.encode(ctranslate2.StorageView.from_array(features),
+                              to_cpu=to_cpu)
+
+
+def speech(audio: np.ndarray) -> np.ndarray:
+    """ The speech in `audio`, found by faster-whisper's Silero VAD with
+    the options model.transcribe(vad_filter=True) uses by default.
+    """
+    from faster_whisper.vad import get_speech_timestamps
+    chunks = get_speech_timestamps(audio)
+    if not chunks:
+        return audio[:0]
+    return np.concatenate([audio[c['start']:c['end']] for c in chunks])
+
+
+def _compression_ratio(text: str) -> float:
+    data = text.encode('utf-8')
+    return len(data) / len(zlib.compress(data))
+
+
+def generate_batch(
+        model: 'WhisperModel',
+        audios: typing.List[np.ndarray],
+        prompt: typing.Optional[str] = None,
+        beam_size: int = 5,
+        no_speech_threshold: float = 0.6,
+        log_prob_threshold: float = -1.0,
+        compression_ratio_threshold: float = 2.4
+) -> typing.List[typing.Optional[str]]:
+    """ Transcribe several clips of at most 30 s with a single batched
+    encoder + decoder call at temperature 0. Returns one text per clip,
+    empty for clips the model considers non-speech, None for those whose
+    result model.transcribe would not accept (too repetitive or too
+    unlikely) and retry at higher temperatures.
+    """
+    from faster_whisper.tokenizer import Tokenizer
+    extractor = model.feature_extractor
+    features = np.stack([
+        extractor(np.pad(a, (0, extractor.n_samples - len(a))))
+        [:, :extractor.nb_max_frames] for a in audios
+    ])
+    encoder_output = _encode(model, features)
+
+    multilingual = model.model.is_multilingual
+    if multilingual:
+        languages = [
+            langs[0][0][2:-2]
+            for langs in model.model.detect_language(encoder_output)
+        ]
+    else:
+        languages = ['en'] * len(audios)
+
+    prompts, tokenizers = [], {}
+    for language in languages:
+        if language not in tokenizers:
+            tokenizers[language] = Tokenizer(model.hf_tokenizer,
+                                             multilingual,
+                                             task="transcribe",
+                                             language=language)
+        tokenizer = tokenizers[language]
+        previous = tokenizer.encode(' ' + prompt.strip()) if prompt else []
+        prompts.append(model.get_prompt(tokenizer,
+                                        previous_tokens=previous,
+                                        without_timestamps=True))
+
+    results = model.model.generate(encoder_output,
+                                   prompts,
+                                   beam_size=beam_size,
+                                   max_length=model.max_length,
+                                   return_scores=True,
+                                   return_no_speech_prob=True)
+    texts: typing.List[typing.Optional[str]] = []
+    for language, result in zip(languages, results):
+        tokens = result.sequences_ids[0]
+        # Same acceptance rules as faster-whisper's generate_with_fallback.
+        avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+        if result.no_speech_prob > no_speech_threshold and \
+                avg_logprob < log_prob_threshold:
+            texts.append('')
+            continue
+        text = tokenizers[language].decode(tokens)
+        if avg_logprob < log_prob_threshold or \
+                _compression_ratio(text) > compression_ratio_threshold:
+            texts.append(None)
+            continue
+        texts.append(text)
+    return texts
+
+
+def transcribe_texts(model: 'WhisperModel',
+                     items: typing.List[typing.Tuple[np.ndarray, bool]],
+                     prompt: typing.Optional[str] = None,
+                     beam_size: int = 5) -> typing.List[typing.List[str]]:
+    """ Segment texts of each (16 kHz audio, vad_filter) item, as
+    model.transcribe would give them.
+
+    Clips of at most 30 s share one generate_batch call when there are
+    several; those with vad_filter are cut down to their speech first. A
+    batch of one, longer clips and clips the batched decode did not settle
+    go through model.transcribe, with its VAD and temperature fallback.
+    """
+    results: typing.List[typing.Optional[typing.List[str]]] = \
+        [None] * len(items)
+    n_samples = model.feature_extractor.n_samples
+    batch: typing.Dict[int, np.ndarray] = {}
+    if len(items) > 1:
+        for i, (audio, vad_filter) in enumerate(items):
+            if len(audio) > n_samples:
+                continue
+            if vad_filter:
+                audio = speech(audio)
+                if not len(audio):
+                    results[i] = []  # no speech, no segments
+                    continue
+            batch[i] = audio
+    if batch:
+        texts = generate_batch(model,
+                               list(batch.values()),
+                               prompt=prompt,
+                               beam_size=beam_size)
+        for i, t in zip(batch, texts):
+            if t is not None:
+                results[i] = [t]
+    for i, (audio, vad_filter) in enumerate(items):
+        if results[i] is None:
+            segments, _ = model.transcribe(audio,
+                                           beam_size=beam_size,
+                                           initial_prompt=prompt,
+                                           vad_filter=vad_filter)
+            results[i] = [s.text for s in segments]
+    return results
+
+
+class Router:
+    """ Picks the model for a request.
+
+    Args:
+        default: model used when the request names none (or "whisper-1").
+        models: model names a request may ask for.
+        fallbacks: model -> cheaper model to use under load.
+        slo: queue wait in seconds beyond which a request moves to the
+            fallback, 0 disables fallback.
+    """
+
+    def __init__(self,
+                 default: str,
+                 models: typing.Iterable[str] = (),
+                 fallbacks: typing.Optional[typing.Dict[str, str]] = None,
+                 slo: float = 0.0) -> None:
+        self.default = default
+        self.fallbacks = fallbacks or {}
+        self.models = set(models) | {default} | set(self.fallbacks.values())
+        self.slo = slo
+        self.degraded = 0  # requests moved to a fallback
+
+    def resolve(self, requested: typing.Optional[str]) -> str:
+        """ Model named by the request, ValueError when it is not served.
+        """
+        if not requested or requested == 'whisper-1':
+            return self.default
+        if requested not in self.models:
+            raise ValueError(
+                f"model must be one of {sorted(self.models)}")
+        return requested
+
+    def degrade(self, model: str,
+                wait: typing.Callable[[str], float]) -> str:
+        """ Follow the fallback chain while `wait(model)` exceeds the SLO.
+        """
+        seen = {model}
+        while self.slo and wait(model) > self.slo:
+            fallback = self.fallbacks.get(model)
+            if fallback is None or fallback in seen:
+                break
+            logging.info('Queue wait on %s over %.2fs, using %s', model,
+                         self.slo, fallback)
+            model = fallback
+            seen.add(model)
+            self.degraded += 1
+        return model
+
+
+def parse_fallbacks(spec: str) -> typing.Dict[str, str]:
+    """ "large-v3:small,medium:base" -> {"large-v3": "small", ...} """
+    pairs = [item.split(':', 1) for item in spec.split(',') if ':' in item]
+    return {src.strip(): dst.strip() for src, dst in pairs}
+
+
+registry = ModelRegistry()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Text post-processing (punctuation restoration and the like) as its own
+pipeline stage.
+
+A PostProcessor maps a batch of texts to a batch of texts. PostStage runs
+one on a dedicated thread: the recognizer submits each utterance's
+segments and moves on, the stage takes every utterance queued at that
+point, makes one batched call for all of them and hands the results to a
+sink in submission order. Utterances pile up while a slow sink (a chat
+reply, say) runs, and are then processed in a single call.
+"""
+import logging
+import queue
+import threading
+import time
+import typing
+
+
+class PostProcessor:
+    """ Base class, texts in, as many texts out. """
+
+    def __call__(self, texts: typing.List[str]) -> typing.List[str]:
+        raise NotImplementedError
+
+
+class StubPunctuation(PostProcessor):
+    """ Stand-in for tests and benchmarks: ends every text with "。", after
+    sleeping `latency` seconds per call plus `per_text` per text, the cost
+    profile of a real model. """
+
+    def __init__(self, latency: float = 0.0, per_text: float = 0.0) -> None:
+        self.latency = latency
+        self.per_text = per_text
+        self.calls = 0
+
+    def __call__(self, texts: typing.List[str]) -> typing.List[str]:
+        self.calls += 1
+        time.sleep(self.latency + self.per_text * len(texts))
+        return [t.rstrip('。') + '。' if t.strip() else t for t in texts]
+
+
+class FunASRPunctuation(PostProcessor):
+    """ FunASR punctuation model, e.g. ct-punc, loaded when constructed.
+
+    ct-punc takes one text per `generate` call, so texts are not batched
+    further; PostStage already hands it each utterance as one text, which
+    also gives the model context across segment boundaries.
+    """
+
+    def __init__(self, model: str = 'ct-punc', **kwargs) -> None:
+        from funasr import AutoModel
+        self.model = AutoModel(model=model, **kwargs)
+
+    def __call__(self, texts: typing.List[str]) -> typing.List[str]:
+        return [
+            self.model.generate(input=t)[0]['text'] if t.strip() else t
+            for t in texts
+        ]
+
+
+class _Job(typing.NamedTuple):
+    segments: typing.List[str]
+    meta: typing.Any
+
+
+class PostStage:
+    """ Runs a PostProcessor on its own thread.
+
+    Args:
+        processor: called with one text per utterance, its segments joined
+            with `separator`.
+        sink: receives (text, meta) for every utterance, in submission
+            order, on the stage thread.
+        max_batch: utterances per processor call.
+    """
+
+    def __init__(self,
+                 processor: PostProcessor,
+                 sink: typing.Callable[[str, typing.Any], None],
+                 max_batch: int = 32,
+                 separator: str = '') -> None:
+        self.processor = processor
+        self.sink = sink
+        self.max_batch = max_batch
+        self.separator = separator
+        self._queue: 'queue.Queue[typing.Optional[_Job]]' = queue.Queue()
+        self._thread: typing.Optional[threading.Thread] = None
+        self.batches = 0
+        self.utterances = 0
+
+    def submit(self,
+               segments: typing.List[str],
+               meta: typing.Any = None) -> None:
+        """ Queue one utterance's segments, returns immediately. """
+        self._queue.put(_Job(segments, meta))
+
+    def _collect(self) -> typing.Tuple[typing.List[_Job], bool]:
+        job = self._queue.get()
+        if job is None:
+            return [], True
+        jobs = [job]
+        while len(jobs) < self.max_batch:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return jobs, True
+            jobs.append(job)
+        return jobs, False
+
+    def _run(self) -> None:
+        done = False
+        while not done:
+            jobs, done = self._collect()
+            if not jobs:
+                continue
+            texts = [self.separator.join(job.segments) for job in jobs]
+            try:
+                texts = self.processor(texts)
+            except Exception as e:
+                # Better unpunctuated text than none.
+                logging.error(e, exc_info=True)
+            self.batches += 1
+            self.utterances += len(jobs)
+            for job, text in zip(jobs, texts):
+                try:
+                    self.sink(text, job.meta)
+                except Exception as e:
+                    logging.error(e, exc_info=True)
+
+    def start(self) -> 'PostStage':
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """ Processes what is queued, then stops. """
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'PostStage':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
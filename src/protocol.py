@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Binary frame format for client -> server audio transport.
+
+    magic     4s  b'SWPC'
+    version   B
+    codec     B   0 = raw, 1 = zlib
+    channels  B
+    width     B   sample width in bytes, 2 for int16
+    rate      I   sample rate in Hz
+    sequence  I   per-client utterance counter
+    timestamp d   capture time, seconds since epoch
+    length    I   payload size in bytes
+
+All fields are little-endian and followed by the (possibly compressed)
+little-endian int16 PCM payload.
+"""
+import struct
+import typing
+import zlib
+
+MAGIC = b'SWPC'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBBIIdI')
+CODECS = {'raw': 0, 'zlib': 1}
+# Preference order when client and server negotiate a codec
+PREFERENCE = ('zlib', 'raw')
+# Largest payload decode inflates: 60 s of 48 kHz stereo int16
+MAX_PAYLOAD = 60 * 48000 * 2 * 2
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Header(typing.NamedTuple):
+    version: int
+    codec: str
+    channels: int
+    sample_width: int
+    sample_rate: int
+    sequence: int
+    timestamp: float
+
+
+def negotiate(client: typing.Iterable[str],
+              server: typing.Iterable[str]) -> str:
+    """ Best codec supported by both sides, falls back to raw. """
+    common = set(client) & set(server)
+    for codec in PREFERENCE:
+        if codec in common:
+            return codec
+    return 'raw'
+
+
+def encode(pcm: bytes,
+           sequence: int,
+           timestamp: float,
+           sample_rate: int = 16000,
+           channels: int = 1,
+           sample_width: int = 2,
+           codec: str = 'raw') -> bytes:
+    if codec not in CODECS:
+        raise ProtocolError(f"Unknown codec: {codec}")
+    payload = zlib.compress(pcm, 1) if codec == 'zlib' else pcm
+    header = HEADER.pack(MAGIC, VERSION, CODECS[codec], channels,
+                         sample_width, sample_rate, sequence, timestamp,
+                         len(payload))
+    return header + payload
+
+
+def is_frame(blob: bytes) -> bool:
+    return blob[:4] == MAGIC
+
+
+def decode(blob: bytes,
+           max_size: int = MAX_PAYLOAD) -> typing.Tuple[Header, bytes]:
+    """ Parse a frame, returns its header and the raw PCM payload. A zlib
+    payload that inflates beyond `max_size` bytes is refused, frames may
+    come from untrusted clients. """
+    if len(blob) < HEADER.size or not is_frame(blob):
+        raise ProtocolError("Not an audio frame")
+    (_, version, codec, channels, sample_width, sample_rate, sequence,
+     timestamp, length) = HEADER.unpack_from(blob)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported frame version: {version}")
+    names = {v: k for k, v in CODECS.items()}
+    if codec not in names:
+        raise ProtocolError(f"Unknown codec id: {codec}")
+    payload = blob[HEADER.size:HEADER.size + length]
+    if len(payload) != length:
+        raise ProtocolError("Truncated frame")
+    if names[codec] == 'zlib':
+        inflate = zlib.decompressobj()
+        try:
+            payload = inflate.decompress(payload, max_size)
+        except zlib.error as e:
+            raise ProtocolError(f"Corrupt zlib payload: {e}") from None
+        if inflate.unconsumed_tail:
+            raise ProtocolError(
+                f"Payload inflates beyond {max_size} bytes")
+    header = Header(version, names[codec], channels, sample_width,
+                    sample_rate, sequence, timestamp)
+    return header, payload
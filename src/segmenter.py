@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+import re
+import typing
+
+import numpy as np
+
+from . import vad as vads
+
+
+class Utterance(typing.NamedTuple):
+    start: float  # seconds since the first frame
+    end: float
+    pcm: bytes  # 16-bit little-endian mono PCM
+    continued: bool = False  # follows a forced cut, overlaps the previous
+
+
+def _energy(frame: bytes) -> float:
+    x = np.frombuffer(frame, dtype='<i2').astype(np.float32)
+    return float(np.dot(x, x))
+
+
+class Segmenter:
+    """ VAD endpointing over a stream of 16-bit mono PCM frames.
+
+    Recording starts once more than `start_ratio` of the last `window` frames
+    are voiced and stops once more than `stop_ratio` of the frames since then
+    (at most `window`) are unvoiced, followed by `hangover` seconds of
+    unvoiced frames. With the defaults the boundaries are those of the
+    original recorder loops. Voiced counts are kept incrementally and pre-roll audio lives in
+    a preallocated ring buffer, so each frame costs O(1).
+
+    Args:
+        sample_rate (int): 8000, 16000, 32000 or 48000.
+        frame_duration (int): 10, 20 or 30 ms, as webrtcvad requires.
+        window (int): frames in the sliding decision window.
+        start_ratio (float): voiced fraction of the window that starts an
+            utterance.
+        stop_ratio (float): unvoiced fraction of the window that ends one.
+        hangover (float): seconds of extra silence required after the stop
+            condition before the utterance is closed, a voiced frame starts
+            the count again.
+        min_duration (float): shorter utterances are discarded.
+        max_duration (float, optional): longer speech is cut at the
+            quietest frame of the last `search` seconds before this length
+            and continues in a new utterance.
+        search (float): seconds searched for the quietest frame.
+        overlap (float): seconds repeated at the start of the next
+            utterance after a forced cut, see `stitch`.
+        preroll (int, optional): frames kept before the trigger, defaults to
+            `window`.
+        vad (str or callable): a backend name from src.vad, or any
+            frame -> is_speech callable. Defaults to webrtcvad.
+        mode (int): webrtcvad aggressiveness, 0 to 3.
+    """
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 frame_duration: int = 30,
+                 window: int = 30,
+                 start_ratio: float = 0.5,
+                 stop_ratio: float = 0.5,
+                 hangover: float = 0.0,
+                 min_duration: float = 0.0,
+                 max_duration: typing.Optional[float] = None,
+                 search: float = 2.0,
+                 overlap: float = 0.2,
+                 preroll: typing.Optional[int] = None,
+                 vad: typing.Union[str, typing.Callable[[bytes], bool],
+                                   None] = None,
+                 mode: int = 1) -> None:
+        self.sample_rate = sample_rate
+        self.frame_duration = frame_duration
+        self.frame_samples = sample_rate * frame_duration // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self.window = window
+        self.start_threshold = start_ratio * window
+        self.stop_threshold = stop_ratio * window
+        self.hangover_frames = int(hangover * 1000 / frame_duration)
+        self.min_frames = int(min_duration * 1000 / frame_duration)
+        self.max_frames = (int(max_duration * 1000 / frame_duration)
+                           if max_duration else None)
+        self.search_frames = int(search * 1000 / frame_duration)
+        self.overlap_frames = int(overlap * 1000 / frame_duration)
+        if vad is None or vad == 'webrtc':
+            vad = vads.WebRTCVAD(sample_rate, mode)
+        elif isinstance(vad, str):
+            vad = vads.create(vad, sample_rate)
+        self.is_speech = vad
+
+        # Sliding window of decisions as a ring of 0/1 plus a running sum.
+        self._flags = [0] * window
+        self._flag_pos = 0
+        self._filled = 0
+        self._voiced = 0
+        # Pre-roll ring buffer, preallocated.
+        self.preroll = window if preroll is None else preroll
+        self._ring = np.zeros(self.preroll * self.frame_samples,
+                              dtype='<i2')
+        self._ring_pos = 0
+        self._ring_filled = 0
+
+        self._frames: typing.List[bytes] = []
+        # Per-frame energy since the pre-roll, only kept with max_frames.
+        self._energies: typing.List[float] = []
+        self._continued = False
+        self._pending = b''
+        self._silence = 0  # hang-over counter
+        self._index = 0  # frames seen so far
+        self._last_voiced = 0  # index of the latest voiced frame
+        self._start = 0
+        self.triggered = False
+
+    @property
+    def frame_time(self) -> float:
+        return self.frame_duration / 1000
+
+    @property
+    def trailing_silence(self) -> float:
+        """ Seconds since the last voiced frame, right after an utterance
+        closes the time it took the VAD to call the endpoint. """
+        return (self._index - self._last_voiced) * self.frame_time
+
+    def _reset_window(self) -> None:
+        self._flags = [0] * self.window
+        self._flag_pos = 0
+        self._filled = 0
+        self._voiced = 0
+
+    def _observe(self, is_speech: bool) -> None:
+        if self._filled == self.window:
+            self._voiced -= self._flags[self._flag_pos]
+        else:
+            self._filled += 1
+        self._flags[self._flag_pos] = int(is_speech)
+        self._voiced += int(is_speech)
+        self._flag_pos = (self._flag_pos + 1) % self.window
+
+    def _remember(self, frame: typing.Optional[bytes]) -> None:
+        if not self.preroll:
+            return
+        if frame is not None:
+            n = self.frame_samples
+            self._ring[self._ring_pos * n:(self._ring_pos + 1) * n] = \
+                np.frombuffer(frame, dtype='<i2')
+        self._ring_pos = (self._ring_pos + 1) % self.preroll
+        self._ring_filled = min(self._ring_filled + 1, self.preroll)
+
+    def _drain_ring(self) -> bytes:
+        n, pos = self.frame_samples, self._ring_pos
+        if self._ring_filled < self.preroll:
+            data = self._ring[:self._ring_filled * n]
+        else:
+            data = np.concatenate([self._ring[pos * n:], self._ring[:pos * n]])
+        self._ring_pos = self._ring_filled = 0
+        return data.tobytes()
+
+    def _close(self) -> typing.Optional[Utterance]:
+        pcm = b''.join(self._frames)
+        self._frames = []
+        self._energies = []
+        continued, self._continued = self._continued, False
+        start, self._start = self._start, self._index
+        if self._index - start < self.min_frames and not continued:
+            return None
+        return Utterance(round(start * self.frame_time, 3),
+                         round(self._index * self.frame_time, 3), pcm,
+                         continued)
+
+    def _split(self) -> Utterance:
+        """ Forced cut of an over-long utterance at its quietest recent
+        frame, the rest (plus the overlap) stays in the buffer.
+        """
+        n = len(self._energies)
+        search = min(self.search_frames, n - self.overlap_frames - 1)
+        cut = n
+        if search > 0:
+            window = self._energies[n - search:]
+            # The latest of equally quiet frames, to keep as much as we can.
+            quietest = search - 1 - int(np.argmin(window[::-1]))
+            cut = n - search + quietest + 1
+        keep = cut - self.overlap_frames
+        pcm = b''.join(self._frames)
+        self._frames = [pcm[keep * self.frame_bytes:]] if pcm else []
+        self._energies = self._energies[keep:]
+        start = self._start
+        self._start += keep
+        continued, self._continued = self._continued, True
+        return Utterance(round(start * self.frame_time, 3),
+                         round((start + cut) * self.frame_time, 3),
+                         pcm[:cut * self.frame_bytes], continued)
+
+    def push(self, frame: bytes) -> typing.Optional[Utterance]:
+        """ Feed exactly one frame, returns an utterance when one ends. """
+        return self.step(frame, self.is_speech(frame))
+
+    def step(self,
+             frame: typing.Optional[bytes],
+             is_speech: bool,
+             energy: typing.Optional[float] = None
+             ) -> typing.Optional[Utterance]:
+        """ Like push, with the VAD decision already made. With frame=None
+        only boundaries are tracked and utterances carry no audio, pass the
+        frame `energy` then to get quiet cut points with max_duration.
+        """
+        self._index += 1
+        if is_speech:
+            self._last_voiced = self._index
+        self._observe(is_speech)
+        if self.max_frames:
+            if energy is None:
+                energy = 0.0 if frame is None else _energy(frame)
+            self._energies.append(energy)
+        if not self.triggered:
+            if self._voiced > self.start_threshold:
+                self.triggered = True
+                self._start = self._index - self._ring_filled - 1
+                if self._energies:
+                    del self._energies[:-(self._ring_filled + 1)]
+                preroll = self._drain_ring()
+                self._frames = [] if frame is None else [preroll, frame]
+                self._silence = 0
+                self._reset_window()
+            else:
+                self._remember(frame)
+                if len(self._energies) > 2 * self.preroll + 2:
+                    del self._energies[:-(self.preroll + 1)]
+            return None
+
+        if frame is not None:
+            self._frames.append(frame)
+        length = self._index - self._start
+        if self.max_frames and length >= self.max_frames:
+            # Keep recording, the speech continues in a new utterance.
+            return self._split()
+        if self._filled - self._voiced <= self.stop_threshold or (
+                is_speech and self.hangover_frames):
+            self._silence = 0
+            return None
+        self._silence += 1
+        if self._silence > self.hangover_frames:
+            # The window is kept, as the old loops did: the voiced frames
+            # in it still count towards the next trigger.
+            self.triggered = False
+            return self._close()
+        return None
+
+    def feed(self, pcm: bytes) -> typing.List[Utterance]:
+        """ Feed PCM of any length, returns the utterances that ended. """
+        data = self._pending + pcm
+        n = len(data) // self.frame_bytes * self.frame_bytes
+        self._pending = data[n:]
+        utterances = []
+        for i in range(0, n, self.frame_bytes):
+            utterance = self.push(data[i:i + self.frame_bytes])
+            if utterance is not None:
+                utterances.append(utterance)
+        return utterances
+
+    def flush(self) -> typing.Optional[Utterance]:
+        """ End of stream, returns the utterance in progress if any. """
+        self._pending = b''
+        if not self.triggered:
+            return None
+        self.triggered = False
+        self._reset_window()
+        return self._close()
+
+    def segment(self,
+                audio: np.ndarray,
+                flags: typing.Optional[np.ndarray] = None
+                ) -> typing.List[Utterance]:
+        """ Offline mode: segment a whole recording in one pass.
+
+        Args:
+            audio: int16 samples, or float32 in [-1, 1].
+            flags: per-frame VAD decisions, computed here when omitted.
+        """
+        if audio.dtype != np.int16:
+            audio = (np.clip(audio, -1, 1) * 32767).astype('<i2')
+        n = len(audio) // self.frame_samples
+        frames = audio[:n * self.frame_samples].reshape(n, -1)
+        energies = [None] * n
+        if self.max_frames:
+            x = frames.astype(np.float32)
+            energies = np.einsum('ij,ij->i', x, x).tolist()
+        if flags is None:
+            if isinstance(self.is_speech, vads.VAD):
+                flags = self.is_speech.batch(frames)
+            else:
+                flags = [self.is_speech(frame.tobytes()) for frame in frames]
+        # Boundaries only, audio is sliced once per utterance at the end.
+        bounds = []
+        for is_speech, energy in zip(flags[:n], energies):
+            utterance = self.step(None, bool(is_speech), energy)
+            if utterance is not None:
+                bounds.append(utterance)
+        utterance = self.flush()
+        if utterance is not None:
+            bounds.append(utterance)
+        utterances = []
+        for start, end, _, continued in bounds:
+            i = int(round(start / self.frame_time)) * self.frame_samples
+            j = int(round(end / self.frame_time)) * self.frame_samples
+            utterances.append(
+                Utterance(start, end, audio[i:j].tobytes(), continued))
+        return utterances
+
+
+_TOKEN = re.compile(r'[\u3400-\u9fff]|[^\W_]+')
+
+
+def stitch(previous: str, text: str, max_tokens: int = 8) -> str:
+    """ Drop the start of `text` that repeats the end of `previous`, for
+    transcripts of consecutive utterances split with an overlap. Words are
+    compared case-insensitively, CJK characters one by one.
+    """
+    head = [(m.group().lower(), m.end())
+            for m in _TOKEN.finditer(text)][:max_tokens]
+    tail = [m.group().lower() for m in _TOKEN.finditer(previous)][-max_tokens:]
+    for k in range(min(len(head), len(tail)), 0, -1):
+        if [t for t, _ in head[:k]] == tail[-k:]:
+            return re.sub(r'^[^\w\s]+', '', text[head[k - 1][1]:])
+    return text
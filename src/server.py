@@ -1,61 +1,207 @@
 import asyncio
+import functools
+import json
 import logging
 import time
 from collections import deque
 
-import aioredis
-from faster_whisper import WhisperModel
+import numpy as np
 
-from .config import REDIS_SERVER
-from .utils import asyncformer
+from . import executor, metrics, protocol
+from .audio import frame_to_float32, load_audio, SAMPLE_RATE
+from .cache import ResultCache, fingerprint
+from .consumer import (RESULT_TTL, StreamConsumer, queued_seconds,
+                       result_stream)
+from .config import redis_server
+from .inference import InferencePool
+from .models import Router, registry
 
 CONVERSATION = deque(maxlen=100)
 MODEL_SIZE = "large-v3"
+MODELS = ()  # other models a producer may name in the `model` field
+# Opt-in: chunks that waited in the stream over SLO seconds go to the cheaper
+# model, loaded on first use, e.g. {'large-v3': 'small'} with SLO = 2.0
+FALLBACKS = {}
+SLO = 0.0
+MODEL_MEMORY = 0  # bytes of loaded models before LRU eviction, 0: no limit
+DEVICE, COMPUTE_TYPE = "auto", "default"
 CN_PROMPT = '聊一下基于faster-whisper的实时/低延迟语音转写服务'
-logging.basicConfig(level=logging.INFO)
-model = WhisperModel(MODEL_SIZE, device="auto", compute_type="default")
-logging.info('Model loaded')
-
-
-async def transcribe():
-    # download audio from redis by popping from list: STS:AUDIO
-    def b_transcribe():
-        # transcribe audio to text
-        start_time = time.time()
-        segments, info = model.transcribe("chunk.mp3",
-                                          beam_size=5,
-                                          initial_prompt=CN_PROMPT)
-        end_time = time.time()
-        period = end_time - start_time
-        text = ''
-        for segment in segments:
-            t = segment.text
-            if t.strip().replace('.', ''):
-                text += ', ' + t if text else t
-        return text, period
-
-    async with aioredis.from_url(REDIS_SERVER) as redis:
-        '-' * 81
-        while True:
-            length = await redis.llen('STS:AUDIOS')
-            if length > 10:
-                await redis.expire('STS:AUDIOS', 1)
-            content = await redis.blpop('STS:AUDIOS', timeout=0.1)
-            if content is None:
-                continue
-
-            with open('chunk.mp3', 'wb') as f:
-                f.write(content[1])
-
-            text, _period = await asyncformer(b_transcribe)
-            t = text.strip().replace('.', '')
-            logging.info(t)
-            CONVERSATION.append(text)
-
-
-async def main():
-    await asyncio.gather(transcribe())
+WORKERS = 2  # chunks transcribed concurrently by this process
+# CPU-only nodes: inference in this many worker processes (0: in-process
+# threads), each with cores / PROCESSES CTranslate2 threads
+PROCESSES = 0
+MAX_BACKLOG = 10  # oldest chunks beyond this are dropped
+# Seconds before a chunk still pending is handed to another worker, above
+# the slowest transcription; a chunk is given up on after MAX_DELIVERIES
+CLAIM_IDLE = 300.0
+MAX_DELIVERIES = 3
+BEAM_SIZE = 5
+CACHE_BYTES = 64 * 1024 * 1024  # in-process result cache, 0 disables it
+# Opt-in shared tier in the queue's Redis: seconds results stay there, e.g.
+# 24 * 3600; 0 keeps results out of Redis
+CACHE_TTL = 0
+METRICS_PORT = 9100  # Prometheus /metrics of this worker, 0 disables it
+# Nothing is loaded at import: the PROCESSES workers import this module
+# again on spawn, and tools import it for its functions.
+pool = None  # InferencePool with PROCESSES, started by transcribe
+router = Router(MODEL_SIZE, MODELS, FALLBACKS, SLO)
+
+
+def b_transcribe(audio: np.ndarray,
+                 vad_filter: bool = False,
+                 model_size: str = MODEL_SIZE):
+    # transcribe audio to text
+    start_time = time.time()
+    options = dict(beam_size=BEAM_SIZE,
+                   initial_prompt=CN_PROMPT,
+                   vad_filter=vad_filter)
+    if pool is not None:
+        segments, info = pool.transcribe(model_size, audio, **options)
+    else:
+        model = registry.get(model_size, DEVICE, COMPUTE_TYPE)
+        segments, info = model.transcribe(audio, **options)
+    kept = []
+    for segment in segments:
+        t = segment.text
+        if t.strip().replace('.', ''):
+            kept.append({
+                'start': round(segment.start, 2),
+                'end': round(segment.end, 2),
+                'text': t
+            })
+    end_time = time.time()
+    period = end_time - start_time
+    metrics.observe_inference(period, len(audio) / SAMPLE_RATE, len(kept))
+    return kept, period
+
+
+async def publish(redis, session: str, result: dict):
+    # One round trip: append to the session's result stream and refresh TTL.
+    key = result_stream(session)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.xadd(key, {'result': json.dumps(result, ensure_ascii=False)},
+                  maxlen=100)
+        pipe.expire(key, RESULT_TTL)
+        await pipe.execute()
+
+
+async def process(redis, cache: ResultCache, entry_id: bytes,
+                  fields: dict):
+    # Decode in memory, no temp file, so chunks can overlap.
+    blob = fields[b'audio']
+    header = None
+    if protocol.is_frame(blob):
+        header, pcm = protocol.decode(blob)
+        audio = await executor.cpu_pool.run(
+            metrics.timed(frame_to_float32, 'decode'), header, pcm)
+    else:
+        audio = await executor.cpu_pool.run(
+            metrics.timed(load_audio, 'decode'), blob)
+    # Audio a client has segmented with its own VAD skips the second pass.
+    vad_filter = b'vad' not in fields
+    try:
+        model_size = router.resolve(fields.get(b'model', b'').decode())
+    except ValueError as e:
+        logging.warning('{}, using {}'.format(e, MODEL_SIZE))
+        model_size = MODEL_SIZE
+    # Measured on the server side, client clocks may be off by any amount.
+    waited = queued_seconds(entry_id)
+    model_size = router.degrade(model_size, lambda _: waited)
+    # Retried uploads hit the cache however they were encoded.
+    key = await executor.cpu_pool.run(fingerprint,
+                                      audio,
+                                      model=model_size,
+                                      prompt=CN_PROMPT,
+                                      language=None,
+                                      beam_size=BEAM_SIZE,
+                                      vad_filter=vad_filter)
+    segments, period = await cache.get(key), 0.0
+    if segments is None:
+        segments, period = await executor.cpu_pool.run(
+            b_transcribe, audio, vad_filter, model_size)
+        await cache.set(key, segments)
+    else:
+        logging.info('Result cache hit {}'.format(cache.stats()))
+    text = ', '.join(seg['text'] for seg in segments)
+    t = text.strip().replace('.', '')
+    logging.info(t)
+    CONVERSATION.append(text)
+
+    session = fields.get(b'session')
+    if session is None:
+        return
+    result = {
+        'text': text,
+        'segments': segments,
+        'inference': period,
+        'model': model_size
+    }
+    if header is not None:
+        # Capture clock is the client's, assumed to be roughly in sync.
+        duration = len(audio) / SAMPLE_RATE
+        result['sequence'] = header.sequence
+        result['latency'] = time.time() - header.timestamp - duration
+        metrics.STAGE_SECONDS.observe(result['latency'], stage='total')
+    await publish(redis, session.decode(), result)
+
+
+async def load(preload: bool = True):
+    # Load the model before consuming, warmed up by one inference with
+    # preload; otherwise the first chunk loads it.
+    global pool
+    registry.max_bytes = MODEL_MEMORY
+    if PROCESSES:
+        # The workers load their own copies.
+        pool = InferencePool(PROCESSES,
+                             DEVICE,
+                             COMPUTE_TYPE,
+                             max_bytes=MODEL_MEMORY)
+        await executor.io_pool.run(pool.start,
+                                   [MODEL_SIZE] if preload else [])
+    elif preload:
+        period = await executor.io_pool.run(registry.warmup, MODEL_SIZE,
+                                            DEVICE, COMPUTE_TYPE)
+        logging.info('Model loaded and warmed up in {:.2f}s'.format(period))
+
+
+async def transcribe(preload: bool = True):
+    # consume audio chunks from the redis stream STS:AUDIO_STREAM
+    import aioredis
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    await load(preload)
+    async with aioredis.from_url(redis_server()) as redis:
+        # Advertise the frame codecs this server can decode.
+        await redis.sadd('STS:CODECS', *protocol.CODECS)
+        cache = ResultCache(CACHE_BYTES,
+                            redis=redis if CACHE_TTL else None,
+                            ttl=CACHE_TTL)
+        consumer = StreamConsumer(redis,
+                                  functools.partial(process, redis, cache),
+                                  workers=max(WORKERS, PROCESSES),
+                                  max_backlog=MAX_BACKLOG,
+                                  claim_idle=CLAIM_IDLE,
+                                  max_deliveries=MAX_DELIVERIES)
+        await consumer.run()
+
+
+async def main(preload: bool = True):
+    try:
+        await asyncio.gather(transcribe(preload))
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+        executor.shutdown(wait=False)
+
+
+def api(preload: bool = True):
+    """ Consume audio chunks from Redis. The model is loaded and warmed up
+    before the first chunk, `--nopreload` leaves it to the first chunk.
+    """
+    logging.basicConfig(level=logging.INFO)
+    return asyncio.run(main(preload))
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    import fire
+    fire.Fire(api)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Streaming transcription with the LocalAgreement policy.
+
+The growing audio buffer is re-transcribed every step. Words on which two
+consecutive hypotheses agree are committed ("final"), the rest is shown as
+"partial" and may still change. Once committed, audio before the end of a
+finished segment is cut from the buffer so each step stays bounded.
+"""
+import re
+import typing
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+class Word(typing.NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+class Event(typing.NamedTuple):
+    kind: str  # 'partial' or 'final'
+    start: float
+    end: float
+    text: str
+
+
+# (audio, context) -> segments, each a list of words timed from audio start
+TranscribeFn = typing.Callable[[np.ndarray, str], typing.List[typing.List[Word]]]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'[^\w]', '', text.lower())
+
+
+class HypothesisBuffer:
+    """ LocalAgreement-2: commit the longest common prefix of the last two
+    hypotheses, ignoring words that were already committed.
+    """
+
+    def __init__(self, overlap: int = 5) -> None:
+        self.overlap = overlap
+        self.committed_end = 0.0
+        self.previous: typing.List[Word] = []
+        self._current: typing.List[Word] = []
+        self._tail: typing.List[Word] = []
+
+    def insert(self, words: typing.List[Word]) -> None:
+        # Words before the committed point have been emitted already.
+        words = [w for w in words if w.start >= self.committed_end - 0.1]
+        # Whisper may repeat the last committed words at the buffer start.
+        for n in range(min(self.overlap, len(words), len(self._tail)), 0, -1):
+            head = [_normalize(w.text) for w in words[:n]]
+            tail = [_normalize(w.text) for w in self._tail[-n:]]
+            if head == tail:
+                words = words[n:]
+                break
+        self._current = words
+
+    def flush(self) -> typing.List[Word]:
+        commit = []
+        for a, b in zip(self.previous, self._current):
+            if _normalize(a.text) != _normalize(b.text):
+                break
+            commit.append(b)
+        self.previous = self._current[len(commit):]
+        if commit:
+            self.committed_end = commit[-1].end
+            self._tail = (self._tail + commit)[-self.overlap:]
+        return commit
+
+    def clear(self) -> typing.List[Word]:
+        pending, self.previous, self._current = self.previous, [], []
+        if pending:
+            self.committed_end = pending[-1].end
+            self._tail = (self._tail + pending)[-self.overlap:]
+        return pending
+
+
+def _event(kind: str, words: typing.List[Word]) -> Event:
+    return Event(kind, words[0].start, words[-1].end,
+                 ''.join(w.text for w in words))
+
+
+class StreamingTranscriber:
+    """ Incremental transcription of a live audio stream.
+
+    Args:
+        transcribe: model call, see TranscribeFn. Word times are relative
+            to the start of the audio passed in.
+        max_buffer: seconds of audio kept before the buffer is cut at the
+            end of the last committed segment.
+        sample_rate: sample rate of the inserted audio.
+    """
+
+    def __init__(self,
+                 transcribe: TranscribeFn,
+                 max_buffer: float = 15.0,
+                 sample_rate: int = SAMPLE_RATE) -> None:
+        self.transcribe = transcribe
+        self.max_buffer = max_buffer
+        self.sample_rate = sample_rate
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.offset = 0.0  # stream time of buffer[0], in seconds
+        self.hypothesis = HypothesisBuffer()
+        self.committed: typing.List[Word] = []
+
+    @property
+    def buffer_duration(self) -> float:
+        return len(self.buffer) / self.sample_rate
+
+    def insert_audio(self, audio: np.ndarray) -> None:
+        self.buffer = np.concatenate([self.buffer, audio])
+
+    def process(self) -> typing.List[Event]:
+        """ Re-transcribe the buffer, returns the new final event (if any)
+        followed by the current partial event (if any).
+        """
+        if not len(self.buffer):
+            return []
+        context = ''.join(w.text for w in self.committed)[-200:]
+        segments = self.transcribe(self.buffer, context)
+        segments = [[
+            Word(w.start + self.offset, w.end + self.offset, w.text)
+            for w in seg
+        ] for seg in segments]
+        self.hypothesis.insert([w for seg in segments for w in seg])
+        commit = self.hypothesis.flush()
+        self.committed.extend(commit)
+
+        events = []
+        if commit:
+            events.append(_event('final', commit))
+        if self.hypothesis.previous:
+            events.append(_event('partial', self.hypothesis.previous))
+        self._trim(segments)
+        return events
+
+    def finish(self) -> typing.List[Event]:
+        """ End of stream, commit whatever is pending. """
+        pending = self.hypothesis.clear()
+        self.committed.extend(pending)
+        self._cut(self.offset + self.buffer_duration)
+        return [_event('final', pending)] if pending else []
+
+    def _trim(self, segments: typing.List[typing.List[Word]]) -> None:
+        if self.buffer_duration <= self.max_buffer:
+            return
+        committed_end = self.hypothesis.committed_end
+        # The last segment may still grow, only cut after earlier ones.
+        ends = [seg[-1].end for seg in segments[:-1] if seg]
+        ends = [end for end in ends if end <= committed_end]
+        if ends:
+            self._cut(ends[-1])
+        elif self.buffer_duration > 2 * self.max_buffer:
+            # No segment boundary to cut at, fall back to the committed word.
+            self._cut(committed_end)
+
+    def _cut(self, timestamp: float) -> None:
+        samples = int((timestamp - self.offset) * self.sample_rate)
+        if samples <= 0:
+            return
+        self.buffer = self.buffer[samples:]
+        self.offset += samples / self.sample_rate
+
+
+def whisper_words(model, prompt: str = '', **kwargs) -> TranscribeFn:
+    """ TranscribeFn backed by a faster-whisper WhisperModel. """
+
+    def transcribe(audio: np.ndarray,
+                   context: str) -> typing.List[typing.List[Word]]:
+        segments, _ = model.transcribe(audio,
+                                       initial_prompt=(prompt + context)
+                                       or None,
+                                       word_timestamps=True,
+                                       condition_on_previous_text=False,
+                                       **kwargs)
+        return [[Word(w.start, w.end, w.word) for w in segment.words]
+                for segment in segments]
+
+    return transcribe
@@ -1,10 +1,11 @@
 #!/usr/bin/env python
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Any
 
+from .executor import io_pool
+
 
 async def asyncformer(sync_func: Callable, *args, **kwargs) -> Any:
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(pool, sync_func, *args, **kwargs)
+    """ Run a blocking function on the shared I/O pool, CPU-bound work should
+    go through executor.cpu_pool instead.
+    """
+    return await io_pool.run(sync_func, *args, **kwargs)
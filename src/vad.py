@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Frame-level voice activity detectors behind one interface.
+
+A detector is called with one frame of 16-bit mono PCM and returns whether
+it holds speech; `batch` scores the next n frames of the same stream at
+once, which is how the offline segmenter and the energy/Silero backends
+amortise their per-call overhead.
+
+    webrtc  webrtcvad, the default, modes 0-3
+    energy  NumPy energy + zero-crossing rate, no native dependency
+    silero  Silero VAD on onnxruntime (CPU), the model bundled with
+            faster-whisper is used unless a path is given
+"""
+import glob
+import os
+import typing
+
+import numpy as np
+
+BACKENDS = ('webrtc', 'energy', 'silero')
+
+
+class VAD:
+    """ Base class, subclasses implement `batch`. """
+
+    name = ''
+
+    def __init__(self, sample_rate: int = 16000) -> None:
+        self.sample_rate = sample_rate
+
+    def __call__(self, frame: bytes) -> bool:
+        return bool(self.batch(np.frombuffer(frame, dtype='<i2')[None])[0])
+
+    def batch(self, frames: np.ndarray) -> np.ndarray:
+        """ frames: (n, samples) int16, consecutive. Returns n booleans. """
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        """ Forget any state carried between calls. """
+
+
+class WebRTCVAD(VAD):
+    name = 'webrtc'
+
+    def __init__(self, sample_rate: int = 16000, mode: int = 1) -> None:
+        import webrtcvad
+        super().__init__(sample_rate)
+        self.mode = mode
+        self._factory = webrtcvad.Vad
+        self.reset()
+
+    def reset(self) -> None:
+        self._vad = self._factory(self.mode)
+
+    def __call__(self, frame: bytes) -> bool:
+        return self._vad.is_speech(frame, self.sample_rate)
+
+    def batch(self, frames: np.ndarray) -> np.ndarray:
+        return np.array([self(frame.tobytes()) for frame in frames],
+                        dtype=bool)
+
+
+class EnergyVAD(VAD):
+    """ Speech is loud enough and not noise-like: frame level above
+    `threshold` dBFS with a zero-crossing rate below `max_zcr`, or more than
+    `loud` dB above the threshold regardless of ZCR (fricatives).
+    """
+
+    name = 'energy'
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 threshold: float = -40.0,
+                 max_zcr: float = 0.25,
+                 loud: float = 15.0) -> None:
+        super().__init__(sample_rate)
+        self.threshold = threshold
+        self.max_zcr = max_zcr
+        self.loud = loud
+
+    def batch(self, frames: np.ndarray) -> np.ndarray:
+        x = frames.astype(np.float32) / 32768.0
+        power = np.mean(x * x, axis=1)
+        level = 10 * np.log10(power + 1e-10)
+        signs = np.signbit(x)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1],
+                               axis=1) / frames.shape[1]
+        return (level > self.threshold) & ((zcr < self.max_zcr) |
+                                           (level > self.threshold + self.loud))
+
+
+class SileroVAD(VAD):
+    """ Silero VAD on onnxruntime. Frames are regrouped into the model's
+    512-sample windows (16 kHz) and each frame takes the probability of the
+    last window that ends inside it. The recurrent state is carried across
+    calls, so `batch` must be given consecutive frames of one stream.
+    """
+
+    name = 'silero'
+    window = 512
+    context = 64
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 threshold: float = 0.5,
+                 path: typing.Optional[str] = None) -> None:
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(
+                "The silero VAD backend requires onnxruntime") from e
+        if sample_rate != 16000:
+            raise ValueError("The silero VAD backend expects 16 kHz audio")
+        super().__init__(sample_rate)
+        self.threshold = threshold
+        if path is None:
+            from faster_whisper.utils import get_assets_path
+            found = sorted(glob.glob(os.path.join(get_assets_path(),
+                                                  'silero_vad*.onnx')))
+            if not found:
+                raise RuntimeError("No Silero model found, pass `path`")
+            path = found[-1]
+        opts = onnxruntime.SessionOptions()
+        opts.inter_op_num_threads = 1
+        opts.intra_op_num_threads = 1
+        opts.log_severity_level = 4
+        self.session = onnxruntime.InferenceSession(
+            path, providers=['CPUExecutionProvider'], sess_options=opts)
+        inputs = {i.name: i for i in self.session.get_inputs()}
+        # faster-whisper < 1.0 ships v4 (one window per call, takes `sr`),
+        # later versions a model that runs a whole sequence of windows.
+        self._sequential = 'sr' in inputs
+        self._state_shape = [d if isinstance(d, int) else 1
+                             for d in inputs['h'].shape]
+        self.reset()
+
+    def reset(self) -> None:
+        self._h = np.zeros(self._state_shape, dtype=np.float32)
+        self._c = np.zeros(self._state_shape, dtype=np.float32)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._tail = np.zeros(self.context, dtype=np.float32)
+        self._prob = 0.0
+
+    def _run(self, windows: np.ndarray) -> np.ndarray:
+        if self._sequential:
+            probs = np.empty(len(windows), dtype=np.float32)
+            sr = np.array(self.sample_rate, dtype=np.int64)
+            for i, window in enumerate(windows):
+                out, self._h, self._c = self.session.run(
+                    None, {'input': window[None], 'sr': sr,
+                           'h': self._h, 'c': self._c})
+                probs[i] = out.ravel()[0]
+            return probs
+        # Each window is preceded by the last samples of the previous one.
+        previous = np.concatenate([self._tail[None],
+                                   windows[:-1, -self.context:]])
+        out, self._h, self._c = self.session.run(
+            None, {'input': np.concatenate([previous, windows], axis=1),
+                   'h': self._h, 'c': self._c})
+        self._tail = windows[-1, -self.context:]
+        return out.ravel()
+
+    def batch(self, frames: np.ndarray) -> np.ndarray:
+        n, size = frames.shape
+        audio = np.concatenate([self._pending,
+                                frames.ravel().astype(np.float32) / 32768.0])
+        offset = len(self._pending)
+        count = len(audio) // self.window
+        self._pending = audio[count * self.window:]
+        probs = np.full(n, self._prob, dtype=np.float32)
+        if count:
+            scores = self._run(audio[:count * self.window].reshape(
+                count, self.window))
+            ends = offset + np.arange(1, n + 1) * size
+            last = ends // self.window - 1
+            probs = np.where(last >= 0, scores[np.maximum(last, 0)], probs)
+            self._prob = float(scores[-1])
+        return probs > self.threshold
+
+
+def create(name: str = 'webrtc', sample_rate: int = 16000, **kwargs) -> VAD:
+    """ Instantiate a backend by name, kwargs go to its constructor. """
+    backends = {cls.name: cls for cls in (WebRTCVAD, EnergyVAD, SileroVAD)}
+    if name not in backends:
+        raise ValueError(f"Unknown VAD backend {name!r}, "
+                         f"expected one of {BACKENDS}")
+    return backends[name](sample_rate, **kwargs)
@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+import pytest
+
+RATE = 16000
+
+
+def _build_whisper(path: str, seed: int = 0) -> None:
+    """ A CTranslate2 Whisper model with two layers of random weights and
+    a word-level tokenizer: the real faster-whisper code paths, in a
+    fraction of a second, without the network. The vocabulary has the
+    multilingual layout (language tokens, timestamps), so language
+    detection runs too.
+    """
+    from ctranslate2.specs import whisper_spec
+    from faster_whisper.tokenizer import _LANGUAGE_CODES
+    from tokenizers import Tokenizer, models, pre_tokenizers
+
+    dim, ffn_dim, layers, heads = 64, 128, 2, 2
+    words = [chr(c) for c in range(ord('a'), ord('z') + 1)] + ['-', '.']
+    # CTranslate2 takes a model as multilingual when the vocabulary has the
+    # empty token, which GPT-2's byte-level vocabulary always has.
+    words += ['w%d' % i for i in range(50256 - len(words))] + ['']
+    vocab = words + ['<|endoftext|>', '<|startoftranscript|>']
+    # English first, as in Whisper's own vocabulary.
+    languages = ['en'] + [c for c in _LANGUAGE_CODES if c != 'en']
+    vocab += ['<|%s|>' % code for code in languages]
+    vocab += [
+        '<|translate|>', '<|transcribe|>', '<|startoflm|>', '<|startofprev|>',
+        '<|nospeech|>', '<|notimestamps|>'
+    ]
+    vocab += ['<|%.2f|>' % (i * 0.02) for i in range(1501)]
+    rng = np.random.default_rng(seed)
+
+    def weight(*shape) -> np.ndarray:
+        return (0.2 * rng.standard_normal(shape)).astype(np.float32)
+
+    def layer_norm(spec) -> None:
+        spec.gamma = np.ones(dim, np.float32)
+        spec.beta = np.zeros(dim, np.float32)
+
+    def linear(spec, n_out: int, n_in: int) -> None:
+        spec.weight = weight(n_out, n_in)
+        spec.bias = weight(n_out)
+
+    def feed_forward(spec) -> None:
+        layer_norm(spec.layer_norm)
+        linear(spec.linear_0, ffn_dim, dim)
+        linear(spec.linear_1, dim, ffn_dim)
+
+    spec = whisper_spec.WhisperSpec(layers, heads, layers, heads)
+    encoder, decoder = spec.encoder, spec.decoder
+    encoder.conv1.weight, encoder.conv1.bias = weight(dim, 80, 3), weight(dim)
+    encoder.conv2.weight, encoder.conv2.bias = weight(dim, dim, 3), weight(dim)
+    encoder.position_encodings.encodings = weight(1500, dim)
+    layer_norm(encoder.layer_norm)
+    for layer in encoder.layer:
+        layer_norm(layer.self_attention.layer_norm)
+        linear(layer.self_attention.linear[0], 3 * dim, dim)
+        linear(layer.self_attention.linear[1], dim, dim)
+        feed_forward(layer.ffn)
+    decoder.embeddings.weight = weight(len(vocab), dim)
+    decoder.position_encodings.encodings = weight(448, dim)
+    layer_norm(decoder.layer_norm)
+    decoder.projection.weight = decoder.embeddings.weight
+    decoder.projection.bias = np.zeros(len(vocab), np.float32)
+    for layer in decoder.layer:
+        layer_norm(layer.self_attention.layer_norm)
+        linear(layer.self_attention.linear[0], 3 * dim, dim)
+        linear(layer.self_attention.linear[1], dim, dim)
+        layer_norm(layer.attention.layer_norm)
+        linear(layer.attention.linear[0], dim, dim)
+        linear(layer.attention.linear[1], 2 * dim, dim)
+        linear(layer.attention.linear[2], dim, dim)
+        feed_forward(layer.ffn)
+    spec.register_vocabulary(vocab)
+    spec.config.suppress_ids = []
+    spec.config.suppress_ids_begin = [vocab.index('<|endoftext|>')]
+    spec.config.lang_ids = [
+        vocab.index('<|%s|>' % code) for code in languages
+    ]
+    spec.config.alignment_heads = [(1, 0), (1, 1)]
+    for name in ('bos_token', 'eos_token', 'unk_token'):
+        spec.config.add_attribute(name, '<|endoftext|>')
+    os.makedirs(path, exist_ok=True)
+    spec.validate()
+    spec.optimize(quantization=None)
+    spec.save(path)
+
+    tokenizer = Tokenizer(
+        models.WordLevel({t: i for i, t in enumerate(vocab)},
+                         unk_token='-'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.save(os.path.join(path, 'tokenizer.json'))
+
+
+@pytest.fixture(scope='session')
+def whisper_model(tmp_path_factory):
+    pytest.importorskip('ctranslate2')
+    pytest.importorskip('faster_whisper')
+    pytest.importorskip('tokenizers')
+    from faster_whisper import WhisperModel
+    path = str(tmp_path_factory.mktemp('whisper'))
+    _build_whisper(path)
+    return WhisperModel(path, device='cpu', compute_type='float32')
+
+
+@pytest.fixture
+def noise():
+    rng = np.random.default_rng(1)
+
+    def make(seconds: float) -> np.ndarray:
+        return (0.1 * rng.standard_normal(int(seconds * RATE))).astype(
+            np.float32)
+
+    return make
@@ -0,0 +1,83 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.cache import CACHE_PREFIX, ResultCache, fingerprint
+
+SETTINGS = dict(kind='texts', model='base', prompt='p', language=None,
+                beam_size=5, vad_filter=True)
+
+
+def _audio(seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-1, 1, 16000).astype(np.float32)
+
+
+def test_same_samples_same_key_however_they_arrive():
+    audio = _audio()
+    key = fingerprint(audio, **SETTINGS)
+    # float64, a non-contiguous view of the same samples and settings in
+    # another order all hash the same.
+    assert fingerprint(audio.astype(np.float64), **SETTINGS) == key
+    doubled = np.repeat(audio, 2)
+    assert fingerprint(doubled[::2], **SETTINGS) == key
+    assert fingerprint(audio, **dict(reversed(list(SETTINGS.items())))) \
+        == key
+
+
+@pytest.mark.parametrize('change', [
+    dict(kind='segments'),
+    dict(model='small'),
+    dict(prompt='q'),
+    dict(language='zh'),
+    dict(beam_size=1),
+    dict(vad_filter=False),
+])
+def test_every_setting_is_part_of_the_key(change):
+    audio = _audio()
+    assert fingerprint(audio, **dict(SETTINGS, **change)) != \
+        fingerprint(audio, **SETTINGS)
+
+
+def test_other_samples_other_key():
+    audio = _audio()
+    changed = audio.copy()
+    changed[-1] += 1e-3
+    keys = {fingerprint(a, **SETTINGS) for a in (audio, changed, audio[:-1])}
+    assert len(keys) == 3
+
+
+def test_local_tier_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=40)
+
+    async def main():
+        await cache.set('a', ['x' * 10])
+        await cache.set('b', ['y' * 10])
+        assert await cache.get('a') == ['x' * 10]  # a is now newest
+        await cache.set('c', ['z' * 10])
+        assert await cache.get('b') is None
+        assert await cache.get('a') is not None
+        assert await cache.get('c') is not None
+
+    asyncio.run(main())
+    assert cache.evictions == 1
+    assert cache.size <= cache.max_bytes
+
+
+def test_redis_tier_is_shared():
+    fakeredis = pytest.importorskip('fakeredis')
+
+    async def main():
+        redis = fakeredis.aioredis.FakeRedis()
+        writer = ResultCache(redis=redis, ttl=60)
+        reader = ResultCache(redis=redis)
+        key = fingerprint(_audio(), **SETTINGS)
+        await writer.set(key, ['你好'])
+        assert 0 < await redis.ttl(CACHE_PREFIX + key) <= 60
+        assert await reader.get(key) == ['你好']
+        assert await reader.get(key) == ['你好']
+        return reader.stats()
+
+    stats = asyncio.run(main())
+    assert (stats['redis_hits'], stats['hits'], stats['misses']) == (1, 1, 0)
@@ -0,0 +1,69 @@
+import threading
+import wave
+
+import numpy as np
+
+from src.capture import Capture, WavReplay
+
+
+def _pcm(start: int, n: int) -> bytes:
+    return np.arange(start, start + n, dtype='<i2').tobytes()
+
+
+def test_reads_wrap_around_the_ring():
+    capture = Capture(sample_rate=100, seconds=1.0)  # 100 samples
+    out = []
+    for i in range(10):
+        capture._push(_pcm(i * 40, 40))
+        while capture.available >= 25:
+            out.append(capture.read(25))
+    assert b''.join(out) == _pcm(0, 25 * len(out))
+    assert capture.overflows == 0
+
+
+def test_a_full_ring_drops_new_chunks():
+    capture = Capture(sample_rate=100, seconds=1.0)
+    capture._push(_pcm(0, 80))
+    capture._push(_pcm(80, 40))  # does not fit
+    assert (capture.overflows, capture.dropped) == (1, 40)
+    assert capture.read(80) == _pcm(0, 80)
+    assert capture.stats()['dropped'] == 0.4
+
+
+def test_read_timeout_counts_an_underrun():
+    capture = Capture(sample_rate=100, seconds=1.0)
+    capture._push(_pcm(0, 10))
+    assert capture.read(20, timeout=0.01) is None
+    assert capture.underruns == 1
+    assert capture.available == 10
+
+
+def test_a_blocked_reader_wakes_on_push():
+    capture = Capture(sample_rate=100, seconds=1.0)
+    result = []
+    reader = threading.Thread(
+        target=lambda: result.append(capture.read(50, timeout=5)))
+    reader.start()
+    for i in range(5):
+        capture._push(_pcm(i * 10, 10))
+    reader.join()
+    assert result == [_pcm(0, 50)]
+
+
+def test_wav_replay(tmp_path):
+    path = str(tmp_path / 'a.wav')
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(_pcm(0, 4000))
+    replay = WavReplay(path, chunk=256, speed=100.0).start()
+    out = []
+    while True:
+        data = replay.read(500, timeout=1.0)
+        if data is None:
+            break
+        out.append(data)
+    replay.stop()
+    assert b''.join(out) == _pcm(0, 4000)
+    assert replay.closed
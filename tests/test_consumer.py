@@ -0,0 +1,106 @@
+import asyncio
+import collections
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from src.consumer import StreamConsumer  # noqa: E402
+
+STREAM, GROUP = 'TEST:AUDIO', 'TEST:WORKERS'
+
+
+async def _deliver(consumer: StreamConsumer, name: str = 'w0') -> int:
+    """ One worker pass: read what is new and hand it to the consumer. """
+    response = await consumer.redis.xreadgroup(GROUP, name, {STREAM: '>'},
+                                               count=100)
+    handled = 0
+    for _, entries in response or []:
+        for entry_id, fields in entries:
+            await consumer._handle(entry_id, fields)
+            handled += 1
+    return handled
+
+
+def _run(test):
+    async def main():
+        redis = fakeredis.aioredis.FakeRedis()
+        seen = collections.Counter()
+        failing = set()
+
+        async def handler(entry_id, fields):
+            seen[fields[b'audio']] += 1
+            if fields[b'audio'] in failing:
+                raise RuntimeError('bad chunk')
+
+        consumer = StreamConsumer(redis, handler, stream=STREAM,
+                                  group=GROUP, workers=4, max_backlog=0,
+                                  claim_idle=0.0, max_deliveries=3,
+                                  dead_letter='TEST:DEAD')
+        await consumer.setup()
+        await test(redis, consumer, seen, failing)
+
+    asyncio.run(main())
+
+
+def test_handled_entries_are_acked_and_deleted():
+    async def test(redis, consumer, seen, failing):
+        for i in range(3):
+            await redis.xadd(STREAM, {'audio': str(i)})
+        assert await _deliver(consumer) == 3
+        assert await redis.xlen(STREAM) == 0
+        assert (await redis.xpending(STREAM, GROUP))['pending'] == 0
+        # Nothing pending, nothing handled twice.
+        assert await consumer.reclaim() == 0
+        assert seen == {b'0': 1, b'1': 1, b'2': 1}
+
+    _run(test)
+
+
+def test_failed_entries_are_retried_then_dead_lettered():
+    async def test(redis, consumer, seen, failing):
+        failing.add(b'bad')
+        await redis.xadd(STREAM, {'audio': 'good'})
+        bad_id = await redis.xadd(STREAM, {'audio': 'bad'})
+        await _deliver(consumer)
+        assert consumer.failed == 1
+        assert (await redis.xpending(STREAM, GROUP))['pending'] == 1
+        assert await consumer.reclaim() == 1
+        assert await consumer.reclaim() == 1
+        assert seen[b'bad'] == 3
+        # Delivered max_deliveries times: buried instead of a fourth try.
+        assert await consumer.reclaim() == 0
+        assert seen == {b'good': 1, b'bad': 3}
+        assert await redis.xlen(STREAM) == 0
+        assert (await redis.xpending(STREAM, GROUP))['pending'] == 0
+        [(_, fields)] = await redis.xrange('TEST:DEAD')
+        assert fields == {b'audio': b'bad', b'id': bad_id}
+
+    _run(test)
+
+
+def test_entries_of_a_crashed_worker_are_reclaimed():
+    async def test(redis, consumer, seen, failing):
+        for i in range(6):
+            await redis.xadd(STREAM, {'audio': str(i)})
+        # Read, never acked.
+        await redis.xreadgroup(GROUP, 'crashed', {STREAM: '>'}, count=6)
+        # At most `workers` per pass.
+        assert await consumer.reclaim() == 4
+        assert await consumer.reclaim() == 2
+        assert sorted(seen) == [str(i).encode() for i in range(6)]
+        assert max(seen.values()) == 1
+        assert await redis.xlen(STREAM) == 0
+
+    _run(test)
+
+
+def test_busy_entries_are_not_reclaimed():
+    async def test(redis, consumer, seen, failing):
+        consumer.claim_idle = 300.0
+        await redis.xadd(STREAM, {'audio': 'slow'})
+        await redis.xreadgroup(GROUP, 'busy', {STREAM: '>'}, count=1)
+        assert await consumer.reclaim() == 0
+        assert not seen
+
+    _run(test)
@@ -0,0 +1,26 @@
+import asyncio
+import concurrent.futures
+import time
+
+from src.executor import Pool
+
+
+def test_shutdown_cancels_queued_jobs():
+    pool = Pool('test', 1)
+
+    async def main():
+        jobs = [
+            asyncio.ensure_future(pool.run(time.sleep, 0.2)) for _ in range(3)
+        ]
+        await asyncio.sleep(0.05)
+        pool.shutdown()
+        return await asyncio.gather(*jobs, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert results[0] is None
+    assert all(
+        isinstance(r, (asyncio.CancelledError,
+                       concurrent.futures.CancelledError))
+        for r in results[1:])
+    assert pool.stats() == {'max_workers': 1, 'queue_depth': 0,
+                            'in_flight': 0}
@@ -0,0 +1,115 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src import longform
+from src.longform import Chunk
+from src.segmenter import stitch
+
+RATE = 16000
+
+
+@pytest.mark.parametrize('previous, text, expected', [
+    ('the quick brown', 'Brown fox', ' fox'),
+    ('今天天气', '天气很好', '很好'),
+    ('a b', ', b c', ' c'),
+    ('no overlap', 'at all', 'at all'),
+    ('', 'first', 'first'),
+])
+def test_stitch(previous, text, expected):
+    assert stitch(previous, text) == expected
+
+
+def _tone(seconds: float) -> np.ndarray:
+    t = np.arange(int(seconds * RATE)) / RATE
+    return (0.5 * np.sin(2 * np.pi * 300 * t)).astype(np.float32)
+
+
+def test_plan_cuts_at_pauses():
+    audio = _tone(70)
+    pauses = [(s + 6, s + 7) for s in range(0, 70, 7)]
+    for start, end in pauses:
+        audio[start * RATE:end * RATE] = 0
+    chunks = longform.plan(audio, RATE, vad='energy')
+    assert chunks[0].start == 0 and chunks[-1].end == 70
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert chunk.end - chunk.start <= 30
+        assert chunk.end == following.start
+        assert any(s < chunk.end < e for s, e in pauses)
+        assert not following.continued
+
+
+def test_plan_overlaps_forced_cuts():
+    chunks = longform.plan(_tone(70), RATE, vad='energy', overlap=0.2)
+    assert len(chunks) == 3
+    assert [c.continued for c in chunks] == [False, True, True]
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert chunk.end - following.start == pytest.approx(0.18)
+
+
+def _collect(audio, chunks, run, parallel=8):
+    async def main():
+        return [
+            s async for s in longform.transcribe(audio, chunks, run, parallel,
+                                                 RATE)
+        ]
+
+    return asyncio.run(main())
+
+
+def test_segments_on_the_recording_clock_in_order():
+    audio = np.zeros(60 * RATE, np.float32)
+    chunks = [Chunk(0.0, 20.0), Chunk(20.0, 45.0), Chunk(45.0, 60.0)]
+    texts = {20 * RATE: 'one', 25 * RATE: 'two', 15 * RATE: 'three'}
+    # The later chunks finish first.
+    delays = {20 * RATE: 0.03, 25 * RATE: 0.02, 15 * RATE: 0.01}
+
+    async def run(piece):
+        await asyncio.sleep(delays[len(piece)])
+        return [{"id": 0, "start": 1.0, "end": 2.0,
+                 "text": texts[len(piece)]},
+                {"id": 1, "start": 3.0, "end": 99.0, "text": '.'}]
+
+    segments = _collect(audio, chunks, run)
+    assert [s["text"] for s in segments] == \
+        ['one', '.', 'two', '.', 'three', '.']
+    assert [s["id"] for s in segments] == list(range(6))
+    assert [(s["start"], s["end"]) for s in segments] == [
+        (1.0, 2.0), (3.0, 20.0), (21.0, 22.0), (23.0, 45.0), (46.0, 47.0),
+        (48.0, 60.0)
+    ]
+
+
+def test_continued_chunks_drop_what_was_decoded_twice():
+    audio = np.zeros(40 * RATE, np.float32)
+    chunks = [Chunk(0.0, 30.0), Chunk(29.8, 40.0, continued=True)]
+
+    async def run(piece):
+        if len(piece) == 30 * RATE:
+            return [{"start": 0.0, "end": 25.0, "text": 'a b'},
+                    {"start": 25.0, "end": 29.9, "text": 'c d'}]
+        return [{"start": 0.0, "end": 0.05, "text": 'd'},
+                {"start": 0.05, "end": 2.0, "text": 'd e f'},
+                {"start": 2.0, "end": 10.2, "text": 'g'}]
+
+    segments = _collect(audio, chunks, run)
+    assert [s["text"] for s in segments] == ['a b', 'c d', ' e f', 'g']
+    assert segments[2]["start"] == 29.85
+
+
+def test_parallel_limit():
+    audio = np.zeros(10 * RATE, np.float32)
+    chunks = [Chunk(float(i), float(i + 1)) for i in range(10)]
+    running, peak = 0, 0
+
+    async def run(piece):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.005)
+        running -= 1
+        return []
+
+    assert _collect(audio, chunks, run, parallel=3) == []
+    assert peak == 3
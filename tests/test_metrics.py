@@ -0,0 +1,33 @@
+from src import metrics
+
+
+def _families(text: str) -> dict:
+    """ Sample names of each family declared by a TYPE line. """
+    families, family = {}, None
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            family = line.split()[2]
+            families[family] = []
+        elif not line.startswith('#'):
+            families[family].append(line.split('{')[0].split()[0])
+    return families
+
+
+def test_samples_belong_to_their_family():
+    registry = metrics.Registry()
+    counter = metrics.Counter('t_dropped', 'Dropped', ('reason', ),
+                              registry=registry)
+    histogram = metrics.Histogram('t_seconds', 'Seconds', buckets=(1.0, ),
+                                  registry=registry)
+    gauge = metrics.Gauge('t_depth', 'Depth', registry=registry)
+    counter.inc(reason='full')
+    histogram.observe(0.5)
+    gauge.track(lambda: 3)
+    families = _families(registry.render())
+    assert families == {
+        't_dropped_total': ['t_dropped_total'],
+        't_seconds': ['t_seconds_bucket'] * 2 + ['t_seconds_sum',
+                                                  't_seconds_count'],
+        't_depth': ['t_depth'],
+    }
+    assert '# HELP t_dropped_total Dropped' in registry.render()
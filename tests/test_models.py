@@ -0,0 +1,58 @@
+import numpy as np
+
+from src import models
+
+
+def test_generate_batch_matches_single_clips(whisper_model, noise):
+    assert whisper_model.model.is_multilingual  # detect_language runs
+    audios = [noise(1.0), noise(2.5), noise(4.0)]
+    batched = models.generate_batch(whisper_model, audios, beam_size=2)
+    assert len(batched) == 3
+    for audio, text in zip(audios, batched):
+        assert models.generate_batch(whisper_model, [audio],
+                                     beam_size=2) == [text]
+
+
+def test_generate_batch_feeds_the_encoder_a_batch(whisper_model, noise,
+                                                  monkeypatch):
+    # faster-whisper before 1.0 adds its own batch axis in encode().
+    def encode(features):
+        raise AssertionError("WhisperModel.encode is not batch safe")
+
+    monkeypatch.setattr(whisper_model, 'encode', encode)
+    assert len(models.generate_batch(whisper_model, [noise(1), noise(1)])) \
+        == 2
+
+
+def test_transcribe_texts_batch(whisper_model, noise):
+    silence = np.zeros(2 * 16000, dtype=np.float32)
+    items = [(noise(1.0), False), (silence, True), (noise(2.0), False)]
+    results = models.transcribe_texts(whisper_model, items, beam_size=2)
+    assert len(results) == 3
+    assert all(isinstance(t, str) for texts in results for t in texts)
+    # Filtered before batching, as model.transcribe would.
+    assert results[1] == []
+    segments, _ = whisper_model.transcribe(silence, vad_filter=True)
+    assert list(segments) == []
+
+
+def test_transcribe_texts_falls_back_like_transcribe(whisper_model, noise,
+                                                     monkeypatch):
+    # Batched results transcribe would not accept are decoded again by it,
+    # with its temperature fallback.
+    monkeypatch.setattr(models, 'generate_batch',
+                        lambda model, audios, **options: [None, ' b'])
+    calls = []
+    transcribe = whisper_model.transcribe
+
+    def counted(audio, **options):
+        calls.append(len(audio))
+        return transcribe(audio, **options)
+
+    monkeypatch.setattr(whisper_model, 'transcribe', counted)
+    audios = [noise(1.0), noise(2.0)]
+    results = models.transcribe_texts(whisper_model,
+                                      [(a, False) for a in audios],
+                                      beam_size=2)
+    assert calls == [len(audios[0])]
+    assert results[1] == [' b']
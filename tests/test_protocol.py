@@ -0,0 +1,94 @@
+import struct
+
+import numpy as np
+import pytest
+
+from src import protocol
+from src.audio import frame_to_float32, load_audio
+
+PCM = np.arange(-800, 800, dtype='<i2').tobytes()
+
+
+@pytest.mark.parametrize('codec', list(protocol.CODECS))
+def test_round_trip(codec):
+    blob = protocol.encode(PCM, 7, 1700000000.25, codec=codec)
+    assert protocol.is_frame(blob)
+    header, pcm = protocol.decode(blob)
+    assert pcm == PCM
+    assert header == protocol.Header(protocol.VERSION, codec, 1, 2, 16000, 7,
+                                     1700000000.25)
+
+
+def test_zlib_is_smaller_on_silence():
+    silence = bytes(32000)
+    assert len(protocol.encode(silence, 0, 0.0, codec='zlib')) < \
+        len(protocol.encode(silence, 0, 0.0)) // 10
+
+
+def test_header_layout():
+    blob = protocol.encode(PCM, 1, 2.0, sample_rate=8000, channels=2)
+    assert len(blob) == protocol.HEADER.size + len(PCM)
+    assert blob[:4] == b'SWPC'
+    # Little-endian rate right after the four one-byte fields.
+    assert struct.unpack_from('<I', blob, 8) == (8000, )
+
+
+@pytest.mark.parametrize('blob', [
+    b'RIFF' + bytes(40),
+    b'SWPC' + bytes(4),
+    protocol.encode(PCM, 0, 0.0)[:-1],
+    bytes([*b'SWPC', 9]) + protocol.encode(PCM, 0, 0.0)[5:],
+    bytes([*b'SWPC', protocol.VERSION, 7]) + protocol.encode(PCM, 0, 0.0)[6:],
+])
+def test_malformed_frames(blob):
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(blob)
+
+
+def test_zlib_bomb_is_refused():
+    # 64 MB of zeros compress to under 300 KB.
+    bomb = protocol.encode(bytes(64 * 1024 * 1024), 0, 0.0, codec='zlib')
+    assert len(bomb) < 1024 * 1024
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(bomb)
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(protocol.encode(bytes(2000), 0, 0.0, codec='zlib'),
+                        max_size=1000)
+    _, pcm = protocol.decode(
+        protocol.encode(bytes(1000), 0, 0.0, codec='zlib'), max_size=1000)
+    assert pcm == bytes(1000)
+
+
+def test_corrupt_zlib_payload():
+    blob = protocol.encode(PCM, 0, 0.0, codec='zlib')
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode(blob[:protocol.HEADER.size] +
+                        bytes(len(blob) - protocol.HEADER.size))
+
+
+def test_unknown_codec():
+    with pytest.raises(protocol.ProtocolError):
+        protocol.encode(PCM, 0, 0.0, codec='opus')
+
+
+@pytest.mark.parametrize('client, server, codec', [
+    (['raw', 'zlib'], ['zlib', 'raw'], 'zlib'),
+    (['raw'], ['zlib', 'raw'], 'raw'),
+    (['opus'], ['zlib'], 'raw'),
+    ([], [], 'raw'),
+])
+def test_negotiate(client, server, codec):
+    assert protocol.negotiate(client, server) == codec
+
+
+def test_frames_decode_to_float32():
+    stereo = np.repeat(np.frombuffer(PCM, '<i2'), 2).tobytes()
+    header, pcm = protocol.decode(
+        protocol.encode(stereo, 0, 0.0, channels=2, codec='zlib'))
+    audio = frame_to_float32(header, pcm)
+    assert audio.dtype == np.float32
+    np.testing.assert_allclose(audio,
+                               np.frombuffer(PCM, '<i2') / 32768.0,
+                               atol=1e-6)
+    np.testing.assert_array_equal(
+        load_audio(protocol.encode(PCM, 0, 0.0)), audio)
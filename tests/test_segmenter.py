@@ -0,0 +1,63 @@
+import collections
+
+import numpy as np
+import pytest
+
+from src.segmenter import Segmenter
+
+
+def _flags(frames: int, seed: int) -> np.ndarray:
+    """ Speech turns and pauses with 10% of the decisions flipped. """
+    rng = np.random.default_rng(seed)
+    flags = np.empty(frames, dtype=bool)
+    i, speech = 0, False
+    while i < frames:
+        n = int(rng.exponential(100 if speech else 50)) + 1
+        flags[i:i + n] = speech
+        i += n
+        speech = not speech
+    return flags ^ (rng.random(frames) < 0.1)
+
+
+def _legacy_ends(flags) -> list:
+    """ Frame index after each utterance of the original recorder loop. """
+    watcher = collections.deque(maxlen=30)
+    triggered, ends = False, []
+    for i, is_speech in enumerate(flags):
+        watcher.append(is_speech)
+        if not triggered:
+            if len([x for x in watcher if x]) > 0.5 * watcher.maxlen:
+                triggered = True
+                watcher.clear()
+        elif len([x for x in watcher if not x]) > 0.5 * watcher.maxlen:
+            triggered = False
+            ends.append(i + 1)
+    return ends
+
+
+def _ends(segmenter: Segmenter, flags) -> list:
+    ends = []
+    for is_speech in flags:
+        utterance = segmenter.step(None, bool(is_speech))
+        if utterance is not None:
+            ends.append(int(round(utterance.end / segmenter.frame_time)))
+    return ends
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_defaults_match_the_original_loop(seed):
+    flags = _flags(20000, seed)
+    assert _ends(Segmenter(vad=lambda frame: False), flags) == \
+        _legacy_ends(flags)
+
+
+def test_hangover_waits_for_unvoiced_frames():
+    # 1 s of speech, then silence broken by a voiced frame every 5.
+    flags = [True] * 33 + [i % 5 == 0 for i in range(60)] + [False] * 60
+    last_voiced = 33 + 55
+    plain = _ends(Segmenter(vad=lambda frame: False), flags)
+    held = _ends(Segmenter(vad=lambda frame: False, hangover=0.3), flags)
+    assert len(plain) == len(held) == 1
+    assert plain[0] < last_voiced
+    # More than 10 unvoiced frames in a row after the last voiced one.
+    assert held[0] - last_voiced > 10
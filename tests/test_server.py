@@ -0,0 +1,56 @@
+import asyncio
+import time
+import typing
+
+import numpy as np
+import pytest
+
+from src import protocol, server
+from src.cache import ResultCache
+from src.models import Router, registry
+
+
+class Info(typing.NamedTuple):
+    language: str
+    duration: float
+
+
+class FakeModel:
+    used: typing.List[str] = []
+
+    def __init__(self, model_size: str, *args, **options) -> None:
+        self.model_size = model_size
+
+    def transcribe(self, audio, **options):
+        self.used.append(self.model_size)
+        return iter([]), Info('en', len(audio) / 16000)
+
+
+@pytest.fixture
+def models(monkeypatch):
+    monkeypatch.setattr(registry, 'loader', FakeModel)
+    monkeypatch.setattr(server, 'router',
+                        Router('large-v3', (), {'large-v3': 'small'}, 2.0))
+    FakeModel.used = []
+    yield FakeModel.used
+    registry.clear()
+
+
+def _entry_id(seconds_ago: float) -> bytes:
+    return b'%d-0' % int((time.time() - seconds_ago) * 1000)
+
+
+@pytest.mark.parametrize('seconds_ago, model', [(0.0, 'large-v3'),
+                                                (10.0, 'small')])
+def test_fallback_follows_the_stream_wait(models, seconds_ago, model):
+    pcm = np.zeros(1600, '<i2').tobytes()
+    # A client clock far behind the server's is no reason to degrade.
+    fields = {b'audio': protocol.encode(pcm, 0, timestamp=0.0)}
+    asyncio.run(
+        server.process(None, ResultCache(0), _entry_id(seconds_ago), fields))
+    assert models == [model]
+
+
+def test_fallback_is_opt_in():
+    assert server.router.degrade(server.MODEL_SIZE, lambda _: 1e9) == \
+        server.MODEL_SIZE
@@ -0,0 +1,141 @@
+import io
+import typing
+import wave
+
+import numpy as np
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('av')
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from src import protocol  # noqa: E402
+from src.docker import whisper  # noqa: E402
+from src.models import registry  # noqa: E402
+
+
+class Segment(typing.NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+class Info(typing.NamedTuple):
+    language: str
+    duration: float
+
+
+class _FeatureExtractor:
+    n_samples = 0
+
+
+class FakeModel:
+    """ One segment per clip, no batched decoder. """
+
+    feature_extractor = _FeatureExtractor()
+
+    def __init__(self, model_size: str, *args, **options) -> None:
+        pass
+
+    def transcribe(self, audio, **options):
+        duration = len(audio) / whisper.SAMPLE_RATE
+        return iter([Segment(0.0, duration, ' hi')]), Info('en', duration)
+
+
+def _wav(seconds: float = 0.5) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(np.zeros(int(seconds * 16000), '<i2').tobytes())
+    return buf.getvalue()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(registry, 'loader', FakeModel)
+    monkeypatch.setattr(whisper, 'WARMUP', False)
+    monkeypatch.setattr(whisper, 'QUEUE_SIZE', 1)
+    monkeypatch.setattr(whisper, 'CACHE_MB', 0)
+    with TestClient(whisper.app) as client:
+        yield client
+
+
+@pytest.mark.parametrize('data', [
+    {'response_format': 'json'},
+    {'response_format': 'srt'},
+    {'response_format': 'verbose_json'},
+    {'stream': 'true'},
+])
+def test_every_format_is_admitted_against_the_queue(client, data):
+    release = whisper.app.state.schedulers[whisper.MODEL_SIZE].reserve()
+    files = {'file': ('a.wav', _wav())}
+    response = client.post('/v1/audio/transcriptions', files=files, data=data)
+    assert response.status_code == 429
+    release()
+    response = client.post('/v1/audio/transcriptions', files=files, data=data)
+    assert response.status_code == 200
+    assert 'hi' in response.text
+    # The slot is given back once the response is done.
+    whisper.app.state.schedulers[whisper.MODEL_SIZE].reserve()()
+
+
+@pytest.mark.parametrize('message, code', [
+    (b'SWPC' + bytes(8), 1007),  # truncated protocol frame
+    (protocol.encode(bytes(64 << 20), 0, 0.0, codec='zlib'), 1007),  # bomb
+    ('{"type": ', 1007),
+    ('[1, 2]', 1003),
+])
+def test_stream_closes_on_bad_messages(client, message, code):
+    from starlette.websockets import WebSocketDisconnect
+    with client.websocket_connect('/v1/audio/stream') as websocket:
+        if isinstance(message, bytes):
+            websocket.send_bytes(message)
+        else:
+            websocket.send_text(message)
+        with pytest.raises(WebSocketDisconnect) as e:
+            websocket.receive_json()
+    assert e.value.code == code
+
+
+def test_stream_end(client):
+    with client.websocket_connect('/v1/audio/stream') as websocket:
+        websocket.send_bytes(bytes(3200))
+        websocket.send_text('{"type": "end"}')
+        assert websocket.receive_json() == {'type': 'end'}
+
+
+class BrokenModel:
+
+    def __init__(self, model_size: str, *args, **options) -> None:
+        raise RuntimeError('no such model file')
+
+
+def _speech(seconds: float = 1.0) -> bytes:
+    t = np.arange(int(seconds * 16000)) / 16000
+    return (8000 * np.sin(2 * np.pi * 300 * t)).astype('<i2').tobytes()
+
+
+@pytest.mark.parametrize('end', [True, False])
+def test_stream_reports_a_failed_decoder(client, monkeypatch, end):
+    from starlette.websockets import WebSocketDisconnect
+    monkeypatch.setattr(whisper, 'VAD', 'energy')
+    monkeypatch.setattr(whisper, 'STREAM_QUEUE', 1)
+    registry.clear()
+    monkeypatch.setattr(registry, 'loader', BrokenModel)
+    with client.websocket_connect('/v1/audio/stream') as websocket:
+        if end:
+            websocket.send_bytes(_speech())
+            websocket.send_text('{"type": "end"}')
+        else:
+            # More utterances than the queue holds, none will be decoded.
+            for _ in range(4):
+                websocket.send_bytes(_speech() + bytes(32000))
+        event = websocket.receive_json()
+        assert event['type'] == 'error'
+        assert 'no such model file' in event['message']
+        with pytest.raises(WebSocketDisconnect) as e:
+            websocket.receive_json()
+    assert e.value.code == 1011